@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+In-process load benchmark for the hotel management API.
+
+Drives server.app through httpx's ASGI transport at a configurable concurrency
+against a local mongod, using scenario mixes that mirror how the hotel is used
+during the day. Reports throughput and p50/p95/p99 latency per route, and flags
+correctness violations such as two check-ins succeeding for the same room.
+
+Each run uses a throwaway database (dropped afterwards unless --keep-db), and
+results are written as JSON so runs can be compared between commits:
+
+    python bench_load.py --scenario checkin_rush --concurrency 50 --duration 30
+    python bench_load.py --scenario all --output bench-results/main.json
+    python bench_load.py --compare bench-results/main.json bench-results/branch.json
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+COMPANIES = ["Công ty ABC", "Công ty Hoàng Long", "Công ty Minh Phát", "Công ty Sao Việt", "Cá nhân"]
+DISHES = [("Phở bò", 50000), ("Cơm tấm", 45000), ("Bún chả", 40000), ("Bánh mì", 25000), ("Cà phê sữa", 20000),
+          ("Gỏi cuốn", 30000), ("Mì xào hải sản", 60000), ("Lẩu thái", 250000), ("Nước cam", 25000), ("Chè", 20000)]
+
+
+class RouteStats:
+    """Latencies and status codes recorded for one route"""
+
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+
+    def record(self, status, elapsed):
+        self.latencies.append(elapsed)
+        self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+        if status >= 500 or status == 0:
+            self.errors += 1
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        return {
+            "count": len(latencies),
+            "errors": self.errors,
+            "statuses": self.statuses,
+            "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "max_ms": round(latencies[-1] * 1000, 2) if latencies else None,
+        }
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile in milliseconds"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return round(sorted_values[int(rank) - 1] * 1000, 2)
+
+
+class BenchState:
+    """What the workers know about the hotel, plus the measurements"""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.empty_rooms = set()
+        self.occupied_rooms = set()
+        self.dishes = []
+        self.routes = {}
+        self.violations = []
+
+    async def request(self, client, method, route, path=None, **kwargs):
+        """Send one request and record it under its route template"""
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path or route, **kwargs)
+            status = response.status_code
+        except httpx.TransportError:
+            # Timeouts count as errors with no status code
+            response = None
+            status = 0
+        stats = self.routes.setdefault(f"{method} {route}", RouteStats())
+        stats.record(status, time.perf_counter() - started)
+        return response
+
+    def violation(self, kind, **details):
+        self.violations.append({"kind": kind, **details})
+
+
+def checkin_payload(rng):
+    return {
+        "company_name": rng.choice(COMPANIES),
+        "guests": [{"name": f"Khách {rng.randint(1, 99999)}", "id_card": f"0010{rng.randint(10**7, 10**8 - 1)}"}
+                   for _ in range(rng.randint(1, 3))],
+        "booking_type": rng.choice(["hourly", "daily", "daily", "monthly"]),
+        "duration": rng.randint(1, 3),
+    }
+
+
+# Operations (each one is a small piece of user behaviour)
+async def check_in(client, state):
+    if not state.empty_rooms:
+        return await check_out(client, state)
+    room_id = state.rng.choice(sorted(state.empty_rooms))
+    state.empty_rooms.discard(room_id)
+    response = await state.request(client, "POST", "/api/rooms/{room_id}/checkin-company",
+                                   f"/api/rooms/{room_id}/checkin-company", json=checkin_payload(state.rng))
+    if response is not None and response.status_code == 200:
+        state.occupied_rooms.add(room_id)
+    else:
+        state.empty_rooms.add(room_id)
+
+
+async def contended_check_in(client, state):
+    """Two receptionists assign the same empty room at the same moment"""
+    if not state.empty_rooms:
+        return await check_out(client, state)
+    room_id = state.rng.choice(sorted(state.empty_rooms))
+    state.empty_rooms.discard(room_id)
+    path = f"/api/rooms/{room_id}/checkin-company"
+    responses = await asyncio.gather(*[
+        state.request(client, "POST", "/api/rooms/{room_id}/checkin-company", path, json=checkin_payload(state.rng))
+        for _ in range(2)
+    ])
+    accepted = sum(1 for response in responses if response is not None and response.status_code == 200)
+    if accepted > 1:
+        state.violation("double_checkin", room_id=room_id, accepted=accepted)
+    (state.occupied_rooms if accepted else state.empty_rooms).add(room_id)
+
+
+async def check_out(client, state, contenders=1):
+    if not state.occupied_rooms:
+        return await check_in(client, state)
+    room_id = state.rng.choice(sorted(state.occupied_rooms))
+    state.occupied_rooms.discard(room_id)
+    path = f"/api/rooms/{room_id}/checkout"
+    responses = await asyncio.gather(*[
+        state.request(client, "POST", "/api/rooms/{room_id}/checkout", path) for _ in range(contenders)
+    ])
+    accepted = sum(1 for response in responses if response is not None and response.status_code == 200)
+    if accepted > 1:
+        state.violation("double_checkout", room_id=room_id, accepted=accepted)
+    (state.empty_rooms if accepted else state.occupied_rooms).add(room_id)
+
+
+async def contended_check_out(client, state):
+    """A double-clicked checkout button must not produce two bills"""
+    await check_out(client, state, contenders=2)
+
+
+async def list_rooms(client, state):
+    await state.request(client, "GET", "/api/rooms")
+
+
+async def room_guests(client, state):
+    if state.occupied_rooms:
+        room_id = state.rng.choice(sorted(state.occupied_rooms))
+        await state.request(client, "GET", "/api/rooms/{room_id}/guests", f"/api/rooms/{room_id}/guests")
+
+
+async def current_cost(client, state):
+    if state.occupied_rooms:
+        room_id = state.rng.choice(sorted(state.occupied_rooms))
+        await state.request(client, "GET", "/api/rooms/{room_id}/current-cost", f"/api/rooms/{room_id}/current-cost")
+
+
+async def create_order(client, state):
+    order = {
+        "company_name": state.rng.choice(COMPANIES),
+        "dish_id": state.rng.choice(state.dishes),
+        "quantity": state.rng.randint(1, 10),
+    }
+    await state.request(client, "POST", "/api/orders", json=order)
+
+
+async def list_orders(client, state):
+    start = (datetime.now(timezone.utc) - timedelta(days=1)).isoformat()
+    await state.request(client, "GET", "/api/orders", params={"start_date": start})
+
+
+async def list_orders_by_company(client, state):
+    await state.request(client, "GET", "/api/orders", params={"company_name": state.rng.choice(COMPANIES)})
+
+
+async def popular_dishes(client, state):
+    await state.request(client, "GET", "/api/reports/popular-dishes")
+
+
+async def company_report(client, state):
+    start = (datetime.now(timezone.utc) - timedelta(days=30)).isoformat()
+    params = {"company_name": state.rng.choice(COMPANIES), "start_date": start,
+              "group_by": state.rng.choice(["daily", "monthly"])}
+    await state.request(client, "GET", "/api/orders/company-report", params=params)
+
+
+async def company_summary(client, state):
+    start = (datetime.now(timezone.utc) - timedelta(days=30)).isoformat()
+    await state.request(client, "GET", "/api/orders/company-summary", params={"start_date": start})
+
+
+async def revenue_report(client, state):
+    start = (datetime.now(timezone.utc) - timedelta(days=30)).isoformat()
+    await state.request(client, "GET", "/api/reports/revenue", params={"period": "monthly", "start_date": start})
+
+
+async def room_occupancy(client, state):
+    await state.request(client, "GET", "/api/reports/room-occupancy")
+
+
+async def list_bills(client, state):
+    await state.request(client, "GET", "/api/bills")
+
+
+async def dashboard(client, state):
+    await state.request(client, "GET", "/api/dashboard")
+
+
+async def dashboard_stats(client, state):
+    await state.request(client, "GET", "/api/dashboard/stats")
+
+
+# Scenario mixes: (operation, weight)
+SCENARIOS = {
+    "checkin_rush": {
+        "description": "Morning check-in rush at the front desk",
+        "mix": [(check_in, 6), (contended_check_in, 1), (check_out, 2), (contended_check_out, 1),
+                (list_rooms, 3), (room_guests, 1)],
+    },
+    "dinner_orders": {
+        "description": "Dinner order burst from company guests",
+        "mix": [(create_order, 8), (list_orders, 2), (list_orders_by_company, 1), (popular_dishes, 1)],
+    },
+    "month_end_reporting": {
+        "description": "Month-end reporting by managers",
+        "mix": [(company_report, 3), (company_summary, 2), (revenue_report, 2), (room_occupancy, 1),
+                (dashboard_stats, 1), (list_bills, 1)],
+    },
+    "front_desk_polling": {
+        "description": "Front-desk screens polling room state",
+        "mix": [(list_rooms, 4), (dashboard, 2), (dashboard_stats, 2), (current_cost, 2)],
+    },
+}
+
+
+async def prepare(client, state, rooms, orders, concurrency):
+    """Make sure the database has enough rooms, dishes and order history"""
+    existing = (await client.get("/api/rooms")).json()
+    numbers = {room["number"] for room in existing}
+    next_number = 1000
+    while len(existing) < rooms:
+        next_number += 1
+        if str(next_number) in numbers:
+            continue
+        room_type = state.rng.choice(["single", "double"])
+        response = await client.post("/api/rooms", json={"number": str(next_number), "type": room_type})
+        response.raise_for_status()
+        existing.append(response.json())
+    for room in existing:
+        (state.empty_rooms if room["status"] == "empty" else state.occupied_rooms).add(room["id"])
+
+    state.dishes = [dish["id"] for dish in (await client.get("/api/dishes")).json()]
+    if not state.dishes:
+        for name, price in DISHES:
+            response = await client.post("/api/dishes", json={"name": name, "price": price})
+            response.raise_for_status()
+            state.dishes.append(response.json()["id"])
+
+    # Order history for the reports, created in batches of the benchmark concurrency
+    for start in range(0, orders, concurrency):
+        await asyncio.gather(*[
+            client.post("/api/orders", json={"company_name": state.rng.choice(COMPANIES),
+                                             "dish_id": state.rng.choice(state.dishes),
+                                             "quantity": state.rng.randint(1, 10)})
+            for _ in range(min(concurrency, orders - start))
+        ])
+
+
+async def run_scenario(client, state, name, concurrency, duration):
+    """Run one scenario mix with `concurrency` workers for `duration` seconds"""
+    operations, weights = zip(*SCENARIOS[name]["mix"])
+    state.routes = {}
+    state.violations = []
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            operation = state.rng.choices(operations, weights)[0]
+            await operation(client, state)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    routes = {route: stats.summary() for route, stats in sorted(state.routes.items())}
+    total = sum(route["count"] for route in routes.values())
+    return {
+        "description": SCENARIOS[name]["description"],
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 2),
+        "requests": total,
+        "errors": sum(route["errors"] for route in routes.values()),
+        "throughput_rps": round(total / elapsed, 1) if elapsed else None,
+        "routes": routes,
+        "violations": state.violations,
+    }
+
+
+def git_revision():
+    """Short commit hash of the working tree, with a marker when it has local changes"""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                         stderr=subprocess.DEVNULL).strip()
+        dirty = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], text=True,
+                                        stderr=subprocess.DEVNULL).strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def benchmark(args):
+    # server.py reads its settings at import time
+    os.environ["MONGO_URL"] = args.mongo_url
+    os.environ["DB_NAME"] = args.db_name
+    server = importlib.import_module("server")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    names = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    state = BenchState(random.Random(args.seed))
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "seed": args.seed,
+            "rooms": args.rooms,
+        },
+        "scenarios": {},
+    }
+
+    await server.app.router.startup()
+    try:
+        # Unhandled exceptions become 500s, as they would behind uvicorn
+        transport = httpx.ASGITransport(app=server.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as client:
+            await prepare(client, state, args.rooms, args.orders, args.concurrency)
+            for name in names:
+                print(f"Running {name} ({args.concurrency} workers, {args.duration}s)...", file=sys.stderr)
+                results["scenarios"][name] = await run_scenario(client, state, name, args.concurrency, args.duration)
+    finally:
+        await server.app.router.shutdown()
+        if not args.keep_db:
+            await server.client.drop_database(args.db_name)
+        server.client.close()
+    return results
+
+
+def print_results(results):
+    for name, scenario in results["scenarios"].items():
+        print(f"\n{name}: {scenario['requests']} requests, {scenario['throughput_rps']} req/s, "
+              f"{scenario['errors']} errors, {len(scenario['violations'])} violations")
+        print(f"  {'route':<48} {'count':>7} {'p50':>9} {'p95':>9} {'p99':>9}")
+        for route, stats in scenario["routes"].items():
+            print(f"  {route:<48} {stats['count']:>7} {stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9}")
+        for violation in scenario["violations"][:10]:
+            print(f"  VIOLATION {violation}")
+
+
+def print_comparison(base, new):
+    """Throughput and latency deltas between two result files"""
+    def delta(old, current):
+        if not old or current is None:
+            return "n/a"
+        return f"{(current - old) / old * 100:+.1f}%"
+
+    print(f"{base['meta']['revision']} -> {new['meta']['revision']}")
+    for name, scenario in new["scenarios"].items():
+        previous = base["scenarios"].get(name)
+        if not previous:
+            print(f"\n{name}: not in baseline")
+            continue
+        print(f"\n{name}: {previous['throughput_rps']} -> {scenario['throughput_rps']} req/s "
+              f"({delta(previous['throughput_rps'], scenario['throughput_rps'])})")
+        print(f"  {'route':<48} {'p50':>9} {'p95':>9} {'p99':>9}")
+        for route, stats in scenario["routes"].items():
+            old = previous["routes"].get(route, {})
+            print(f"  {route:<48} " + " ".join(
+                f"{delta(old.get(key), stats[key]):>9}" for key in ("p50_ms", "p95_ms", "p99_ms")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenario", choices=[*SCENARIOS, "all"], default="all")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=15, help="seconds per scenario")
+    parser.add_argument("--rooms", type=int, default=60, help="minimum number of rooms to benchmark with")
+    parser.add_argument("--orders", type=int, default=500, help="order history created before the run")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=30, help="per-request timeout in seconds")
+    parser.add_argument("--mongo-url", default=os.environ.get("BENCH_MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default=f"hotel_management_bench_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--keep-db", action="store_true", help="do not drop the benchmark database afterwards")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as base, open(args.compare[1]) as new:
+            print_comparison(json.load(base), json.load(new))
+        return 0
+
+    results = asyncio.run(benchmark(args))
+    print_results(results)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\nResults written to {args.output}")
+
+    # Non-zero exit so CI notices correctness regressions
+    return 1 if any(scenario["violations"] for scenario in results["scenarios"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the pricing and document codec hot paths.
+
+Times calculate_room_cost, calculate_booking_cost, prepare_for_mongo,
+parse_from_mongo and Room/Order model construction on fixed inputs, and reports
+ns/op as the best of several repeats, which is the most stable figure on a busy
+machine. Save a baseline before a refactor and compare against it afterwards:
+
+    python bench_micro.py --save bench-results/micro-baseline.json
+    python bench_micro.py --compare bench-results/micro-baseline.json
+    python bench_micro.py --filter parse_from_mongo
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import timeit
+import warnings
+from datetime import datetime, timedelta, timezone
+
+# server.py reads its settings at import time; nothing here talks to MongoDB
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "hotel_management_bench")
+# server.py still calls the deprecated .dict(); the warning text is noise here
+warnings.filterwarnings("ignore", category=DeprecationWarning)
+
+import pydantic  # noqa: E402
+from server import (  # noqa: E402
+    BookingType, Order, PricingStructure, Room, calculate_booking_cost, calculate_room_cost,
+    parse_from_mongo, prepare_for_mongo,
+)
+
+CHECK_IN = datetime(2026, 3, 1, 14, 0, tzinfo=timezone.utc)
+PRICING = PricingStructure()
+LONG_NAME = "Công ty Trách nhiệm Hữu hạn Thương mại Dịch vụ Du lịch Khách sạn Hoàng Long " * 3
+
+
+def room_document(guests):
+    """An occupied room as stored in MongoDB"""
+    return {
+        "id": "3f0b6a8e-4c1d-4b5e-9a7f-2d8c1e6b9a01",
+        "number": "305",
+        "type": "double",
+        "status": "occupied",
+        "pricing": PRICING.dict(),
+        "guest_name": "Nguyễn Văn An",
+        "company_name": "Công ty ABC",
+        "guests": [{"name": f"Khách {i}", "phone": f"09{i:08d}", "email": None, "id_card": f"0010900{i:05d}"}
+                   for i in range(guests)],
+        "check_in_date": CHECK_IN.isoformat(),
+        "check_out_date": (CHECK_IN + timedelta(days=2)).isoformat(),
+        "total_cost": 1000000,
+        "schema_version": 2,
+        "created_at": "2026-01-01T00:00:00+00:00",
+    }
+
+
+ORDER_DOCUMENT = {
+    "id": "7a1c2e3f-5b6d-4e8f-9a0b-1c2d3e4f5a6b",
+    "company_name": LONG_NAME,
+    "dish_id": "b1c2d3e4-f5a6-4b7c-8d9e-0f1a2b3c4d5e",
+    "dish_name": "Lẩu hải sản chua cay kiểu Thái với tôm, mực, nghêu và rau muống " * 2,
+    "quantity": 12,
+    "unit_price": 250000,
+    "total_price": 3000000,
+    "order_date": "2026-03-01T19:30:00+00:00",
+    "status": "pending",
+    "schema_version": 2,
+}
+
+ROOM_1_GUEST = room_document(1)
+ROOM_20_GUESTS = room_document(20)
+ROOM_MODEL = Room(**parse_from_mongo(room_document(20)))
+ORDER_MODEL = Order(**parse_from_mongo(dict(ORDER_DOCUMENT)))
+
+
+def stay(**duration):
+    return CHECK_IN, CHECK_IN + timedelta(**duration)
+
+
+# name -> zero-argument callable. Codec cases mutate their input in place, so
+# they work on a shallow copy and the timing includes that copy.
+CASES = {
+    "calculate_room_cost/hourly_45min": lambda args=stay(minutes=45): calculate_room_cost(*args, PRICING),
+    "calculate_room_cost/hourly_5h": lambda args=stay(hours=5): calculate_room_cost(*args, PRICING),
+    "calculate_room_cost/daily_3d_7h": lambda args=stay(days=3, hours=7): calculate_room_cost(*args, PRICING),
+    "calculate_room_cost/monthly_45d": lambda args=stay(days=45): calculate_room_cost(*args, PRICING),
+    "calculate_booking_cost/hourly_5h": lambda: calculate_booking_cost(BookingType.HOURLY, 5, PRICING),
+    "calculate_booking_cost/daily_3d": lambda: calculate_booking_cost(BookingType.DAILY, 3, PRICING),
+    "calculate_booking_cost/monthly_2m": lambda: calculate_booking_cost(BookingType.MONTHLY, 2, PRICING),
+    "prepare_for_mongo/room_20_guests": lambda: prepare_for_mongo(ROOM_MODEL.dict()),
+    "prepare_for_mongo/order_long_names": lambda: prepare_for_mongo(ORDER_MODEL.dict()),
+    "parse_from_mongo/room_1_guest": lambda: parse_from_mongo(dict(ROOM_1_GUEST)),
+    "parse_from_mongo/room_20_guests": lambda: parse_from_mongo(dict(ROOM_20_GUESTS)),
+    "parse_from_mongo/order_long_names": lambda: parse_from_mongo(dict(ORDER_DOCUMENT)),
+    "model/room_1_guest": lambda: Room(**parse_from_mongo(dict(ROOM_1_GUEST))),
+    "model/room_20_guests": lambda: Room(**parse_from_mongo(dict(ROOM_20_GUESTS))),
+    "model/order_long_names": lambda: Order(**parse_from_mongo(dict(ORDER_DOCUMENT))),
+    "model/room_dict": lambda: ROOM_MODEL.dict(),
+}
+
+
+def measure(func, repeat, min_time):
+    """ns/op of func: calibrate a loop count that runs for min_time, then keep the best repeat"""
+    timer = timeit.Timer(func)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    runs = [elapsed / number * 1e9 for elapsed in timer.repeat(repeat=repeat, number=number)]
+    best = min(runs)
+    return {
+        "ns_per_op": round(best, 1),
+        "median_ns": round(statistics.median(runs), 1),
+        # Spread between the best and median run; a high value means a noisy machine
+        "spread_pct": round((statistics.median(runs) - best) / best * 100, 1),
+        "loops": number,
+    }
+
+
+def run(names, repeat, min_time):
+    results = {}
+    for name in names:
+        results[name] = measure(CASES[name], repeat, min_time)
+        print(f"{name:<42} {results[name]['ns_per_op']:>12,.0f} ns/op  (median +{results[name]['spread_pct']}%)")
+    return results
+
+
+def compare(baseline, results, threshold):
+    """Print the change against a saved baseline; returns the names that got slower than threshold"""
+    regressions = []
+    print(f"\n{'case':<42} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name, current in results.items():
+        old = baseline["cases"].get(name)
+        if not old:
+            print(f"{name:<42} {'-':>12} {current['ns_per_op']:>12,.0f} {'new':>9}")
+            continue
+        change = (current["ns_per_op"] - old["ns_per_op"]) / old["ns_per_op"] * 100
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  SLOWER"
+        print(f"{name:<42} {old['ns_per_op']:>12,.0f} {current['ns_per_op']:>12,.0f} {change:>+8.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per repeat")
+    parser.add_argument("--save", help="write the results as a baseline JSON file")
+    parser.add_argument("--compare", help="compare against a baseline JSON file")
+    parser.add_argument("--threshold", type=float, default=10, help="slowdown in percent that counts as a regression")
+    args = parser.parse_args()
+
+    names = [name for name in CASES if args.filter in name]
+    if not names:
+        parser.error(f"no benchmark matches {args.filter!r}")
+
+    results = run(names, args.repeat, args.min_time)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "pydantic": pydantic.VERSION,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "cases": results,
+            }, f, indent=2)
+        print(f"\nBaseline written to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) more than {args.threshold:g}% slower than the baseline")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+"""
+Synthetic hotel dataset for benchmarks and load tests.
+
+Generates a parameterized property (rooms by floor and type with pricing
+variants), years of stays with their bills, guests with Vietnamese names and ID
+cards, reservations with conflicts and cancellations, and orders per company,
+and writes them with bulk inserts. Documents have the same shape as the ones
+server.py writes, and the indexes from server.INDEXES are built after loading.
+
+The same --seed and --now always produce the same data:
+
+    python generate_dataset.py --db-name hotel_bench --drop
+    python generate_dataset.py --db-name hotel_bench --drop --years 3 --orders-per-company 1000000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import unicodedata
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from pymongo import MongoClient
+
+# server.py reads its settings at import time; its client is never used here
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "hotel_management_dataset")
+
+from server import (  # noqa: E402
+    INDEXES, SCHEMA_VERSIONS, BookingType, PricingStructure, calculate_booking_cost, calculate_room_cost,
+)
+
+COLLECTIONS = ["rooms", "guests", "reservations", "dishes", "orders", "bills", "enhanced_bills"]
+
+FAMILY_NAMES = ["Nguyễn", "Trần", "Lê", "Phạm", "Hoàng", "Huỳnh", "Phan", "Vũ", "Võ", "Đặng", "Bùi", "Đỗ",
+                "Hồ", "Ngô", "Dương", "Lý"]
+# Weights roughly follow how common each family name is
+FAMILY_WEIGHTS = [38, 11, 9.5, 7, 5.1, 5.1, 4.5, 3.9, 3.9, 2.1, 2, 1.4, 1.3, 1.3, 1, 0.5]
+MIDDLE_NAMES = {"male": ["Văn", "Hữu", "Đức", "Minh", "Quốc", "Thanh", "Công", "Xuân"],
+                "female": ["Thị", "Ngọc", "Thu", "Thanh", "Minh", "Bảo", "Diệu", "Kim"]}
+GIVEN_NAMES = {"male": ["An", "Bình", "Cường", "Dũng", "Hùng", "Huy", "Khánh", "Long", "Nam", "Phong", "Quang",
+                        "Sơn", "Tài", "Thắng", "Trung", "Tuấn", "Việt", "Vinh"],
+               "female": ["Anh", "Chi", "Dung", "Giang", "Hà", "Hạnh", "Hoa", "Hương", "Lan", "Linh", "Mai",
+                          "Ngân", "Nhung", "Phương", "Quyên", "Thảo", "Trang", "Vy"]}
+PHONE_PREFIXES = ["090", "091", "093", "094", "096", "097", "098", "032", "033", "035", "036", "037", "038",
+                  "070", "076", "077", "079", "081", "083", "085", "088"]
+# Province codes used as the first three digits of a citizen ID card (CCCD)
+PROVINCE_CODES = ["001", "002", "004", "008", "010", "015", "019", "022", "024", "025", "026", "027", "030",
+                  "031", "033", "034", "035", "036", "037", "038", "040", "042", "044", "045", "046", "048",
+                  "049", "051", "052", "054", "056", "058", "060", "062", "064", "066", "067", "068", "070",
+                  "072", "074", "075", "077", "079", "080", "082", "083", "084", "086", "087", "089", "091",
+                  "092", "093", "094", "095", "096"]
+
+COMPANY_PREFIXES = ["Công ty TNHH", "Công ty Cổ phần", "Tập đoàn", "Công ty"]
+COMPANY_WORDS = ["Hoàng Long", "Minh Phát", "Sao Việt", "Thành Công", "An Khang", "Phú Quý", "Đại Nam",
+                 "Bình Minh", "Hưng Thịnh", "Tân Tiến", "Việt Á", "Trường Sơn", "Hải Đăng", "Kim Ngân",
+                 "Phương Đông", "Thái Bình", "Nam Việt", "Sông Hồng", "Đông Á", "Vạn Xuân"]
+COMPANY_TRADES = ["Xây dựng", "Thương mại", "Vận tải", "Du lịch", "Công nghệ", "Dược phẩm", "Điện lực", "Thực phẩm"]
+INDIVIDUAL = "Cá nhân"
+
+DISHES = [("Phở bò", 50000), ("Phở gà", 45000), ("Bún chả", 45000), ("Bún bò Huế", 50000), ("Cơm tấm sườn", 45000),
+          ("Cơm gà xối mỡ", 50000), ("Cơm rang dưa bò", 55000), ("Mì xào hải sản", 65000), ("Miến lươn", 50000),
+          ("Bánh mì ốp la", 30000), ("Bánh cuốn", 35000), ("Xôi xéo", 25000), ("Cháo gà", 35000),
+          ("Gỏi cuốn", 40000), ("Nem rán", 60000), ("Canh chua cá lóc", 90000), ("Cá kho tộ", 110000),
+          ("Thịt kho trứng", 80000), ("Rau muống xào tỏi", 40000), ("Đậu phụ sốt cà chua", 45000),
+          ("Gà luộc", 180000), ("Bò lúc lắc", 150000), ("Tôm rang muối", 170000), ("Mực xào", 140000),
+          ("Lẩu thái hải sản", 350000), ("Lẩu gà lá é", 320000), ("Lẩu riêu cua", 300000),
+          ("Cà phê đen", 20000), ("Cà phê sữa", 25000), ("Trà đá", 5000), ("Nước cam", 35000),
+          ("Sinh tố bơ", 40000), ("Nước dừa", 30000), ("Bia Hà Nội", 20000), ("Bia Sài Gòn", 22000),
+          ("Chè ba màu", 25000), ("Bánh flan", 20000), ("Trái cây theo mùa", 60000)]
+
+BOOKING_MIX = {BookingType.HOURLY: 50, BookingType.DAILY: 42, BookingType.MONTHLY: 8}
+# (hour, weight) of when orders are placed; meal times dominate
+ORDER_HOURS = [(6, 3), (7, 6), (8, 5), (9, 2), (10, 2), (11, 9), (12, 10), (13, 5), (14, 2), (15, 2), (16, 2),
+               (17, 4), (18, 9), (19, 10), (20, 7), (21, 4), (22, 2), (23, 1)]
+
+
+def ascii_name(name):
+    """Lowercase name without Vietnamese diacritics, for e-mail addresses"""
+    name = name.lower().replace("đ", "d")
+    return "".join(c for c in unicodedata.normalize("NFKD", name) if not unicodedata.combining(c))
+
+
+class DatasetGenerator:
+    """Deterministic document factory; all randomness comes from one seeded Random"""
+
+    def __init__(self, seed, now, years):
+        self.rng = random.Random(seed)
+        self.now = now
+        self.start = now - timedelta(days=int(365 * years))
+        self.guest_pool = []
+        self.companies = []
+
+    def uuid(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def moment(self, start=None, end=None):
+        start, end = start or self.start, end or self.now
+        return start + timedelta(seconds=self.rng.uniform(0, (end - start).total_seconds()))
+
+    def person(self):
+        gender = self.rng.choice(["male", "female"])
+        name = " ".join([self.rng.choices(FAMILY_NAMES, FAMILY_WEIGHTS)[0], self.rng.choice(MIDDLE_NAMES[gender]),
+                         self.rng.choice(GIVEN_NAMES[gender])])
+        birth_year = self.rng.randint(1955, 2005)
+        # CCCD: province, gender/century digit, two-digit birth year, six random digits
+        century_digit = (0 if birth_year < 2000 else 2) + (0 if gender == "male" else 1)
+        id_card = f"{self.rng.choice(PROVINCE_CODES)}{century_digit}{birth_year % 100:02d}{self.rng.randint(0, 999999):06d}"
+        phone = f"{self.rng.choice(PHONE_PREFIXES)}{self.rng.randint(0, 9999999):07d}"
+        email = None
+        if self.rng.random() < 0.35:
+            email = f"{ascii_name(name.split()[-1])}{self.rng.randint(1, 9999)}@example.vn"
+        return {"name": name, "phone": phone, "email": email, "id_card": id_card}
+
+    def make_companies(self, count):
+        names = set()
+        while len(names) < count:
+            names.add(f"{self.rng.choice(COMPANY_PREFIXES)} {self.rng.choice(COMPANY_TRADES)} "
+                      f"{self.rng.choice(COMPANY_WORDS)}")
+        self.companies = sorted(names)
+
+    def pricing(self, floor, floors, room_type):
+        """Pricing variant: doubles cost more, the top floors have a view surcharge, some rooms are discounted"""
+        factor = 1.5 if room_type == "double" else 1.0
+        if floor > floors - 2:
+            factor *= 1.2
+        if self.rng.random() < 0.1:
+            factor *= 0.9
+        base = PricingStructure()
+        return {key: round(value * factor, -3) for key, value in base.dict().items()}
+
+    def rooms(self, floors, rooms_per_floor):
+        for floor in range(1, floors + 1):
+            for index in range(1, rooms_per_floor + 1):
+                room_type = "double" if self.rng.random() < 0.4 else "single"
+                status = "maintenance" if self.rng.random() < 0.02 else "empty"
+                yield {
+                    "id": self.uuid(),
+                    "number": f"{floor}{index:02d}",
+                    "type": room_type,
+                    "status": status,
+                    "pricing": self.pricing(floor, floors, room_type),
+                    "guest_name": None,
+                    "company_name": None,
+                    "guests": [],
+                    "check_in_date": None,
+                    "check_out_date": None,
+                    "total_cost": None,
+                    "schema_version": SCHEMA_VERSIONS["rooms"],
+                    "created_at": self.start.isoformat(),
+                }
+
+    def guests(self, count):
+        for _ in range(count):
+            guest = {"id": self.uuid(), **self.person(), "schema_version": SCHEMA_VERSIONS["guests"],
+                     "created_at": self.moment().isoformat()}
+            self.guest_pool.append(guest)
+            yield guest
+
+    def stay_guests(self):
+        company = INDIVIDUAL if self.rng.random() < 0.4 else self.rng.choice(self.companies)
+        size = 1 if company == INDIVIDUAL else self.rng.choice([1, 1, 2, 2, 3, 4])
+        guests = [{key: guest[key] for key in ("name", "phone", "email", "id_card")}
+                  for guest in self.rng.sample(self.guest_pool, size)]
+        return company, guests
+
+    def stays(self, room):
+        """Bills and enhanced bills of one room's history; leaves the room occupied if the last stay is ongoing"""
+        pricing = PricingStructure(**room["pricing"])
+        check_in = self.start + timedelta(hours=self.rng.uniform(0, 48))
+        while check_in < self.now and room["status"] != "maintenance":
+            booking_type = self.rng.choices(list(BOOKING_MIX), list(BOOKING_MIX.values()))[0]
+            if booking_type == BookingType.HOURLY:
+                duration = self.rng.choice([1, 1, 2, 2, 3, 4, 6])
+                planned = timedelta(hours=duration)
+                actual = planned + timedelta(minutes=self.rng.uniform(-40, 30))
+            elif booking_type == BookingType.DAILY:
+                duration = self.rng.choice([1, 1, 1, 2, 2, 3, 4, 5, 7])
+                planned = timedelta(days=duration)
+                # Early checkouts happen, they still pay the pre-paid amount
+                actual = planned - timedelta(hours=self.rng.choice([0, 0, 0, 2, 5, 20]))
+            else:
+                duration = self.rng.choice([1, 1, 2, 3])
+                planned = timedelta(days=30 * duration)
+                actual = planned - timedelta(days=self.rng.choice([0, 0, 1, 5]))
+            company, guests = self.stay_guests()
+            total_cost = calculate_booking_cost(booking_type, duration, pricing)
+            check_out = check_in + actual
+
+            if check_out > self.now:
+                # Ongoing stay
+                room.update({
+                    "status": "occupied",
+                    "company_name": company,
+                    "guests": guests,
+                    "guest_name": guests[0]["name"],
+                    "check_in_date": check_in.isoformat(),
+                    "check_out_date": (check_in + planned).isoformat(),
+                    "total_cost": total_cost,
+                    "booking_type": booking_type.value,
+                    "booking_duration": duration,
+                })
+                return
+
+            if booking_type == BookingType.HOURLY:
+                cost_calculation = calculate_room_cost(check_in, check_out, pricing)
+                calculation_method = "actual_time_hourly"
+            else:
+                cost_calculation = {
+                    "total_cost": total_cost,
+                    "duration_hours": round(actual.total_seconds() / 3600, 2),
+                    "duration_days": actual.days,
+                    "calculation_type": f"fixed_{booking_type.value}",
+                    "details": f"Chi phí cố định ({booking_type.value}) - Đã thanh toán trước: {total_cost:,.0f} VND",
+                }
+                calculation_method = f"pre_paid_{booking_type.value}"
+
+            yield "bills", {
+                "id": self.uuid(),
+                "room_number": room["number"],
+                "company_name": company,
+                "guests": guests,
+                "guest_name": guests[0]["name"],
+                "booking_type": booking_type.value,
+                "original_total_cost": total_cost,
+                "calculation_method": calculation_method,
+                "check_in_time": check_in.isoformat(),
+                "check_out_time": check_out.isoformat(),
+                "cost_calculation": cost_calculation,
+                "created_at": check_out.isoformat(),
+                "schema_version": SCHEMA_VERSIONS["bills"],
+            }
+            amount = cost_calculation["total_cost"]
+            paid = self.rng.random() < 0.97
+            yield "enhanced_bills", {
+                "id": self.uuid(),
+                "guest_id": guests[0]["name"],
+                "room_id": room["id"],
+                "reservation_id": None,
+                "items": [{
+                    "type": "room",
+                    "description": f"Phòng {room['number']} - {cost_calculation['details']} (Booking: {booking_type.value})",
+                    "quantity": 1,
+                    "unit_price": amount,
+                    "total_price": amount,
+                }],
+                "subtotal": amount,
+                "tax": 0.0,
+                "total": amount,
+                "status": "paid" if paid else "unpaid",
+                "created_at": check_out.isoformat(),
+                "paid_at": (check_out + timedelta(minutes=self.rng.uniform(1, 30))).isoformat() if paid else None,
+                "schema_version": SCHEMA_VERSIONS["enhanced_bills"],
+            }
+            # Turnaround until the next guest arrives
+            check_in = check_out + timedelta(hours=self.rng.expovariate(1 / 14))
+
+    def reservations(self, count, rooms):
+        """Past and future reservations; about one in ten collides with another one on the same room"""
+        horizon = self.now + timedelta(days=90)
+        made = 0
+        while made < count:
+            room = self.rng.choice(rooms)
+            start = self.moment(self.start, horizon).replace(hour=14, minute=0, second=0, microsecond=0)
+            nights = self.rng.choice([1, 1, 2, 2, 3, 4, 5, 7, 14])
+            reservation = self.reservation(room, start, nights)
+            yield reservation
+            made += 1
+            if made < count and self.rng.random() < 0.1:
+                # A second booking for an overlapping period: usually caught and cancelled, sometimes still pending
+                overlap_start = start + timedelta(days=self.rng.randint(0, nights - 1) if nights > 1 else 0)
+                conflict = self.reservation(room, overlap_start, self.rng.choice([1, 2, 3]))
+                conflict["status"] = "cancelled" if self.rng.random() < 0.8 else "pending"
+                yield conflict
+                made += 1
+
+    def reservation(self, room, start, nights):
+        end = start + timedelta(days=nights)
+        if end < self.now:
+            status = "checked_in" if self.rng.random() < 0.85 else "cancelled"
+        elif start < self.now:
+            status = "checked_in"
+        else:
+            status = self.rng.choices(["pending", "confirmed", "cancelled"], [3, 6, 1])[0]
+        return {
+            "id": self.uuid(),
+            "room_id": room["id"],
+            "guest_id": self.rng.choice(self.guest_pool)["id"],
+            "start_date": start.isoformat(),
+            "end_date": end.isoformat(),
+            "status": status,
+            "total_cost": room["pricing"]["daily_rate"] * nights,
+            "schema_version": SCHEMA_VERSIONS["reservations"],
+            "created_at": (min(start, self.now) - timedelta(days=self.rng.uniform(0, 30))).isoformat(),
+        }
+
+    def dishes(self):
+        for name, price in DISHES:
+            yield {
+                "id": self.uuid(),
+                "name": name,
+                "price": float(price),
+                "status": "available" if self.rng.random() < 0.9 else "unavailable",
+                "description": None,
+                "schema_version": SCHEMA_VERSIONS["dishes"],
+                "created_at": self.start.isoformat(),
+            }
+
+    def orders(self, dishes, per_company):
+        hours, weights = zip(*ORDER_HOURS)
+        days = (self.now - self.start).days
+        for company in self.companies:
+            # Each company has a few favourite dishes
+            favourites = self.rng.sample(dishes, min(8, len(dishes)))
+            for _ in range(per_company):
+                dish = self.rng.choice(favourites) if self.rng.random() < 0.6 else self.rng.choice(dishes)
+                day = self.start + timedelta(days=self.rng.randrange(days))
+                order_date = day.replace(hour=self.rng.choices(hours, weights)[0], minute=self.rng.randrange(60),
+                                         second=self.rng.randrange(60), microsecond=0)
+                quantity = self.rng.choices([1, 2, 3, 4, 5, 10, 20], [30, 25, 15, 10, 10, 7, 3])[0]
+                yield {
+                    "id": self.uuid(),
+                    "company_name": company,
+                    "dish_id": dish["id"],
+                    "dish_name": dish["name"],
+                    "quantity": quantity,
+                    "unit_price": dish["price"],
+                    "total_price": dish["price"] * quantity,
+                    "order_date": order_date.isoformat(),
+                    "status": "delivered" if order_date < self.now - timedelta(hours=2) else "pending",
+                    "schema_version": SCHEMA_VERSIONS["orders"],
+                }
+
+
+class BulkWriter:
+    """Buffers documents per collection and writes them with unordered insert_many"""
+
+    def __init__(self, db, batch_size):
+        self.db = db
+        self.batch_size = batch_size
+        self.buffers = {}
+        self.counts = {}
+
+    def add(self, collection, document):
+        buffer = self.buffers.setdefault(collection, [])
+        buffer.append(document)
+        if len(buffer) >= self.batch_size:
+            self.flush(collection)
+
+    def add_all(self, collection, documents):
+        for document in documents:
+            self.add(collection, document)
+        self.flush(collection)
+
+    def flush(self, collection=None):
+        for name in [collection] if collection else list(self.buffers):
+            buffer = self.buffers.get(name)
+            if buffer:
+                self.db[name].insert_many(buffer, ordered=False)
+                self.counts[name] = self.counts.get(name, 0) + len(buffer)
+                self.buffers[name] = []
+
+
+def generate(db, args):
+    now = datetime.fromisoformat(args.now) if args.now else datetime.now(timezone.utc).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    if now.tzinfo is None:
+        now = now.replace(tzinfo=timezone.utc)
+    generator = DatasetGenerator(args.seed, now, args.years)
+    writer = BulkWriter(db, args.batch_size)
+
+    def step(label, action):
+        started = time.perf_counter()
+        action()
+        print(f"{label:<28} {time.perf_counter() - started:7.1f}s", file=sys.stderr)
+
+    generator.make_companies(args.companies)
+    step("guests", lambda: writer.add_all("guests", generator.guests(args.guests)))
+
+    rooms = list(generator.rooms(args.floors, args.rooms_per_floor))
+
+    def stays():
+        for room in rooms:
+            for collection, document in generator.stays(room):
+                writer.add(collection, document)
+        writer.flush()
+        writer.add_all("rooms", rooms)
+    step("rooms, stays and bills", stays)
+
+    step("reservations", lambda: writer.add_all("reservations", generator.reservations(args.reservations, rooms)))
+    dishes = list(generator.dishes())
+    writer.add_all("dishes", dishes)
+    step("orders", lambda: writer.add_all("orders", generator.orders(dishes, args.orders_per_company)))
+
+    def indexes():
+        for collection, models in INDEXES.items():
+            if collection in COLLECTIONS:
+                db[collection].create_indexes(models)
+    step("indexes", indexes)
+    return writer.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", required=True)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--now", help="ISO timestamp the data ends at (default: today 00:00 UTC)")
+    parser.add_argument("--years", type=float, default=2, help="years of history")
+    parser.add_argument("--floors", type=int, default=8)
+    parser.add_argument("--rooms-per-floor", type=int, default=12)
+    parser.add_argument("--guests", type=int, default=20000)
+    parser.add_argument("--reservations", type=int, default=20000)
+    parser.add_argument("--companies", type=int, default=40)
+    parser.add_argument("--orders-per-company", type=int, default=25000)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--drop", action="store_true", help="drop the dataset collections first")
+    args = parser.parse_args()
+
+    if args.companies > len(COMPANY_PREFIXES) * len(COMPANY_TRADES) * len(COMPANY_WORDS):
+        parser.error("too many companies for the available name combinations")
+
+    client = MongoClient(args.mongo_url)
+    db = client[args.db_name]
+    if args.drop:
+        for collection in COLLECTIONS:
+            db.drop_collection(collection)
+    elif any(db[collection].estimated_document_count() for collection in COLLECTIONS):
+        parser.error(f"database {args.db_name} already has data; pass --drop to replace it")
+
+    started = time.perf_counter()
+    counts = generate(db, args)
+    print(f"\nGenerated in {time.perf_counter() - started:.1f}s into {args.db_name}:")
+    for collection in COLLECTIONS:
+        print(f"  {collection:<16} {counts.get(collection, 0):>12,}")
+    client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Production launcher for the API server.
+
+Wraps uvicorn with the settings that matter under load: worker processes, the
+uvloop event loop and httptools parser when they are installed, TCP or Unix
+socket binding, listen backlog and keep-alive, and a graceful shutdown that
+fits in SHUTDOWN_DRAIN_TIMEOUT_SECONDS. Every option can also be set from the
+environment (shown in --help), so one command line serves all environments:
+
+    python launcher.py --workers 4 --port 8001
+    python launcher.py --uds /run/hotel/api.sock --keep-alive 75 --backlog 4096
+    WEB_CONCURRENCY=8 python launcher.py --print-config
+
+The app is imported once in this process before serving, so a broken .env or
+import error fails here instead of in every worker. With a single worker the
+preloaded app is served directly; with several, uvicorn starts each worker as a
+fresh process that imports the app again.
+
+Shutdown runs in three consecutive phases, which together take at most
+SHUTDOWN_DRAIN_TIMEOUT_SECONDS: the shutdown delay (draining while the listener
+is still open), uvicorn's graceful timeout for the requests already running,
+and the app's flush of queued writes (AUDIT_SHUTDOWN_TIMEOUT_SECONDS). Unless
+--graceful-timeout is given, the graceful timeout is whatever the other two
+phases leave of the budget.
+"""
+
+import asyncio
+import importlib.util
+import json
+import logging
+import math
+import os
+import signal
+import sys
+from pathlib import Path
+from typing import Optional
+
+import typer
+import uvicorn
+from dotenv import load_dotenv
+from uvicorn.main import STARTUP_FAILURE
+from uvicorn.supervisors import Multiprocess
+
+ROOT_DIR = Path(__file__).parent
+# Read before the options are parsed so that .env can set their environment variables too
+load_dotenv(ROOT_DIR / '.env')
+
+APP = "server:app"
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def installed(module):
+    return importlib.util.find_spec(module) is not None
+
+
+def event_loop(choice):
+    if choice == "auto":
+        return "uvloop" if installed("uvloop") else "asyncio"
+    return choice
+
+
+def http_parser(choice):
+    if choice == "auto":
+        return "httptools" if installed("httptools") else "h11"
+    return choice
+
+
+class DrainingServer(uvicorn.Server):
+    """
+    uvicorn server that starts draining as soon as SIGTERM arrives.
+
+    uvicorn closes its listener the moment it is told to exit, so the load balancer would
+    only find out from failed connections. Here the app is marked as draining first
+    (readiness 503, new requests 503 with Connection: close) and uvicorn's own shutdown,
+    which waits for the running requests, starts shutdown_delay seconds later. SIGINT
+    (Ctrl+C) and a second SIGTERM skip the delay.
+    """
+
+    def __init__(self, config, shutdown_delay):
+        super().__init__(config)
+        self.shutdown_delay = shutdown_delay
+
+    def handle_exit(self, sig, frame):
+        from server import shutdown_coordinator
+
+        if sig != signal.SIGTERM or shutdown_coordinator.draining or not self.shutdown_delay:
+            shutdown_coordinator.begin()
+            super().handle_exit(sig, frame)
+            return
+        shutdown_coordinator.begin()
+        asyncio.get_running_loop().call_later(self.shutdown_delay, super().handle_exit, sig, frame)
+
+
+class DrainingMultiprocess(Multiprocess):
+    """Multiprocess supervisor that signals all workers at once instead of one after the other"""
+
+    def shutdown(self):
+        # uvicorn terminates and joins each worker in turn, so with a shutdown delay the last
+        # worker would keep taking new requests until all the others had exited
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        logger.info(f"Stopping parent process [{self.pid}]")
+
+
+def serve(app, config, shutdown_delay):
+    """uvicorn.run with DrainingServer in place of uvicorn.Server"""
+    config = uvicorn.Config(app, **config)
+    server = DrainingServer(config, shutdown_delay)
+    if config.workers > 1:
+        DrainingMultiprocess(config, target=server.run, sockets=[config.bind_socket()]).run()
+    else:
+        server.run()
+    if config.uds and os.path.exists(config.uds):
+        os.remove(config.uds)
+    if not server.started and config.workers == 1:
+        sys.exit(STARTUP_FAILURE)
+
+
+def effective_config(host, port, uds, workers, loop, http, backlog, keep_alive, graceful_timeout,
+                     limit_concurrency, limit_max_requests, proxy_headers, forwarded_allow_ips, access_log):
+    """Keyword arguments for uvicorn.run, with 'auto' choices resolved"""
+    return {
+        "host": host,
+        "port": port,
+        "uds": uds,
+        "workers": workers,
+        "loop": event_loop(loop),
+        "http": http_parser(http),
+        "backlog": backlog,
+        "timeout_keep_alive": keep_alive,
+        "timeout_graceful_shutdown": graceful_timeout,
+        "limit_concurrency": limit_concurrency,
+        "limit_max_requests": limit_max_requests,
+        "proxy_headers": proxy_headers,
+        "forwarded_allow_ips": forwarded_allow_ips,
+        "access_log": access_log,
+        # server.py configures logging (JSON, queued, sampled access logs); keep uvicorn's defaults out
+        "log_config": None,
+    }
+
+
+def main(
+    host: str = typer.Option("127.0.0.1", envvar="HOST", help="Interface to bind (ignored with --uds)"),
+    port: int = typer.Option(8001, envvar="PORT"),
+    uds: Optional[str] = typer.Option(None, envvar="UDS", help="Bind to this Unix socket instead of TCP"),
+    workers: int = typer.Option(1, min=1, envvar="WEB_CONCURRENCY", help="Worker processes"),
+    loop: str = typer.Option("auto", envvar="UVICORN_LOOP", help="auto (uvloop if installed), uvloop or asyncio"),
+    http: str = typer.Option("auto", envvar="UVICORN_HTTP", help="auto (httptools if installed), httptools or h11"),
+    backlog: int = typer.Option(2048, min=1, envvar="UVICORN_BACKLOG",
+                                help="Listen queue length; the kernel caps it at net.core.somaxconn"),
+    keep_alive: int = typer.Option(5, min=1, envvar="UVICORN_KEEP_ALIVE",
+                                   help="Seconds idle connections are kept; behind a load balancer set it above the "
+                                        "balancer's idle timeout"),
+    graceful_timeout: Optional[int] = typer.Option(
+        None, envvar="UVICORN_GRACEFUL_TIMEOUT",
+        help="Seconds to wait for running requests on shutdown (default: what SHUTDOWN_DRAIN_TIMEOUT_SECONDS "
+             "leaves after the shutdown delay and the app's flush)"),
+    limit_concurrency: Optional[int] = typer.Option(
+        None, envvar="UVICORN_LIMIT_CONCURRENCY", help="Connections per worker before answering 503"),
+    limit_max_requests: Optional[int] = typer.Option(
+        None, envvar="UVICORN_LIMIT_MAX_REQUESTS", help="Restart a worker after this many requests"),
+    proxy_headers: bool = typer.Option(True, envvar="UVICORN_PROXY_HEADERS",
+                                       help="Trust X-Forwarded-For/-Proto from --forwarded-allow-ips"),
+    forwarded_allow_ips: str = typer.Option("127.0.0.1", envvar="FORWARDED_ALLOW_IPS"),
+    access_log: bool = typer.Option(True, envvar="UVICORN_ACCESS_LOG"),
+    shutdown_delay: float = typer.Option(
+        5, min=0, envvar="SHUTDOWN_DELAY_SECONDS",
+        help="Seconds between SIGTERM and closing the listener, while readiness reports 503 and new "
+             "requests are turned away; give the load balancer time to notice"),
+    print_config: bool = typer.Option(False, "--print-config", help="Print the effective configuration and exit"),
+):
+    """Serve the hotel management API"""
+    for name, value, choices in (("--loop", loop, ("auto", "uvloop", "asyncio")),
+                                 ("--http", http, ("auto", "httptools", "h11"))):
+        if value not in choices:
+            raise typer.BadParameter(f"must be one of {', '.join(choices)}", param_hint=name)
+        if value in ("uvloop", "httptools") and not installed(value):
+            raise typer.BadParameter(f"{value} is not installed", param_hint=name)
+
+    sys.path.insert(0, str(ROOT_DIR))
+    import server
+
+    budget = server.SHUTDOWN_DRAIN_TIMEOUT_SECONDS
+    flush = server.AUDIT_SHUTDOWN_TIMEOUT_SECONDS
+    if graceful_timeout is None:
+        # uvicorn waits for the running requests first; the app's flush runs only after that
+        graceful_timeout = max(1, math.floor(budget - shutdown_delay - flush))
+    total = shutdown_delay + graceful_timeout + flush
+    if total > budget:
+        logger.warning(f"Shutdown can take {total:g}s (delay {shutdown_delay:g}s + requests {graceful_timeout}s + "
+                       f"flush {flush:g}s), more than SHUTDOWN_DRAIN_TIMEOUT_SECONDS={budget:g}")
+    config = effective_config(host, port, uds, workers, loop, http, backlog, keep_alive, graceful_timeout,
+                              limit_concurrency, limit_max_requests, proxy_headers, forwarded_allow_ips, access_log)
+
+    if print_config:
+        typer.echo(json.dumps({"app": APP, "shutdown_delay": shutdown_delay, **config,
+                               "shutdown_flush_timeout": flush, "shutdown_total_max": total}, indent=2))
+        return
+
+    serve(server.app if workers == 1 else APP, config, shutdown_delay)
+
+
+if __name__ == "__main__":
+    typer.run(main)
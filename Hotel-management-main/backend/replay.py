@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Replay captured traffic against a test instance.
+
+Reads the traces written by the server when TRAFFIC_CAPTURE_FILE is set and
+re-issues them at 1x, 10x or maximum speed, then compares the replayed latency
+distribution per route with the captured one.
+
+Captured ids are mapped onto ids that exist on the target (rooms, guests,
+dishes, reservations, bills), and redacted values are filled with placeholders
+of the captured type, so the replayed requests have the same shape and cost.
+Writes are replayed too: point this at a test database only.
+
+    python replay.py traffic.log --date 2026-10-18 --target http://localhost:8001 --speed 10
+    python replay.py traffic.log traffic.log.1 --speed max --concurrency 100 --output replay.json
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+# Path parameter / body field -> (collection endpoint listing valid ids on the target)
+ID_SOURCES = {
+    "room_id": "/api/rooms",
+    "guest_id": "/api/guests",
+    "dish_id": "/api/dishes",
+    "reservation_id": "/api/reservations",
+    "bill_id": "/api/enhanced-bills",
+}
+PLACEHOLDERS = {"str": "replay", "int": 1, "float": 1.0, "bool": True}
+# Never replayed: metrics scrapes, logins whose password is redacted in the capture, and logouts
+# whose bearer token is not captured
+SKIP_ROUTES = {"/metrics", "/api/admin/login", "/api/admin/logout"}
+
+
+def load_traces(paths, date=None, route_filter=None):
+    """Captured traces from one or more files, oldest first"""
+    traces = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    trace = json.loads(line)
+                except ValueError:
+                    continue
+                if trace.get("r") is None or trace["r"] in SKIP_ROUTES:
+                    continue
+                if date and datetime.fromtimestamp(trace["t"], timezone.utc).date().isoformat() != date:
+                    continue
+                if route_filter and route_filter not in trace["r"]:
+                    continue
+                traces.append(trace)
+    traces.sort(key=lambda trace: trace["t"])
+    return traces
+
+
+class IdMapper:
+    """Maps captured ids onto ids that exist on the target, the same captured id always to the same target id"""
+
+    def __init__(self, pools):
+        self.pools = pools
+
+    def map(self, field, value):
+        pool = self.pools.get(field)
+        if not pool or not isinstance(value, str):
+            return value
+        digest = int(hashlib.sha1(value.encode()).hexdigest(), 16)
+        return pool[digest % len(pool)]
+
+    def path(self, template, captured_path):
+        parts = []
+        for template_part, captured_part in zip(template.split("/"), captured_path.split("/")):
+            if template_part.startswith("{"):
+                parts.append(self.map(template_part.strip("{}"), captured_part))
+            else:
+                parts.append(captured_part)
+        return "/".join(parts)
+
+    def body(self, shape, key=None):
+        """Request body with redacted values replaced by placeholders and ids mapped"""
+        if isinstance(shape, dict):
+            return {item_key: self.body(item, item_key) for item_key, item in shape.items()}
+        if isinstance(shape, list):
+            return [self.body(item) for item in shape]
+        if key in self.pools:
+            return self.map(key, shape)
+        if isinstance(shape, str) and shape in PLACEHOLDERS and not (key or "").endswith("_date"):
+            return PLACEHOLDERS[shape]
+        return shape
+
+
+async def fetch_id_pools(client):
+    pools = {}
+    for field, endpoint in ID_SOURCES.items():
+        response = await client.get(endpoint)
+        if response.status_code == 200:
+            pools[field] = sorted(item["id"] for item in response.json() if "id" in item)
+    return pools
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return round(sorted_values[int(rank) - 1], 2)
+
+
+def distribution(values):
+    values = sorted(values)
+    return {"count": len(values), "p50_ms": percentile(values, 50), "p95_ms": percentile(values, 95),
+            "p99_ms": percentile(values, 99)}
+
+
+async def replay(traces, args):
+    results = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with httpx.AsyncClient(base_url=args.target, timeout=args.timeout) as client:
+        mapper = IdMapper(await fetch_id_pools(client))
+
+        async def issue(trace):
+            async with semaphore:
+                kwargs = {"params": {key: PLACEHOLDERS["str"] if value == "str" else value
+                                     for key, value in trace.get("q", {}).items()}}
+                if isinstance(trace.get("b"), (dict, list)):
+                    kwargs["json"] = mapper.body(trace["b"])
+                started = time.perf_counter()
+                try:
+                    response = await client.request(trace["m"], mapper.path(trace["r"], trace["p"]), **kwargs)
+                    status = response.status_code
+                except httpx.TransportError:
+                    status = 0
+                results.append((trace, (time.perf_counter() - started) * 1000, status))
+
+        tasks = []
+        origin = traces[0]["t"]
+        replay_started = time.perf_counter()
+        for trace in traces:
+            if args.speed != "max":
+                # Keep the captured spacing between requests, compressed by the speed factor
+                delay = (trace["t"] - origin) / float(args.speed) - (time.perf_counter() - replay_started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(issue(trace)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - replay_started
+
+    return summarize(results, elapsed, traces, args)
+
+
+def summarize(results, elapsed, traces, args):
+    routes = {}
+    for trace, latency, status in results:
+        route = routes.setdefault(f"{trace['m']} {trace['r']}", {"captured": [], "replayed": [], "status_mismatch": 0})
+        route["captured"].append(trace["d"])
+        route["replayed"].append(latency)
+        if status != trace["s"]:
+            route["status_mismatch"] += 1
+
+    summary = {}
+    for name, route in sorted(routes.items()):
+        captured, replayed = distribution(route["captured"]), distribution(route["replayed"])
+        summary[name] = {
+            "captured": captured,
+            "replayed": replayed,
+            "p95_ratio": round(replayed["p95_ms"] / captured["p95_ms"], 2) if captured["p95_ms"] else None,
+            "status_mismatch": route["status_mismatch"],
+        }
+    return {
+        "meta": {
+            "target": args.target,
+            "speed": args.speed,
+            "requests": len(results),
+            "captured_span_s": round(traces[-1]["t"] - traces[0]["t"], 1),
+            "replay_duration_s": round(elapsed, 1),
+            "replayed_at": datetime.now(timezone.utc).isoformat(),
+        },
+        "routes": summary,
+    }
+
+
+def print_summary(summary):
+    meta = summary["meta"]
+    print(f"Replayed {meta['requests']} requests spanning {meta['captured_span_s']}s in {meta['replay_duration_s']}s "
+          f"(speed {meta['speed']}) against {meta['target']}")
+    print(f"\n{'route':<48} {'count':>6} {'captured p50/p95':>18} {'replayed p50/p95':>18} {'p95 x':>6} {'status!=':>8}")
+    for name, route in summary["routes"].items():
+        captured, replayed = route["captured"], route["replayed"]
+        print(f"{name:<48} {captured['count']:>6} {captured['p50_ms']:>8}/{captured['p95_ms']:<9} "
+              f"{replayed['p50_ms']:>8}/{replayed['p95_ms']:<9} {route['p95_ratio'] or '-':>6} {route['status_mismatch']:>8}")
+
+
+def speed(value):
+    if value == "max":
+        return value
+    if float(value) <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive or 'max'")
+    return float(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("captures", nargs="+", help="capture files (TRAFFIC_CAPTURE_FILE and its rotations)")
+    parser.add_argument("--target", default="http://localhost:8001")
+    parser.add_argument("--date", help="only replay requests captured on this UTC day (YYYY-MM-DD)")
+    parser.add_argument("--route", help="only replay routes containing this text")
+    parser.add_argument("--speed", type=speed, default=1.0, help="1, 10, ... or 'max'")
+    parser.add_argument("--concurrency", type=int, default=50, help="maximum requests in flight")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--output", help="write the comparison as JSON to this file")
+    args = parser.parse_args()
+
+    traces = load_traces(args.captures, args.date, args.route)
+    if not traces:
+        print("No captured requests match", file=sys.stderr)
+        return 1
+
+    summary = asyncio.run(replay(traces, args))
+    print_summary(summary)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
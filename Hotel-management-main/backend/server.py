@@ -1,10 +1,49 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+import bcrypt
+import jwt
+import pymongo
+from pymongo import monitoring, ASCENDING, DESCENDING, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import (
+    AutoReconnect, BulkWriteError, DuplicateKeyError, ExecutionTimeout, NetworkTimeout, NotPrimaryError, OperationFailure,
+    PyMongoError, ServerSelectionTimeoutError,
+)
 import os
+import asyncio
+import atexit
+import bisect
+import collections
+import contextlib
+import contextvars
+import copy
+import functools
+import glob
+import hashlib
+import cProfile
+import importlib
+import io
+import json
 import logging
+import logging.handlers
+import math
+import pstats
+import queue
+import random
+import secrets
+import sys
+import threading
+import time
+import traceback
+import urllib.parse
 from pathlib import Path
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 from pydantic import BaseModel, Field
 from typing import List, Optional
 import uuid
@@ -16,21 +55,1343 @@ from functools import wraps
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Configure logging
+# Records are put on a bounded queue by the thread that logs them and formatted and written by a
+# background thread (QueueListener), so neither traceback formatting nor a slow stdout blocks the
+# event loop; when the queue is full records are dropped and counted instead of waited for.
+# With LOG_FORMAT=json (default) every record is one JSON object carrying the request id.
+# INFO records of the loggers in LOG_SAMPLED_LOGGERS (access logs) are kept with probability
+# LOG_INFO_SAMPLE_RATE; warnings and errors are always kept.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()
+LOG_INFO_SAMPLE_RATE = float(os.environ.get('LOG_INFO_SAMPLE_RATE', '1'))
+LOG_SAMPLED_LOGGERS = tuple(name.strip() for name in os.environ.get('LOG_SAMPLED_LOGGERS', 'uvicorn.access').split(',') if name.strip())
+LOG_QUEUE_SIZE = 10000
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in ("request_id", "method", "route"):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class InfoSampler(logging.Filter):
+    def filter(self, record):
+        if record.levelno > logging.INFO or LOG_INFO_SAMPLE_RATE >= 1 or not record.name.startswith(LOG_SAMPLED_LOGGERS):
+            return True
+        return random.random() < LOG_INFO_SAMPLE_RATE
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves traceback formatting to the writer thread and never waits for room"""
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only the message is rendered here; exc_info goes along and is formatted by the writer
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+log_listeners = []
+
+def queued_handler(handler):
+    """A handler that passes records to `handler`, which writes them from a background thread"""
+    queue_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    listener = logging.handlers.QueueListener(queue_handler.queue, handler, respect_handler_level=True)
+    listener.start()
+    log_listeners.append(listener)
+    return queue_handler
+
+@atexit.register
+def stop_log_listeners():
+    """Write out the records still queued"""
+    for listener in log_listeners:
+        listener.stop()
+    log_listeners.clear()
+
+stream_handler = logging.StreamHandler()
+if LOG_FORMAT == "json":
+    stream_handler.setFormatter(JsonFormatter())
+else:
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+log_handler = queued_handler(stream_handler)
+log_handler.addFilter(InfoSampler())
+logging.getLogger().addHandler(log_handler)
+logging.getLogger().setLevel(LOG_LEVEL)
+# uvicorn installs its own synchronous handlers before importing the app; route its records here too
+for uvicorn_logger_name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+    logging.getLogger(uvicorn_logger_name).handlers = []
+    logging.getLogger(uvicorn_logger_name).propagate = True
+logger = logging.getLogger(__name__)
+
+def redact_mongo_url(url):
+    """The connection string without its credentials"""
+    scheme, separator, rest = url.partition("://")
+    return f"{scheme}{separator}***@{rest.split('@', 1)[1]}" if "@" in rest.split("/", 1)[0] else url
+
 # MongoDB connection
 mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
 db_name = os.environ.get('DB_NAME', 'hotel_management')
 
-print(f"Connecting to MongoDB: {mongo_url}")
-print(f"Database name: {db_name}")
+logger.info(f"Connecting to MongoDB: {redact_mongo_url(mongo_url)}")
+logger.info(f"Database name: {db_name}")
+
+# Connection pool settings; unset values fall back to the driver defaults
+MONGO_POOL_SETTINGS = {
+    "maxPoolSize": "MONGO_MAX_POOL_SIZE",
+    "minPoolSize": "MONGO_MIN_POOL_SIZE",
+    "maxIdleTimeMS": "MONGO_MAX_IDLE_TIME_MS",
+    "waitQueueTimeoutMS": "MONGO_WAIT_QUEUE_TIMEOUT_MS",
+    "serverSelectionTimeoutMS": "MONGO_SERVER_SELECTION_TIMEOUT_MS",
+}
+
+# Wire compressors and the module each one needs
+MONGO_COMPRESSOR_MODULES = {
+    "zstd": "zstandard",
+    "snappy": "snappy",
+    "zlib": "zlib",
+}
+
+def mongo_client_options():
+    """Build the Motor client options from the environment"""
+    options = {}
+    for option, env_var in MONGO_POOL_SETTINGS.items():
+        value = os.environ.get(env_var)
+        if value:
+            options[option] = int(value)
+
+    compressors = []
+    for name in os.environ.get('MONGO_COMPRESSORS', '').split(','):
+        name = name.strip().lower()
+        if not name:
+            continue
+        if name not in MONGO_COMPRESSOR_MODULES:
+            logger.warning(f"Ignoring unknown MongoDB compressor: {name}")
+            continue
+        try:
+            importlib.import_module(MONGO_COMPRESSOR_MODULES[name])
+        except ImportError:
+            logger.warning(f"Ignoring MongoDB compressor {name}: {MONGO_COMPRESSOR_MODULES[name]} is not installed")
+            continue
+        compressors.append(name)
+    if compressors:
+        options["compressors"] = ",".join(compressors)
+    return options
+
+class ConnectionPoolStats(monitoring.ConnectionPoolListener):
+    """Tracks connection pool usage per server from pymongo's pool events"""
+
+    def __init__(self):
+        # Events are published from Motor's executor threads
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.servers = {}
+
+    def _server(self, address):
+        key = f"{address[0]}:{address[1]}"
+        if key not in self.servers:
+            self.servers[key] = {
+                "open_connections": 0,
+                "checked_out": 0,
+                "wait_queue": 0,
+                "max_wait_queue": 0,
+                "checkouts": 0,
+                "checkout_failures": {},
+                "total_wait_ms": 0.0,
+                "max_wait_ms": 0.0,
+                "connections_created": 0,
+                "connections_closed": 0,
+                "pool_cleared": 0,
+            }
+        return self.servers[key]
+
+    def pool_created(self, event):
+        with self._lock:
+            self._server(event.address)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self._server(event.address)["pool_cleared"] += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            server = self._server(event.address)
+            server["open_connections"] += 1
+            server["connections_created"] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            server = self._server(event.address)
+            server["open_connections"] -= 1
+            server["connections_closed"] += 1
+
+    def connection_check_out_started(self, event):
+        # A checkout starts and ends on the same thread, so the wait is timed per thread
+        self._local.started = time.perf_counter()
+        with self._lock:
+            server = self._server(event.address)
+            server["wait_queue"] += 1
+            server["max_wait_queue"] = max(server["max_wait_queue"], server["wait_queue"])
+
+    def _check_out_finished(self, server):
+        server["wait_queue"] -= 1
+        started = getattr(self._local, "started", None)
+        if started is not None:
+            waited_ms = (time.perf_counter() - started) * 1000
+            server["total_wait_ms"] += waited_ms
+            server["max_wait_ms"] = max(server["max_wait_ms"], waited_ms)
+            self._local.started = None
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            server = self._server(event.address)
+            self._check_out_finished(server)
+            reason = str(event.reason)
+            server["checkout_failures"][reason] = server["checkout_failures"].get(reason, 0) + 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            server = self._server(event.address)
+            self._check_out_finished(server)
+            server["checked_out"] += 1
+            server["checkouts"] += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self._server(event.address)["checked_out"] -= 1
+
+    def snapshot(self):
+        """Current stats per server, including derived available/average wait values"""
+        with self._lock:
+            servers = []
+            for address, stats in self.servers.items():
+                stats = dict(stats, checkout_failures=dict(stats["checkout_failures"]))
+                stats["address"] = address
+                stats["available"] = stats["open_connections"] - stats["checked_out"]
+                stats["avg_wait_ms"] = round(stats["total_wait_ms"] / stats["checkouts"], 3) if stats["checkouts"] else 0.0
+                stats["total_wait_ms"] = round(stats["total_wait_ms"], 3)
+                stats["max_wait_ms"] = round(stats["max_wait_ms"], 3)
+                servers.append(stats)
+            return servers
+
+# Request context, visible to everything running on behalf of a request, including
+# pymongo's command listeners (Motor copies the context into its executor threads)
+class RequestContext:
+    def __init__(self, scope):
+        self.scope = scope
+        self.request_id = incoming_request_id(scope) or uuid.uuid4().hex
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.started = time.perf_counter()
+        # MongoDB commands issued while handling the request
+        self.db_commands = 0
+        self.db_time_ms = 0.0
+        # Commands per shape, tracked only with DB_DEBUG (used to spot N+1 patterns)
+        self.db_shapes = collections.Counter() if DB_DEBUG else None
+        # time.monotonic() by which MongoDB work must finish, set by GuardedRoute
+        self.deadline = None
+
+    @property
+    def route(self):
+        # Set by FastAPI once routing has matched the request
+        route = self.scope.get("route")
+        return route.path if route is not None else None
+
+request_context = contextvars.ContextVar("request_context", default=None)
+
+REQUEST_ID_MAX_LENGTH = 128
+
+def incoming_request_id(scope):
+    """X-Request-ID set by a proxy or client, if it is a sane value"""
+    value = dict(scope.get("headers", [])).get(b"x-request-id", b"").decode("latin-1").strip()
+    if value and len(value) <= REQUEST_ID_MAX_LENGTH and value.isprintable():
+        return value
+    return None
+
+class RequestLogFilter(logging.Filter):
+    """Adds the id, method and route of the request being handled to every log record"""
+
+    def filter(self, record):
+        context = request_context.get()
+        if context is not None:
+            record.request_id = context.request_id
+            record.method = context.method
+            record.route = context.route
+        return True
+
+log_handler.addFilter(RequestLogFilter())
+
+# Per-request MongoDB accounting: with DB_DEBUG on, responses carry X-DB-Commands/X-DB-Time-Ms
+# headers, and requests exceeding their route budget or repeating a query shape are reported
+DB_DEBUG = os.environ.get('DB_DEBUG', 'false').lower() == 'true'
+DB_REPEATED_QUERY_THRESHOLD = int(os.environ.get('DB_REPEATED_QUERY_THRESHOLD', '3'))
+
+# Maximum MongoDB commands per request, by (method, route). These are ceilings on the
+# current implementation: lower them as endpoints are optimized, never raise them silently.
+DB_QUERY_BUDGETS = {
+    ("GET", "/api/rooms"): 1,
+    ("POST", "/api/rooms"): 2,
+    ("PUT", "/api/rooms/{room_id}"): 3,
+    ("POST", "/api/rooms/{room_id}/checkin"): 4,
+    ("POST", "/api/rooms/{room_id}/checkin-company"): 3,
+    ("POST", "/api/rooms/{room_id}/checkout"): 5,
+    ("GET", "/api/rooms/{room_id}/current-cost"): 1,
+    ("GET", "/api/rooms/{room_id}/guests"): 1,
+    ("GET", "/api/guests"): 1,
+    ("POST", "/api/guests"): 1,
+    ("PUT", "/api/guests/{guest_id}"): 3,
+    ("GET", "/api/reservations"): 1,
+    ("POST", "/api/reservations"): 4,
+    ("PUT", "/api/reservations/{reservation_id}"): 3,
+    ("GET", "/api/dishes"): 1,
+    ("POST", "/api/dishes"): 1,
+    ("PUT", "/api/dishes/{dish_id}"): 3,
+    ("GET", "/api/orders"): 1,
+    ("POST", "/api/orders"): 2,
+    ("GET", "/api/bills"): 1,
+    ("GET", "/api/enhanced-bills"): 1,
+    ("PUT", "/api/enhanced-bills/{bill_id}/payment"): 3,
+    ("GET", "/api/dashboard"): 5,
+    ("GET", "/api/dashboard/stats"): 5,
+    ("GET", "/api/reports/revenue"): 1,
+    ("GET", "/api/reports/room-occupancy"): 1,
+}
+
+# Metrics
+# A minimal Prometheus text-format registry, safe to update from the event loop
+# and from Motor's executor threads (where pymongo publishes its events).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+METRICS = []
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + "}"
+
+class Counter:
+    """Monotonic counter keyed by label values"""
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = list(self.values.items())
+        for labelvalues, value in values:
+            yield f"{self.name}{format_labels(self.labelnames, labelvalues)} {value}"
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+    kind = "gauge"
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, *labelvalues, value):
+        with self._lock:
+            self.values[labelvalues] = value
+
+class Histogram:
+    """Cumulative histogram with fixed buckets keyed by label values"""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.values = {}
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.values.get(labelvalues)
+            if series is None:
+                # Per-bucket counts (last slot is +Inf), sum, count
+                series = self.values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            values = [(labelvalues, (list(series[0]), series[1], series[2])) for labelvalues, series in self.values.items()]
+        for labelvalues, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket{format_labels(self.labelnames, labelvalues, ('le', le))} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labelnames, labelvalues)} {total}"
+            yield f"{self.name}_count{format_labels(self.labelnames, labelvalues)} {count}"
+
+http_requests_total = Counter("http_requests_total", "HTTP requests handled", ("method", "route", "status"))
+http_request_duration = Histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+http_requests_in_flight = Gauge("http_requests_in_flight", "HTTP requests currently being handled", ("method",))
+http_response_size = Histogram("http_response_size_bytes", "HTTP response body size", ("method", "route"), buckets=SIZE_BUCKETS)
+mongodb_commands_total = Counter("mongodb_commands_total", "MongoDB commands executed", ("collection", "command", "outcome"))
+mongodb_command_duration = Histogram("mongodb_command_duration_seconds", "MongoDB command latency", ("collection", "command"))
+
+def command_collection(command_name, command):
+    """Collection targeted by a MongoDB command, or '' for database/admin commands"""
+    if command_name == "getMore":
+        target = command.get("collection")
+    else:
+        target = command.get(command_name)
+    return target if isinstance(target, str) else ""
+
+class CommandMetrics(monitoring.CommandListener):
+    """Per-collection MongoDB command counts and latencies, plus per-request totals"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._collections = {}
+
+    def started(self, event):
+        collection = command_collection(event.command_name, event.command)
+        context = request_context.get()
+        if context is not None and context.db_shapes is not None:
+            shape = command_filter_shape(event.command_name, event.command)
+            context.db_shapes[f"{event.command_name} {collection} {json.dumps(shape, sort_keys=True)}"] += 1
+        with self._lock:
+            self._collections[(event.connection_id, event.request_id)] = (collection, context)
+
+    def _finished(self, event, outcome):
+        with self._lock:
+            collection, context = self._collections.pop((event.connection_id, event.request_id), ("", None))
+            if context is not None:
+                context.db_commands += 1
+                context.db_time_ms += event.duration_micros / 1000
+        mongodb_commands_total.inc(collection, event.command_name, outcome)
+        mongodb_command_duration.observe(event.duration_micros / 1_000_000, collection, event.command_name)
+
+    def succeeded(self, event):
+        self._finished(event, "success")
+
+    def failed(self, event):
+        self._finished(event, "failure")
+
+# Slow query log
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', '100'))
+SLOW_QUERY_BUFFER_SIZE = int(os.environ.get('SLOW_QUERY_BUFFER_SIZE', '200'))
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(os.environ.get('SLOW_QUERY_EXPLAIN_SAMPLE_RATE', '0'))
+SLOW_QUERY_LOG_FILE = os.environ.get('SLOW_QUERY_LOG_FILE', '')
+
+# Commands that support explain, and where each keeps its filter
+EXPLAINABLE_COMMAND_FILTERS = {
+    "find": "filter",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+    "aggregate": "pipeline",
+    "update": "updates",
+    "delete": "deletes",
+}
+
+# Driver-added fields that must not be sent back inside an explain
+COMMAND_META_FIELDS = {"lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern"}
+
+def redact_shape(value):
+    """Keep the structure of a filter/pipeline but replace every value with '?'"""
+    if isinstance(value, dict):
+        return {key: redact_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact_shape(item) for item in value[:1]]
+    return "?"
+
+def command_filter_shape(command_name, command):
+    field = EXPLAINABLE_COMMAND_FILTERS.get(command_name)
+    if field is None:
+        return None
+    target = command.get(field)
+    if command_name in ("update", "delete") and target:
+        target = target[0].get("q")
+    return redact_shape(target) if target is not None else None
+
+def reply_document_count(command_name, reply):
+    """Number of documents returned or affected, as reported in the command reply"""
+    if "cursor" in reply:
+        return len(reply["cursor"].get("firstBatch", reply["cursor"].get("nextBatch", [])))
+    if command_name == "distinct":
+        return len(reply.get("values", []))
+    if "n" in reply:
+        return reply["n"]
+    return None
+
+def find_key(document, key):
+    """Depth-first search for the first value stored under `key` in an explain document"""
+    if isinstance(document, dict):
+        if key in document:
+            return document[key]
+        items = document.values()
+    elif isinstance(document, list):
+        items = document
+    else:
+        return None
+    for item in items:
+        found = find_key(item, key)
+        if found is not None:
+            return found
+    return None
+
+def plan_stages(plan):
+    """Stage names of a winning plan, outermost first"""
+    stages = []
+    while isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0] or plan.get("queryPlan")
+    return stages
+
+def summarize_explain(explain):
+    """The parts of explain("executionStats") output that matter for a slow query"""
+    stats = find_key(explain, "executionStats") or {}
+    stages = plan_stages(find_key(explain, "winningPlan"))
+    return {
+        "docs_examined": stats.get("totalDocsExamined"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "docs_returned": stats.get("nReturned"),
+        "execution_time_ms": stats.get("executionTimeMillis"),
+        "plan": stages,
+        "collscan": "COLLSCAN" in stages,
+    }
+
+class SlowQueryLog(monitoring.CommandListener):
+    """Keeps the most recent commands slower than SLOW_QUERY_THRESHOLD_MS"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self.entries = collections.deque(maxlen=SLOW_QUERY_BUFFER_SIZE)
+        self.loop = None
+        self.file_logger = None
+        if SLOW_QUERY_LOG_FILE:
+            self.file_logger = logging.getLogger("slow_queries")
+            self.file_logger.propagate = False
+            handler = logging.handlers.RotatingFileHandler(SLOW_QUERY_LOG_FILE, maxBytes=10 * 1024 * 1024, backupCount=5)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.file_logger.addHandler(queued_handler(handler))
+
+    def started(self, event):
+        if event.command_name == "explain":
+            return
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (event.command, event.database_name, request_context.get())
+
+    def failed(self, event):
+        with self._lock:
+            self._pending.pop((event.connection_id, event.request_id), None)
+
+    def succeeded(self, event):
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+        duration_ms = event.duration_micros / 1000
+        if pending is None or duration_ms < SLOW_QUERY_THRESHOLD_MS:
+            return
+
+        command, database_name, context = pending
+        entry = {
+            "id": str(uuid.uuid4()),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "route": context.route if context else None,
+            "method": context.method if context else None,
+            "database": database_name,
+            "collection": command_collection(event.command_name, command),
+            "command": event.command_name,
+            "duration_ms": round(duration_ms, 3),
+            "filter_shape": command_filter_shape(event.command_name, command),
+            "docs_returned": reply_document_count(event.command_name, event.reply),
+            "explain": None,
+        }
+        explainable = event.command_name in EXPLAINABLE_COMMAND_FILTERS
+        if explainable:
+            # Kept in memory only, for explain; never logged or returned
+            entry["_command"] = {key: value for key, value in command.items() if key not in COMMAND_META_FIELDS}
+
+        with self._lock:
+            self.entries.append(entry)
+
+        logger.warning(f"Slow MongoDB {entry['command']} on {entry['collection']} took {entry['duration_ms']}ms (route {entry['route']})")
+        if explainable and self.loop is not None and random.random() < SLOW_QUERY_EXPLAIN_SAMPLE_RATE:
+            asyncio.run_coroutine_threadsafe(self.explain(entry["id"]), self.loop)
+        elif self.file_logger:
+            self.file_logger.info(json.dumps(self.public(entry), default=str))
+
+    def public(self, entry):
+        return {key: value for key, value in entry.items() if not key.startswith("_")}
+
+    def get(self, entry_id):
+        with self._lock:
+            return next((entry for entry in self.entries if entry["id"] == entry_id), None)
+
+    def recent(self, limit=50):
+        with self._lock:
+            entries = list(self.entries)[-limit:]
+        return [self.public(entry) for entry in reversed(entries)]
+
+    async def explain(self, entry_id):
+        """Run explain("executionStats") for a recorded command and attach the summary"""
+        entry = self.get(entry_id)
+        if entry is None or "_command" not in entry:
+            return None
+        try:
+            result = await client[entry["database"]].command({"explain": entry["_command"], "verbosity": "executionStats"})
+            entry["explain"] = summarize_explain(result)
+        except Exception as e:
+            entry["explain"] = {"error": str(e)}
+        if self.file_logger:
+            self.file_logger.info(json.dumps(self.public(entry), default=str))
+        return self.public(entry)
+
+# Event loop stall detection
+# A coroutine measures how late the loop wakes it up; a watchdog thread notices when
+# the loop stops ticking altogether and captures the stack of the code blocking it.
+LOOP_MONITOR_INTERVAL_MS = float(os.environ.get('LOOP_MONITOR_INTERVAL_MS', '50'))
+LOOP_STALL_THRESHOLD_MS = float(os.environ.get('LOOP_STALL_THRESHOLD_MS', '200'))
+
+event_loop_lag = Histogram("event_loop_lag_seconds", "Delay between scheduled and actual event loop wake-ups",
+                           buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+event_loop_stalls_total = Counter("event_loop_stalls_total", "Event loop stalls longer than LOOP_STALL_THRESHOLD_MS", ("route",))
+
+class LoopStallDetector:
+    """Measures event loop lag and reports blocking code with the route that ran it"""
+
+    def __init__(self):
+        self.heartbeat = time.perf_counter()
+        self.loop_thread_id = None
+        self.captured = None
+        self.stalls = collections.deque(maxlen=100)
+        self.routes_by_code = {}
+        self._stopped = threading.Event()
+        self._task = None
+
+    def start(self):
+        self.loop_thread_id = threading.get_ident()
+        # Map endpoint code objects (and the functions behind decorators) to route paths
+        for route in app.routes:
+            endpoint = getattr(route, "endpoint", None)
+            while endpoint is not None:
+                if hasattr(endpoint, "__code__"):
+                    self.routes_by_code[endpoint.__code__] = route.path
+                endpoint = getattr(endpoint, "__wrapped__", None)
+
+        self.heartbeat = time.perf_counter()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self.monitor())
+        threading.Thread(target=self.watchdog, name="loop-stall-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+
+    async def monitor(self):
+        interval = LOOP_MONITOR_INTERVAL_MS / 1000
+        while True:
+            scheduled = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.heartbeat = time.perf_counter()
+            lag = self.heartbeat - scheduled - interval
+            event_loop_lag.observe(max(lag, 0.0))
+            if lag * 1000 >= LOOP_STALL_THRESHOLD_MS:
+                self.record_stall(lag * 1000)
+
+    def watchdog(self):
+        while not self._stopped.wait(LOOP_MONITOR_INTERVAL_MS / 2000):
+            blocked_ms = (time.perf_counter() - self.heartbeat) * 1000 - LOOP_MONITOR_INTERVAL_MS
+            if blocked_ms >= LOOP_STALL_THRESHOLD_MS and self.captured is None:
+                frame = sys._current_frames().get(self.loop_thread_id)
+                if frame is not None:
+                    self.captured = {
+                        "route": self.route_for_frame(frame),
+                        "stack": traceback.format_stack(frame),
+                    }
+
+    def route_for_frame(self, frame):
+        while frame is not None:
+            route = self.routes_by_code.get(frame.f_code)
+            if route:
+                return route
+            frame = frame.f_back
+        return None
+
+    def record_stall(self, duration_ms):
+        # The stack is only available if the watchdog caught the loop while it was still blocked
+        captured, self.captured = self.captured or {}, None
+        route = captured.get("route") or "unknown"
+        stall = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "duration_ms": round(duration_ms, 1),
+            "route": route,
+            "stack": captured.get("stack", []),
+        }
+        self.stalls.append(stall)
+        event_loop_stalls_total.inc(route)
+        logger.warning(f"Event loop blocked for {stall['duration_ms']}ms (route {route})\n" + "".join(stall["stack"][-8:]))
+
+loop_stall_detector = LoopStallDetector()
+
+def render_metrics():
+    """All registered metrics plus connection pool gauges in Prometheus text format"""
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+
+    pool_gauges = {
+        "mongodb_pool_open_connections": "open_connections",
+        "mongodb_pool_checked_out_connections": "checked_out",
+        "mongodb_pool_available_connections": "available",
+        "mongodb_pool_wait_queue": "wait_queue",
+    }
+    servers = pool_stats.snapshot()
+    for name, key in pool_gauges.items():
+        lines.append(f"# TYPE {name} gauge")
+        for server in servers:
+            lines.append(f"{name}{format_labels(('address',), (server['address'],))} {server[key]}")
+    lines.append("# HELP log_records_dropped_total Log records dropped because the log queue was full")
+    lines.append("# TYPE log_records_dropped_total counter")
+    lines.append(f"log_records_dropped_total {log_handler.dropped}")
+    return "\n".join(lines) + "\n"
+
+# Database handle layers
+# `db` is a DatabaseProxy: every collection operation, and the read of every find/aggregate
+# cursor, runs through a list of layers (MongoGuard, and FaultInjector when enabled). A layer
+# has `async call(collection, operation, invoke)` and awaits `invoke()` to run the operation.
+DB_CURSOR_OPERATIONS = {"find", "aggregate"}
+DB_OPERATIONS = {
+    "find_one", "count_documents", "estimated_document_count", "distinct", "insert_one", "insert_many",
+    "update_one", "update_many", "replace_one", "delete_one", "delete_many", "find_one_and_update",
+    "find_one_and_replace", "find_one_and_delete", "bulk_write",
+}
+DB_CURSOR_MODIFIERS = {"sort", "limit", "skip", "batch_size", "hint", "collation", "max_time_ms", "allow_disk_use"}
+
+async def run_db_layers(layers, collection, operation, invoke):
+    for layer in reversed(layers):
+        invoke = functools.partial(layer.call, collection, operation, invoke)
+    return await invoke()
+
+class CursorProxy:
+    """Deferred find/aggregate cursor, rebuilt on every attempt so a retried read starts over"""
+
+    def __init__(self, collection, layers, operation, args, kwargs):
+        self._collection = collection
+        self._layers = layers
+        self._operation = operation
+        self._args = args
+        self._kwargs = kwargs
+        self._modifiers = []
+
+    def __getattr__(self, name):
+        if name not in DB_CURSOR_MODIFIERS:
+            raise AttributeError(name)
+
+        def modifier(*args, **kwargs):
+            self._modifiers.append((name, args, kwargs))
+            return self
+        return modifier
+
+    def build(self):
+        cursor = getattr(self._collection, self._operation)(*self._args, **self._kwargs)
+        for name, args, kwargs in self._modifiers:
+            cursor = getattr(cursor, name)(*args, **kwargs)
+        return cursor
+
+    async def to_list(self, length=None):
+        return await run_db_layers(self._layers, self._collection.name, self._operation,
+                                   lambda: self.build().to_list(length=length))
 
-client = AsyncIOMotorClient(mongo_url)
-db = client[db_name]
+class CollectionProxy:
+    def __init__(self, collection, layers):
+        self._collection = collection
+        self._layers = layers
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in DB_OPERATIONS:
+            return lambda *args, **kwargs: run_db_layers(self._layers, self._collection.name, name,
+                                                         lambda: attr(*args, **kwargs))
+        if name in DB_CURSOR_OPERATIONS:
+            return lambda *args, **kwargs: CursorProxy(self._collection, self._layers, name, args, kwargs)
+        return attr
+
+class DatabaseProxy:
+    """Motor database handle whose collection operations run through the layers"""
+
+    def __init__(self, database, layers):
+        self._database = database
+        self.layers = layers
+
+    def __getitem__(self, name):
+        return CollectionProxy(self._database[name], self.layers)
+
+    def __getattr__(self, name):
+        attr = getattr(self._database, name)
+        if isinstance(attr, AsyncIOMotorCollection):
+            return CollectionProxy(attr, self.layers)
+        return attr
+
+# Fault injection (testing only)
+# With FAULT_INJECTION_ENABLED=true the FaultInjector joins the `db` layers, and rules set through
+# PUT /api/admin/faults can add latency, raise transient errors before an operation, or drop
+# the connection after it ran (the write happened, the caller still sees an error).
+# It is refused (logged and left off) when ENVIRONMENT=production.
+def fault_injection_enabled(environ=os.environ):
+    if environ.get('FAULT_INJECTION_ENABLED', 'false').lower() != 'true':
+        return False
+    if environ.get('ENVIRONMENT', 'development').lower() == 'production':
+        logger.error("FAULT_INJECTION_ENABLED=true is ignored with ENVIRONMENT=production; fault injection stays off")
+        return False
+    return True
+
+FAULT_INJECTION_ENABLED = fault_injection_enabled()
+
+FAULT_ERRORS = {
+    "AutoReconnect": lambda: AutoReconnect("injected fault: connection reset"),
+    "NotPrimaryError": lambda: NotPrimaryError("injected fault: not primary", {"code": 10107}),
+    "NetworkTimeout": lambda: NetworkTimeout("injected fault: network timeout"),
+    "ExecutionTimeout": lambda: ExecutionTimeout("injected fault: operation exceeded time limit", 50),
+    "ServerSelectionTimeoutError": lambda: ServerSelectionTimeoutError("injected fault: no servers available"),
+}
+
+class FaultRule(BaseModel):
+    collection: str = "*"
+    operation: str = "*"
+    latency_ms: float = 0
+    latency_distribution: str = "fixed"  # fixed, uniform (0 to 2x), exponential
+    latency_rate: float = 1.0  # Fraction of matching operations that get the latency
+    error: Optional[str] = None  # One of FAULT_ERRORS
+    error_rate: float = 0.0
+    drop_rate: float = 0.0  # Fraction of operations that run but then lose the connection
+    remaining: Optional[int] = None  # Rule expires after this many injected faults
+
+class FaultInjector:
+    """Applies FaultRules to MongoDB operations"""
+
+    def __init__(self):
+        self.rules = []
+        self.injected = collections.Counter()
+
+    def configure(self, rules):
+        for rule in rules:
+            if rule.error is not None and rule.error not in FAULT_ERRORS:
+                raise ValueError(f"Unknown error {rule.error}, expected one of {sorted(FAULT_ERRORS)}")
+            if rule.latency_distribution not in ("fixed", "uniform", "exponential"):
+                raise ValueError(f"Unknown latency distribution {rule.latency_distribution}")
+        self.rules = list(rules)
+        self.injected.clear()
+
+    def matching(self, collection, operation):
+        return [
+            rule for rule in self.rules
+            if rule.collection in ("*", collection) and rule.operation in ("*", operation)
+            and (rule.remaining is None or rule.remaining > 0)
+        ]
+
+    def count(self, rule, kind, collection, operation):
+        self.injected[f"{kind}:{collection}.{operation}"] += 1
+        if rule.remaining is not None:
+            rule.remaining -= 1
+
+    async def before(self, collection, operation):
+        for rule in self.matching(collection, operation):
+            if rule.latency_ms and random.random() < rule.latency_rate:
+                if rule.latency_distribution == "uniform":
+                    delay = random.uniform(0, 2 * rule.latency_ms)
+                elif rule.latency_distribution == "exponential":
+                    delay = random.expovariate(1 / rule.latency_ms)
+                else:
+                    delay = rule.latency_ms
+                self.count(rule, "latency", collection, operation)
+                await asyncio.sleep(delay / 1000)
+            if rule.error and random.random() < rule.error_rate:
+                self.count(rule, rule.error, collection, operation)
+                raise FAULT_ERRORS[rule.error]()
+
+    def after(self, collection, operation):
+        for rule in self.matching(collection, operation):
+            if rule.drop_rate and random.random() < rule.drop_rate:
+                self.count(rule, "drop", collection, operation)
+                raise AutoReconnect("injected fault: connection dropped after the operation was sent")
+
+    async def call(self, collection, operation, invoke):
+        await self.before(collection, operation)
+        result = await invoke()
+        self.after(collection, operation)
+        return result
+
+# Deadlines, retries and circuit breaker
+# Every API route belongs to a route class with a MongoDB deadline: its handler runs under
+# pymongo.timeout(), so each command gets maxTimeMS/socket timeouts from the remaining budget.
+# Reads that fail with a transient error are retried with jittered exponential backoff while
+# the deadline allows. After MONGO_CIRCUIT_FAILURE_THRESHOLD consecutive failures the circuit
+# opens and requests fail fast with a 503 until a probe succeeds MONGO_CIRCUIT_RESET_SECONDS later.
+ROUTE_DEADLINES_MS = {
+    "critical": float(os.environ.get('MONGO_DEADLINE_CRITICAL_MS', '5000')),
+    "interactive": float(os.environ.get('MONGO_DEADLINE_INTERACTIVE_MS', '3000')),
+    "analytics": float(os.environ.get('MONGO_DEADLINE_ANALYTICS_MS', '20000')),
+    # Migrations process whole collections in batches
+    "maintenance": None,
+}
+MONGO_RETRY_ATTEMPTS = int(os.environ.get('MONGO_RETRY_ATTEMPTS', '3'))
+MONGO_RETRY_BASE_DELAY_MS = float(os.environ.get('MONGO_RETRY_BASE_DELAY_MS', '50'))
+MONGO_RETRY_MAX_DELAY_MS = float(os.environ.get('MONGO_RETRY_MAX_DELAY_MS', '1000'))
+MONGO_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('MONGO_CIRCUIT_FAILURE_THRESHOLD', '5'))
+MONGO_CIRCUIT_RESET_SECONDS = float(os.environ.get('MONGO_CIRCUIT_RESET_SECONDS', '10'))
+
+# Front-desk flows that move guests or money
+CRITICAL_ROUTES = {
+    ("POST", "/api/rooms/{room_id}/checkin"),
+    ("POST", "/api/rooms/{room_id}/checkin-company"),
+    ("POST", "/api/rooms/{room_id}/checkout"),
+    ("POST", "/api/reservations/{reservation_id}/checkin"),
+    ("POST", "/api/orders"),
+    ("PUT", "/api/enhanced-bills/{bill_id}/payment"),
+    ("POST", "/api/admin/login"),
+    ("POST", "/api/admin/logout"),
+}
+# Reports and admin tooling only; the dashboard and bill lookups are front-desk reads that every
+# open tab polls, so they stay interactive
+ANALYTICS_ROUTE_PREFIXES = ("/api/reports/", "/api/orders/company-", "/api/admin/")
+MAINTENANCE_ROUTE_PREFIXES = ("/api/migrat",)
+
+def classify_route(method, route):
+    """critical, interactive, analytics or maintenance"""
+    if (method, route) in CRITICAL_ROUTES:
+        return "critical"
+    if route.startswith(MAINTENANCE_ROUTE_PREFIXES):
+        return "maintenance"
+    if route.startswith(ANALYTICS_ROUTE_PREFIXES):
+        return "analytics"
+    return "interactive"
+
+# Reads can always be repeated; writes are left to the driver's own retryable writes
+MONGO_IDEMPOTENT_OPERATIONS = {"find", "aggregate", "find_one", "count_documents", "estimated_document_count", "distinct"}
+
+mongodb_retries_total = Counter("mongodb_retries_total", "MongoDB operations retried after a transient error", ("collection", "operation"))
+mongodb_circuit_state = Gauge("mongodb_circuit_state", "MongoDB circuit breaker state (0 closed, 1 half-open, 2 open)")
+
+class DatabaseUnavailable(Exception):
+    """Raised instead of calling MongoDB while the circuit is open"""
+
+    def __init__(self, retry_after):
+        super().__init__("Database temporarily unavailable")
+        self.retry_after = retry_after
+
+def is_transient_mongo_error(error):
+    """Network errors, failovers and timeouts: the database, not the request, is the problem"""
+    return isinstance(error, (AutoReconnect, ExecutionTimeout)) or getattr(error, "timeout", False)
+
+def is_deadline_error(error):
+    """
+    The server gave up on the operation at its maxTimeMS: the query was too slow, MongoDB is fine.
+    pymongo.timeout() sets maxTimeMS just below the request deadline, so a slow report on a healthy
+    server ends here; socket and pool wait-queue timeouts mean MongoDB did not answer in time at all.
+    """
+    return isinstance(error, ExecutionTimeout)
+
+class CircuitBreaker:
+    STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.opened_at_wall = None
+        self.probing = False
+        self.probe_started = None
+        mongodb_circuit_state.set(value=0)
+
+    def _set_state(self, state):
+        if state != self.state:
+            logger.warning(f"MongoDB circuit {self.state} -> {state}")
+        self.state = state
+        mongodb_circuit_state.set(value=self.STATES[state])
+
+    def allow(self):
+        """Whether a call may go to the database now"""
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_seconds:
+                return False
+            self._set_state("half_open")
+            self.probing = False
+        if self.state == "half_open":
+            # Let a single probe through; a probe that never reported back loses its slot after reset_seconds
+            if self.probing and time.monotonic() - self.probe_started < self.reset_seconds:
+                return False
+            self.probing = True
+            self.probe_started = time.monotonic()
+        return True
+
+    def release_probe(self):
+        """The probe ended without telling whether the database is healthy (cancelled, deadline, other error)"""
+        self.probing = False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.probing = False
+        if self.state != "closed":
+            self._set_state("closed")
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self.probing = False
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self.opened_at_wall = datetime.now(timezone.utc)
+            self._set_state("open")
+
+    def retry_after(self):
+        if self.state != "open":
+            return 1
+        return max(1, math.ceil(self.reset_seconds - (time.monotonic() - self.opened_at)))
+
+    def snapshot(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "opened_at": self.opened_at_wall.isoformat() if self.state != "closed" and self.opened_at_wall else None,
+            "retry_after_s": self.retry_after() if self.state == "open" else None,
+        }
+
+class MongoGuard:
+    """Circuit breaker and retries for transient errors, within the request's deadline"""
+
+    def __init__(self):
+        self.breaker = CircuitBreaker(MONGO_CIRCUIT_FAILURE_THRESHOLD, MONGO_CIRCUIT_RESET_SECONDS)
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff in seconds"""
+        cap = min(MONGO_RETRY_MAX_DELAY_MS, MONGO_RETRY_BASE_DELAY_MS * 2 ** (attempt - 1))
+        return random.uniform(0, cap) / 1000
+
+    async def call(self, collection, operation, invoke):
+        attempts = MONGO_RETRY_ATTEMPTS if operation in MONGO_IDEMPOTENT_OPERATIONS else 1
+        for attempt in range(1, attempts + 1):
+            if not self.breaker.allow():
+                raise DatabaseUnavailable(self.breaker.retry_after())
+            probe = self.breaker.state == "half_open"
+            try:
+                result = await invoke()
+            except PyMongoError as e:
+                if not is_transient_mongo_error(e):
+                    # The database answered; the request was at fault
+                    self.breaker.record_success()
+                    raise
+                if is_deadline_error(e):
+                    # A report running out of time says nothing about whether check-in can reach MongoDB
+                    raise
+                self.breaker.record_failure()
+                # Timeouts used up the deadline and server selection already waited; neither is retried
+                if attempt == attempts or getattr(e, "timeout", False) or isinstance(e, ServerSelectionTimeoutError):
+                    raise
+                delay = self.backoff(attempt)
+                context = request_context.get()
+                if context is not None and context.deadline is not None and time.monotonic() + delay >= context.deadline:
+                    raise
+                mongodb_retries_total.inc(collection, operation)
+                logger.warning(f"Retrying {collection}.{operation} after {type(e).__name__} (attempt {attempt}): {e}")
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
+            finally:
+                if probe:
+                    self.breaker.release_probe()
+
+# Admission control
+# Each route class has its own concurrency limit and a bounded queue, so a burst of reports
+# cannot take the event loop and the connection pool away from the front desk. A request
+# arriving while its class's queue is full gets a 429, and one that waited in the queue for
+# longer than ADMISSION_QUEUE_TIMEOUT_MS gets a 503; both carry Retry-After. A limit of 0
+# means unlimited: critical routes are never shed.
+ADMISSION_LIMITS = {
+    "critical": int(os.environ.get('ADMISSION_CRITICAL_CONCURRENCY', '0')),
+    "interactive": int(os.environ.get('ADMISSION_INTERACTIVE_CONCURRENCY', '64')),
+    "analytics": int(os.environ.get('ADMISSION_ANALYTICS_CONCURRENCY', '4')),
+    # Concurrent migration runs are already serialized by the migration lease
+    "maintenance": 0,
+}
+ADMISSION_QUEUE_SIZES = {
+    "critical": 0,
+    "interactive": int(os.environ.get('ADMISSION_INTERACTIVE_QUEUE', '128')),
+    "analytics": int(os.environ.get('ADMISSION_ANALYTICS_QUEUE', '8')),
+    "maintenance": 0,
+}
+ADMISSION_QUEUE_TIMEOUT_MS = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT_MS', '2000'))
+
+admission_in_flight = Gauge("admission_in_flight", "Requests being handled, by route class", ("route_class",))
+admission_queued = Gauge("admission_queued", "Requests waiting for a slot, by route class", ("route_class",))
+admission_rejected_total = Counter("admission_rejected_total", "Requests shed by admission control", ("route_class", "reason"))
+
+class Overloaded(Exception):
+    """Raised when a route class has no capacity left for the request"""
+
+    def __init__(self, status_code, route_class, retry_after):
+        super().__init__(f"Too many {route_class} requests")
+        self.status_code = status_code
+        self.route_class = route_class
+        self.retry_after = retry_after
+
+class AdmissionGate:
+    """Concurrency limit and bounded FIFO wait queue of one route class"""
+
+    def __init__(self, route_class, limit, queue_size, queue_timeout_ms):
+        self.route_class = route_class
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout_ms / 1000
+        self.active = 0
+        # Futures of queued requests; a slot is handed over by resolving one
+        self.waiters = collections.deque()
+        # Moving average of the time a request holds its slot, for Retry-After
+        self.service_time = 0.1
+
+    def retry_after(self):
+        """Seconds until the requests ahead are likely to be done"""
+        return max(1, math.ceil(self.service_time * (len(self.waiters) + 1) / self.limit))
+
+    def reject(self, status_code, reason):
+        admission_rejected_total.inc(self.route_class, reason)
+        raise Overloaded(status_code, self.route_class, self.retry_after())
+
+    async def acquire(self):
+        if not self.limit or (self.active < self.limit and not self.waiters):
+            self.active += 1
+            return
+        if len(self.waiters) >= self.queue_size:
+            self.reject(429, "queue_full")
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        admission_queued.inc(self.route_class)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.reject(503, "queue_timeout")
+        except asyncio.CancelledError:
+            # The slot may have been handed over just before the client went away
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+            admission_queued.dec(self.route_class)
+
+    def release(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                # The slot passes to the next queued request without becoming free
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    async def run(self, call):
+        await self.acquire()
+        admission_in_flight.inc(self.route_class)
+        started = time.monotonic()
+        try:
+            return await call()
+        finally:
+            admission_in_flight.dec(self.route_class)
+            self.service_time = 0.8 * self.service_time + 0.2 * (time.monotonic() - started)
+            self.release()
+
+    def snapshot(self):
+        return {"limit": self.limit or None, "active": self.active, "waiting": len(self.waiters),
+                "queue_size": self.queue_size, "service_time_ms": round(self.service_time * 1000, 1)}
+
+admission_gates = {
+    route_class: AdmissionGate(route_class, limit, ADMISSION_QUEUE_SIZES[route_class], ADMISSION_QUEUE_TIMEOUT_MS)
+    for route_class, limit in ADMISSION_LIMITS.items()
+}
+
+# Request coalescing
+# Identical concurrent GETs to these hot read endpoints (same path and query string) share one
+# in-flight computation: the first caller runs the handler, later callers wait for its response
+# instead of repeating the queries. Nothing is kept after it completes, so a response is never
+# older than the request that produced it. Followers do not take an admission slot.
+COALESCED_ROUTES = {
+    ("GET", "/api/rooms"),
+    ("GET", "/api/dashboard/stats"),
+    ("GET", "/api/reports/room-occupancy"),
+}
+
+coalesced_requests_total = Counter("coalesced_requests_total", "Requests answered by another caller's in-flight computation", ("route",))
+
+class SingleFlight:
+    """Shares one in-flight computation among concurrent callers with the same key"""
+
+    def __init__(self):
+        self.calls = {}
+
+    def forget(self, key, task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        # Retrieve the outcome so a failure nobody waited for is not reported as unhandled
+        if not task.cancelled():
+            task.exception()
+
+    async def run(self, key, route, compute):
+        task = self.calls.get(key)
+        if task is None:
+            # A task of its own, so a caller that disconnects does not cancel it for the others
+            task = asyncio.create_task(compute())
+            self.calls[key] = task
+            task.add_done_callback(functools.partial(self.forget, key))
+        else:
+            coalesced_requests_total.inc(route)
+        response = await asyncio.shield(task)
+        # Middleware (CORS) adds headers to the response in place; every caller sends its own copy
+        response = copy.copy(response)
+        response.raw_headers = list(response.raw_headers)
+        return response
+
+single_flight = SingleFlight()
+
+class GuardedRoute(APIRoute):
+    """Runs the endpoint through the admission gate and under the MongoDB deadline of its route class,
+    coalescing identical concurrent calls to COALESCED_ROUTES"""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        method = next(iter(self.methods))
+        route_class = classify_route(method, self.path)
+        gate = admission_gates[route_class]
+        deadline_ms = ROUTE_DEADLINES_MS[route_class]
+
+        async def run_with_deadline(request):
+            if not deadline_ms:
+                return await handler(request)
+            # The deadline starts once the request is admitted, not while it waits in the queue
+            context = request_context.get()
+            if context is not None:
+                context.deadline = time.monotonic() + deadline_ms / 1000
+            with pymongo.timeout(deadline_ms / 1000):
+                return await handler(request)
+
+        async def guarded_handler(request):
+            return await gate.run(lambda: run_with_deadline(request))
+
+        if (method, self.path) not in COALESCED_ROUTES:
+            return guarded_handler
+
+        async def coalesced_handler(request):
+            key = (method, request.url.path, request.url.query)
+            return await single_flight.run(key, self.path, lambda: guarded_handler(request))
+        return coalesced_handler
+
+client_options = mongo_client_options()
+logger.info(f"MongoDB client options: {client_options}")
+
+pool_stats = ConnectionPoolStats()
+command_metrics = CommandMetrics()
+slow_query_log = SlowQueryLog()
+client = AsyncIOMotorClient(mongo_url, event_listeners=[pool_stats, command_metrics, slow_query_log], **client_options)
+mongo_guard = MongoGuard()
+fault_injector = FaultInjector()
+db_layers = [mongo_guard]
+if FAULT_INJECTION_ENABLED:
+    logger.warning("Fault injection is enabled; rules are managed through /api/admin/faults")
+    db_layers.append(fault_injector)
+db = DatabaseProxy(client[db_name], db_layers)
 
 # Create the main app without a prefix
 app = FastAPI(title="Hotel Management API", version="1.0.0")
 
+# MongoDB outages surface as 503 with Retry-After instead of piling up as 500s
+DATABASE_UNAVAILABLE_DETAIL = "Database temporarily unavailable, please retry"
+
+@app.exception_handler(DatabaseUnavailable)
+async def database_unavailable_handler(request, exc):
+    return JSONResponse(status_code=503, content={"detail": DATABASE_UNAVAILABLE_DETAIL},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+@app.exception_handler(PyMongoError)
+async def mongo_error_handler(request, exc):
+    if is_transient_mongo_error(exc):
+        logger.warning(f"{request.method} {request.url.path} failed: {type(exc).__name__}: {exc}")
+        return JSONResponse(status_code=503, content={"detail": DATABASE_UNAVAILABLE_DETAIL},
+                            headers={"Retry-After": str(mongo_guard.breaker.retry_after())})
+    logger.error(f"{request.method} {request.url.path} failed", exc_info=exc)
+    return JSONResponse(status_code=500, content={"detail": "Internal server error"})
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc):
+    return JSONResponse(status_code=exc.status_code,
+                        content={"detail": f"Too many {exc.route_class} requests, please retry later"},
+                        headers={"Retry-After": str(exc.retry_after)})
+
 # Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", route_class=GuardedRoute)
+
+# Current schema version of the documents stored in each collection.
+# Documents without a schema_version field are version 1.
+SCHEMA_VERSIONS = {
+    "rooms": 2,
+    "bills": 2,
+    "orders": 2,
+    "guests": 1,
+    "reservations": 1,
+    "dishes": 1,
+    "enhanced_bills": 1,
+    "admins": 1,
+}
 
 # Enums
 class RoomType(str, Enum):
@@ -75,6 +1436,7 @@ class Room(BaseModel):
     check_in_date: Optional[datetime] = None
     check_out_date: Optional[datetime] = None
     total_cost: Optional[float] = None
+    schema_version: int = SCHEMA_VERSIONS["rooms"]
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class RoomCreate(BaseModel):
@@ -120,6 +1482,7 @@ class Dish(BaseModel):
     price: float
     status: MealStatus = MealStatus.AVAILABLE
     description: Optional[str] = None
+    schema_version: int = SCHEMA_VERSIONS["dishes"]
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class DishCreate(BaseModel):
@@ -137,6 +1500,7 @@ class Order(BaseModel):
     total_price: float
     order_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     status: str = "pending"  # pending, confirmed, delivered
+    schema_version: int = SCHEMA_VERSIONS["orders"]
 
 class OrderCreate(BaseModel):
     company_name: str
@@ -149,16 +1513,158 @@ class AdminRole(str, Enum):
     RECEPTIONIST = "receptionist"
     MANAGER = "manager"
 
-# Permission decorator  
+# Authentication
+# admin_login issues a signed JWT (HS256) carrying the admin's id, username and role, and
+# require_permission checks the role from the token alone: no MongoDB lookup per request.
+# Verified tokens are cached in memory until they expire. Logged-out tokens are listed in the
+# revoked_tokens collection and every process keeps a copy of that list, refreshed in the
+# background every AUTH_REVOCATION_REFRESH_SECONDS. Passwords are bcrypt hashes, computed and
+# checked in a worker thread. With AUTH_ENABLED=false (the default, until the frontend sends
+# tokens) login still issues tokens but no role is enforced.
+AUTH_ENABLED = os.environ.get('AUTH_ENABLED', 'false').lower() == 'true'
+JWT_ALGORITHM = "HS256"
+JWT_TTL_MINUTES = float(os.environ.get('JWT_TTL_MINUTES', '480'))
+AUTH_REVOCATION_REFRESH_SECONDS = float(os.environ.get('AUTH_REVOCATION_REFRESH_SECONDS', '30'))
+AUTH_TOKEN_CACHE_SIZE = 10000
+BCRYPT_ROUNDS = 12
+# bcrypt only looks at the first 72 bytes; longer passwords are refused rather than truncated
+BCRYPT_MAX_PASSWORD_BYTES = 72
+
+def jwt_secret(environ=os.environ):
+    secret = environ.get('JWT_SECRET', '')
+    if secret:
+        return secret
+    if environ.get('AUTH_ENABLED', 'false').lower() == 'true':
+        # A per-process key would reject tokens issued by the other workers and log everyone out on restart
+        raise RuntimeError("AUTH_ENABLED=true requires JWT_SECRET, a long random value shared by all instances")
+    return secrets.token_urlsafe(32)
+
+JWT_SECRET = jwt_secret()
+
+# A role may do everything the roles below it may do
+ROLE_RANKS = {AdminRole.RECEPTIONIST.value: 0, AdminRole.MANAGER.value: 1, AdminRole.ADMIN.value: 2}
+
+def is_password_hash(value):
+    return isinstance(value, str) and value.startswith(("$2a$", "$2b$", "$2y$"))
+
+async def hash_password(password):
+    encoded = password.encode()
+    if len(encoded) > BCRYPT_MAX_PASSWORD_BYTES:
+        raise ValueError(f"Password must be at most {BCRYPT_MAX_PASSWORD_BYTES} bytes")
+    hashed = await asyncio.to_thread(bcrypt.hashpw, encoded, bcrypt.gensalt(BCRYPT_ROUNDS))
+    return hashed.decode()
+
+@functools.lru_cache(maxsize=1)
+def dummy_password_hash():
+    """Checked against when the username does not exist, so both cases take as long"""
+    return bcrypt.hashpw(secrets.token_bytes(16), bcrypt.gensalt(BCRYPT_ROUNDS))
+
+async def verify_password(password, stored):
+    encoded = password.encode()
+    if stored is None:
+        # The dummy hash costs as much as a real one the first time; keep it off the event loop too
+        dummy = await asyncio.to_thread(dummy_password_hash)
+        await asyncio.to_thread(bcrypt.checkpw, encoded[:BCRYPT_MAX_PASSWORD_BYTES], dummy)
+        return False
+    if len(encoded) > BCRYPT_MAX_PASSWORD_BYTES:
+        return False
+    if not is_password_hash(stored):
+        # Accounts created before hashing; admin_login rehashes them on success
+        return secrets.compare_digest(encoded, str(stored).encode())
+    return await asyncio.to_thread(bcrypt.checkpw, encoded, stored.encode())
+
+def issue_token(admin):
+    """Signed access token for an admin document; returns (token, expires_at)"""
+    now = datetime.now(timezone.utc)
+    expires_at = now + timedelta(minutes=JWT_TTL_MINUTES)
+    claims = {
+        "sub": admin["id"],
+        "username": admin["username"],
+        "role": admin.get("role", AdminRole.RECEPTIONIST.value),
+        "jti": uuid.uuid4().hex,
+        "iat": now,
+        "exp": expires_at,
+    }
+    return jwt.encode(claims, JWT_SECRET, algorithm=JWT_ALGORITHM), expires_at
+
+class RevokedTokens:
+    """Ids of logged-out tokens, mirrored from the revoked_tokens collection"""
+
+    def __init__(self):
+        self.ids = set()
+        # Whether the list was read from MongoDB at least once
+        self.loaded = False
+        self._task = None
+
+    def __contains__(self, token_id):
+        return token_id in self.ids
+
+    async def revoke(self, claims):
+        self.ids.add(claims["jti"])
+        await db.revoked_tokens.update_one(
+            {"_id": claims["jti"]},
+            {"$setOnInsert": {"expires_at": datetime.fromtimestamp(claims["exp"], timezone.utc)}},
+            upsert=True,
+        )
+
+    async def refresh(self):
+        documents = await db.revoked_tokens.find({}, {"_id": 1}).to_list(length=None)
+        self.ids = {document["_id"] for document in documents}
+        self.loaded = True
+
+    def start(self):
+        self._task = asyncio.create_task(self.poll())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def poll(self):
+        while True:
+            try:
+                await self.refresh()
+            except (PyMongoError, DatabaseUnavailable) as e:
+                logger.warning(f"Could not refresh revoked tokens: {e}")
+            await asyncio.sleep(AUTH_REVOCATION_REFRESH_SECONDS)
+
+revoked_tokens = RevokedTokens()
+# token -> verified claims
+verified_tokens = collections.OrderedDict()
+
+def decode_token(token):
+    claims = verified_tokens.get(token)
+    if claims is None:
+        try:
+            claims = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM], options={"require": ["exp", "jti", "sub"]})
+        except jwt.InvalidTokenError:
+            return None
+        verified_tokens[token] = claims
+        while len(verified_tokens) > AUTH_TOKEN_CACHE_SIZE:
+            verified_tokens.popitem(last=False)
+    elif claims["exp"] <= time.time():
+        del verified_tokens[token]
+        return None
+    return claims
+
+def current_admin_claims():
+    """Claims of the bearer token sent with the current request; raises 401 without a valid one"""
+    context = request_context.get()
+    authorization = dict(context.scope["headers"]).get(b"authorization", b"") if context else b""
+    scheme, _, token = authorization.decode("latin-1").partition(" ")
+    claims = decode_token(token.strip()) if scheme.lower() == "bearer" and token else None
+    if claims is None or claims["jti"] in revoked_tokens:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    return claims
+
+# Permission decorator
 def require_permission(required_role: AdminRole):
     def decorator(func):
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            # In real app, you would get current user from JWT token
-            # For demo, we'll skip authentication check
-            # current_admin = get_current_admin_from_token()
-            # if current_admin.role != required_role and current_admin.role != AdminRole.ADMIN:
-            #     raise HTTPException(status_code=403, detail="Insufficient permissions")
+            if AUTH_ENABLED:
+                claims = current_admin_claims()
+                if ROLE_RANKS.get(claims["role"], -1) < ROLE_RANKS[required_role.value]:
+                    raise HTTPException(status_code=403, detail="Insufficient permissions")
             return await func(*args, **kwargs)
         return wrapper
     return decorator
@@ -168,6 +1674,7 @@ class Admin(BaseModel):
     username: str
     password: str
     role: AdminRole = AdminRole.RECEPTIONIST
+    schema_version: int = SCHEMA_VERSIONS["admins"]
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class AdminLogin(BaseModel):
@@ -178,12 +1685,18 @@ class AdminResponse(BaseModel):
     id: str
     username: str
     role: AdminRole
+
+class LoginResponse(AdminResponse):
+    access_token: str
+    token_type: str = "bearer"
+    expires_at: datetime
 class Guest(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
     phone: Optional[str] = None
     email: Optional[str] = None
     id_card: Optional[str] = None
+    schema_version: int = SCHEMA_VERSIONS["guests"]
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class GuestCreate(BaseModel):
@@ -213,6 +1726,7 @@ class Reservation(BaseModel):
     end_date: datetime
     status: ReservationStatus = ReservationStatus.PENDING
     total_cost: Optional[float] = None
+    schema_version: int = SCHEMA_VERSIONS["reservations"]
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class ReservationCreate(BaseModel):
@@ -251,6 +1765,7 @@ class EnhancedBill(BaseModel):
     status: BillStatus = BillStatus.UNPAID
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     paid_at: Optional[datetime] = None
+    schema_version: int = SCHEMA_VERSIONS["enhanced_bills"]
 
 # Helper functions
 def calculate_room_cost(check_in_time: datetime, check_out_time: datetime, pricing: PricingStructure) -> dict:
@@ -312,6 +1827,22 @@ def calculate_room_cost(check_in_time: datetime, check_out_time: datetime, prici
         "calculation_type": calculation_type,
         "details": details
     }
+
+def calculate_booking_cost(booking_type: BookingType, duration: int, pricing: PricingStructure) -> float:
+    """Calculate the pre-paid cost of a booking from its type and duration"""
+    if booking_type == BookingType.HOURLY:
+        if duration <= 1:
+            return pricing.hourly_first
+        elif duration <= 2:
+            return pricing.hourly_first + pricing.hourly_second
+        else:
+            return pricing.hourly_first + pricing.hourly_second + ((duration - 2) * pricing.hourly_additional)
+    elif booking_type == BookingType.DAILY:
+        return pricing.daily_rate * duration
+    elif booking_type == BookingType.MONTHLY:
+        return pricing.monthly_rate * duration
+    raise ValueError(f"Invalid booking type: {booking_type}")
+
 def prepare_for_mongo(data):
     if isinstance(data, dict):
         for key, value in data.items():
@@ -329,104 +1860,991 @@ def parse_from_mongo(item):
                     pass
     return item
 
+def as_utc_datetime(value):
+    """Parse a stored datetime (ISO string with or without offset, or datetime) as an aware UTC-based datetime"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        # Assume UTC if no timezone info
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+def normalize_datetime_fields(doc, fields):
+    """Rewrite the given datetime fields as ISO strings with an explicit offset"""
+    for field in fields:
+        if doc.get(field) is not None:
+            doc[field] = as_utc_datetime(doc[field]).isoformat()
+
+def legacy_guests(doc):
+    """Build the guests list of a document that only has the legacy guest_name field"""
+    if doc.get("guest_name"):
+        return [RoomGuest(name=doc["guest_name"]).dict()]
+    return []
+
+# Lazy schema upgrades: SCHEMA_UPGRADES[collection][version] turns a document of
+# that version into the next one. Documents are upgraded when they are read, so
+# old data never needs a full-collection rewrite.
+def upgrade_room_v1(room):
+    """v2: rooms always have company_name/guests, a booking_type when occupied and offset-aware dates"""
+    if "guests" not in room or (not room["guests"] and room.get("guest_name")):
+        room["guests"] = legacy_guests(room)
+    if "company_name" not in room:
+        room["company_name"] = "Cá nhân" if room.get("guest_name") else None
+    if room.get("status") == "occupied" and not room.get("booking_type"):
+        room["booking_type"] = "hourly"  # Older check-ins were all hourly
+    normalize_datetime_fields(room, ["check_in_date", "check_out_date"])
+    return room
+
+def upgrade_bill_v1(bill):
+    """v2: bills always have booking_type, company_name and guests"""
+    if not bill.get("booking_type"):
+        bill["booking_type"] = "hourly"
+    if not bill.get("guests"):
+        bill["guests"] = legacy_guests(bill)
+    if not bill.get("company_name"):
+        bill["company_name"] = "Cá nhân"
+    return bill
+
+def upgrade_order_v1(order):
+    """v2: order_date is an ISO string with an explicit offset"""
+    normalize_datetime_fields(order, ["order_date"])
+    return order
+
+SCHEMA_UPGRADES = {
+    "rooms": {1: upgrade_room_v1},
+    "bills": {1: upgrade_bill_v1},
+    "orders": {1: upgrade_order_v1},
+}
+
+# Persist upgraded documents the first time they are read
+SCHEMA_WRITE_BACK = os.environ.get('SCHEMA_WRITE_BACK', 'false').lower() == 'true'
+_write_back_tasks = set()
+
+def upgrade_document(collection_name, doc):
+    """Bring a document read from `collection_name` up to the current schema version"""
+    if doc is None:
+        return None
+
+    version = doc.get("schema_version", 1)
+    target = SCHEMA_VERSIONS[collection_name]
+    if version >= target:
+        return doc
+
+    original = dict(doc)
+    upgrades = SCHEMA_UPGRADES.get(collection_name, {})
+    while version < target:
+        doc = upgrades[version](doc) if version in upgrades else doc
+        version += 1
+    doc["schema_version"] = target
+
+    if SCHEMA_WRITE_BACK and "_id" in doc:
+        # Snapshot the upgraded form: callers go on to mutate the document (parse_from_mongo)
+        task = asyncio.create_task(write_back_document(collection_name, original, dict(doc)))
+        _write_back_tasks.add(task)
+        task.add_done_callback(_write_back_tasks.discard)
+    return doc
+
+async def write_back_document(collection_name, original, upgraded):
+    """Store the fields changed by an upgrade, unless the document changed since it was read"""
+    changed = {key: value for key, value in upgraded.items() if key not in original or original[key] != value}
+
+    # Compare-and-set on the original values so a concurrent write is never overwritten
+    query = {"_id": original["_id"]}
+    for key in changed:
+        query[key] = original[key] if key in original else {"$exists": False}
+
+    try:
+        await db[collection_name].update_one(query, {"$set": changed})
+    except Exception:
+        logger.exception(f"Schema write-back failed for {collection_name} {original['_id']}")
+
+# Query builders, shared by the routes and the query-plan tests (tests/test_query_plans.py)
+def date_range_filter(start_date=None, end_date=None):
+    """Range condition on an ISO date string field, or None when unbounded"""
+    date_filter = {}
+    if start_date:
+        date_filter["$gte"] = start_date
+    if end_date:
+        date_filter["$lte"] = end_date
+    return date_filter or None
+
+def orders_filter(start_date=None, end_date=None, company_name=None, dish_name=None):
+    """Filter for the order list"""
+    filter_query = {}
+
+    # Date filter
+    date_filter = date_range_filter(start_date, end_date)
+    if date_filter:
+        filter_query["order_date"] = date_filter
+
+    # Company name filter (case-insensitive partial match)
+    if company_name:
+        filter_query["company_name"] = {"$regex": company_name, "$options": "i"}
+
+    # Dish name filter (case-insensitive partial match)
+    if dish_name:
+        filter_query["dish_name"] = {"$regex": dish_name, "$options": "i"}
+
+    return filter_query
+
+def reservation_overlap_filter(room_id, start_date, end_date):
+    """Active reservations of a room that overlap the given period"""
+    return {
+        "room_id": room_id,
+        "status": {"$in": ["confirmed", "checked_in"]},
+        "$or": [
+            {"start_date": {"$lte": end_date.isoformat()},
+             "end_date": {"$gte": start_date.isoformat()}}
+        ]
+    }
+
+def company_report_pipeline(company_name, start_date=None, end_date=None, group_by="daily"):
+    """Aggregation pipeline for one company's orders grouped per day or month"""
+    # Base match stage
+    match_stage = {
+        "company_name": {"$regex": company_name, "$options": "i"}
+    }
+    date_filter = date_range_filter(start_date, end_date)
+    if date_filter:
+        match_stage["order_date"] = date_filter
+
+    # Group by date format
+    if group_by == "monthly":
+        date_format = "%Y-%m"
+    else:  # daily
+        date_format = "%Y-%m-%d"
+
+    return [
+        {"$match": match_stage},
+        {
+            "$group": {
+                "_id": {
+                    "date": {"$dateToString": {"format": date_format, "date": {"$dateFromString": {"dateString": "$order_date"}}}},
+                    "company": "$company_name"
+                },
+                "total_orders": {"$sum": 1},
+                "total_amount": {"$sum": "$total_price"},
+                "orders": {
+                    "$push": {
+                        "dish_name": "$dish_name",
+                        "quantity": "$quantity",
+                        "unit_price": "$unit_price",
+                        "total_price": "$total_price",
+                        "order_date": "$order_date"
+                    }
+                }
+            }
+        },
+        {"$sort": {"_id.date": -1}}
+    ]
+
+def companies_summary_pipeline(start_date=None, end_date=None):
+    """Aggregation pipeline for the per-company order summary"""
+    match_stage = {}
+    date_filter = date_range_filter(start_date, end_date)
+    if date_filter:
+        match_stage["order_date"] = date_filter
+
+    return [
+        {"$match": match_stage},
+        {
+            "$group": {
+                "_id": "$company_name",
+                "total_orders": {"$sum": 1},
+                "total_amount": {"$sum": "$total_price"},
+                "unique_dishes": {"$addToSet": "$dish_name"},
+                "last_order_date": {"$max": "$order_date"}
+            }
+        },
+        {"$sort": {"total_amount": -1}}
+    ]
+
+def distinct_values_pipeline(field):
+    """Sorted distinct values of an order field"""
+    return [
+        {"$group": {"_id": f"${field}"}},
+        {"$sort": {"_id": 1}}
+    ]
+
+def popular_dishes_pipeline(limit):
+    """Most ordered dishes by total quantity"""
+    return [
+        {
+            "$group": {
+                "_id": "$dish_id",
+                "dish_name": {"$first": "$dish_name"},
+                "total_quantity": {"$sum": "$quantity"},
+                "total_revenue": {"$sum": "$total_price"},
+                "order_count": {"$sum": 1}
+            }
+        },
+        {"$sort": {"total_quantity": -1}},
+        {"$limit": limit}
+    ]
+
+def room_occupancy_pipeline():
+    """Room counts per type, split by occupied/empty"""
+    return [
+        {
+            "$group": {
+                "_id": "$type",
+                "total_rooms": {"$sum": 1},
+                "occupied_rooms": {
+                    "$sum": {
+                        "$cond": [{"$eq": ["$status", "occupied"]}, 1, 0]
+                    }
+                },
+                "empty_rooms": {
+                    "$sum": {
+                        "$cond": [{"$eq": ["$status", "empty"]}, 1, 0]
+                    }
+                }
+            }
+        }
+    ]
+
+# Default data seeded on first startup
+DEFAULT_ROOMS = [
+    # Single rooms
+    {"number": "201", "type": "single"},
+    {"number": "206", "type": "single"},
+    {"number": "207", "type": "single"},
+    # Double rooms
+    {"number": "101", "type": "double"},
+    {"number": "102", "type": "double"},
+    {"number": "103", "type": "double"},
+    {"number": "202", "type": "double"},
+    {"number": "203", "type": "double"},
+    {"number": "204", "type": "double"},
+    {"number": "205", "type": "double"},
+]
+
+# Indexes backing the lookups and filters used by the routes below
+INDEXES = {
+    "rooms": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        # Also what keeps concurrent seeding from inserting a room twice
+        IndexModel([("number", ASCENDING)], unique=True),
+        IndexModel([("status", ASCENDING)]),
+    ],
+    "guests": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("created_at", DESCENDING)]),
+    ],
+    "reservations": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("room_id", ASCENDING), ("status", ASCENDING), ("start_date", ASCENDING)]),
+        IndexModel([("created_at", DESCENDING)]),
+    ],
+    "dishes": [
+        IndexModel([("id", ASCENDING)], unique=True),
+    ],
+    "orders": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("order_date", DESCENDING)]),
+        IndexModel([("company_name", ASCENDING), ("order_date", DESCENDING)]),
+    ],
+    "bills": [
+        IndexModel([("created_at", DESCENDING)]),
+    ],
+    "enhanced_bills": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("created_at", DESCENDING)]),
+    ],
+    "admins": [
+        IndexModel([("username", ASCENDING)]),
+    ],
+    "idempotency_keys": [
+        # Records are removed by MongoDB once expires_at has passed
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "audit_log": [
+        IndexModel([("entity_id", ASCENDING), ("at", DESCENDING)]),
+        IndexModel([("at", DESCENDING)]),
+    ],
+    "revoked_tokens": [
+        # A revoked token only needs listing until it would have expired anyway
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+}
+
+# Audit log
+# State changes (check-ins, checkouts, room and pricing edits, payments, ...) are recorded with
+# `await audit_log.record(...)`, which only puts the event on a bounded in-memory queue. A
+# background task writes the queue to the audit_log collection with insert_many, every
+# AUDIT_FLUSH_INTERVAL_MS or as soon as AUDIT_BATCH_SIZE events are waiting. When the queue is
+# full, record() waits up to AUDIT_BACKPRESSURE_TIMEOUT_MS for room and then writes the event to
+# the spill file itself. Batches MongoDB does not accept are spilled too, and the spill file is
+# replayed after the next successful write. Events carry their own _id, so replays never duplicate.
+# Every process spills to its own file, AUDIT_SPILL_FILE with the pid before the extension
+# (audit-spill.1234.jsonl), and holds an flock on its .lock file while it runs. Spill files whose
+# lock nobody holds were left by a process that died, and are replayed by whichever process
+# takes their lock first.
+AUDIT_QUEUE_SIZE = int(os.environ.get('AUDIT_QUEUE_SIZE', '10000'))
+AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', '500'))
+AUDIT_FLUSH_INTERVAL_MS = float(os.environ.get('AUDIT_FLUSH_INTERVAL_MS', '200'))
+AUDIT_BACKPRESSURE_TIMEOUT_MS = float(os.environ.get('AUDIT_BACKPRESSURE_TIMEOUT_MS', '50'))
+AUDIT_SPILL_FILE = os.environ.get('AUDIT_SPILL_FILE') or str(ROOT_DIR / 'audit-spill.jsonl')
+AUDIT_WRITE_TIMEOUT_SECONDS = 5
+AUDIT_SHUTDOWN_TIMEOUT_SECONDS = 10
+
+audit_events_total = Counter("audit_events_total", "Audit events by outcome", ("outcome",))
+audit_queue_depth = Gauge("audit_queue_depth", "Audit events waiting to be written")
+
+def current_actor():
+    """Username of the bearer token sent with the current request, if any"""
+    try:
+        return current_admin_claims()["username"]
+    except HTTPException:
+        return None
+
+class AuditLog:
+    """Write-behind writer for the audit_log collection"""
+
+    def __init__(self, spill_file=AUDIT_SPILL_FILE):
+        self.spill_root, self.spill_ext = os.path.splitext(spill_file)
+        self.spill_pattern = f"{glob.escape(self.spill_root)}.*{glob.escape(self.spill_ext)}"
+        self.owner_lock = None
+        self.queue = asyncio.Queue(AUDIT_QUEUE_SIZE)
+        self.wakeup = asyncio.Event()
+        self.closing = False
+        # Batch taken off the queue and not yet written, spilled if shutdown times out
+        self.pending = []
+        self.spill_lock = threading.Lock()
+        self.spilled = any(os.path.exists(path) for path in (self.spill_file, self.spill_file + ".replay"))
+        self._task = None
+
+    @property
+    def spill_file(self):
+        """This process's spill file; read on every use so a fork does not share its parent's"""
+        return f"{self.spill_root}.{os.getpid()}{self.spill_ext}"
+
+    async def record(self, event_type, entity, entity_id, details=None):
+        context = request_context.get()
+        event = {
+            "_id": str(uuid.uuid4()),
+            "type": event_type,
+            "entity": entity,
+            "entity_id": entity_id,
+            "actor": current_actor(),
+            "route": f"{context.method} {context.route}" if context else None,
+            "at": datetime.now(timezone.utc).isoformat(),
+            "details": details or {},
+        }
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(self.queue.put(event), AUDIT_BACKPRESSURE_TIMEOUT_MS / 1000)
+            except asyncio.TimeoutError:
+                await self.spill([event])
+                return
+        if self.queue.qsize() >= AUDIT_BATCH_SIZE:
+            self.wakeup.set()
+
+    def take_batch(self):
+        batch = []
+        while len(batch) < AUDIT_BATCH_SIZE and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        audit_queue_depth.set(value=self.queue.qsize())
+        return batch
+
+    async def insert(self, events):
+        """insert_many that treats events already stored (replays) as written"""
+        try:
+            with pymongo.timeout(AUDIT_WRITE_TIMEOUT_SECONDS):
+                await db.audit_log.insert_many(events, ordered=False)
+        except BulkWriteError as e:
+            if any(error["code"] != 11000 for error in e.details.get("writeErrors", [])) or e.details.get("writeConcernErrors"):
+                raise
+
+    async def write(self, batch):
+        try:
+            await self.insert(batch)
+        except Exception as e:
+            # Not only outages: an event BSON can't encode fails the batch too, and is spilled as JSON
+            logger.warning(f"Could not write {len(batch)} audit events, spilling them to {self.spill_file}: {e!r}")
+            await self.spill(batch)
+            return
+        audit_events_total.inc("written", amount=len(batch))
+        if self.spilled:
+            await self.replay_spill()
+
+    def append_to_spill(self, events):
+        lines = "".join(json.dumps(event, default=str, ensure_ascii=False) + "\n" for event in events)
+        with self.spill_lock:
+            with open(self.spill_file, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+    async def spill(self, events):
+        try:
+            await asyncio.to_thread(self.append_to_spill, events)
+        except Exception as e:
+            audit_events_total.inc("lost", amount=len(events))
+            logger.error(f"Lost {len(events)} audit events, spill file {self.spill_file} is not writable: {e}")
+            return
+        self.spilled = True
+        audit_events_total.inc("spilled", amount=len(events))
+
+    def read_spill(self, path):
+        """Events of a spill file; lines torn by a crash mid-write are skipped"""
+        events = []
+        with open(path, encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    audit_events_total.inc("lost")
+                    logger.error(f"Skipping undecodable line {number} of audit spill {path}")
+        return events
+
+    def take_spill(self, spill_file):
+        """Events of a spill file, moved aside so new spills do not mix with the replay"""
+        replay_file = spill_file + ".replay"
+        with self.spill_lock:
+            # A replay file left by an interrupted replay is finished first
+            if not os.path.exists(replay_file):
+                if not os.path.exists(spill_file):
+                    return None, []
+                os.replace(spill_file, replay_file)
+        return replay_file, self.read_spill(replay_file)
+
+    async def replay_file(self, spill_file):
+        """Insert everything in a spill file; False when MongoDB stopped taking the events"""
+        while True:
+            try:
+                replay_file, events = await asyncio.to_thread(self.take_spill, spill_file)
+                if replay_file is None:
+                    return True
+                for start in range(0, len(events), AUDIT_BATCH_SIZE):
+                    await self.insert(events[start:start + AUDIT_BATCH_SIZE])
+            except Exception as e:
+                logger.warning(f"Audit spill replay of {spill_file} stopped, will retry after the next write: {e!r}")
+                return False
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(replay_file)
+            audit_events_total.inc("replayed", amount=len(events))
+            if events:
+                logger.info(f"Replayed {len(events)} spilled audit events from {spill_file}")
+
+    def lock_spill(self, spill_file):
+        """Open and flock spill_file's .lock; None if a live process holds it"""
+        lock = open(spill_file + ".lock", "a")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return None
+        return lock
+
+    def orphaned_spills(self):
+        """Spill files of processes that are gone, each returned with its lock taken"""
+        if fcntl is None:
+            return []
+        spill_files = set()
+        for suffix in ("", ".replay", ".lock"):
+            for path in glob.glob(self.spill_pattern + suffix):
+                spill_file = path.removesuffix(suffix)
+                if spill_file != self.spill_file:
+                    spill_files.add(spill_file)
+        locked = [(spill_file, self.lock_spill(spill_file)) for spill_file in sorted(spill_files)]
+        return [(spill_file, lock) for spill_file, lock in locked if lock is not None]
+
+    async def replay_spill(self):
+        if not await self.replay_file(self.spill_file):
+            return
+        self.spilled = any(os.path.exists(path) for path in (self.spill_file, self.spill_file + ".replay"))
+        for spill_file, lock in await asyncio.to_thread(self.orphaned_spills):
+            try:
+                if await self.replay_file(spill_file):
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(spill_file + ".lock")
+            finally:
+                lock.close()
+
+    async def run(self):
+        # Also picks up spills of processes that died since the last start
+        await self.replay_spill()
+        while not self.closing or not self.queue.empty():
+            if self.queue.qsize() < AUDIT_BATCH_SIZE and not self.closing:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), AUDIT_FLUSH_INTERVAL_MS / 1000)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+            self.pending = self.take_batch()
+            if self.pending:
+                await self.write(self.pending)
+                self.pending = []
+
+    def start(self):
+        if fcntl is not None:
+            self.owner_lock = self.lock_spill(self.spill_file)
+            if self.owner_lock is None:
+                logger.warning(f"Audit spill {self.spill_file} is locked by another process with the same pid")
+        self.closing = False
+        self.wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self, timeout=AUDIT_SHUTDOWN_TIMEOUT_SECONDS):
+        """Write out everything still queued; whatever MongoDB does not take in time is spilled"""
+        if self._task is None:
+            return
+        self.closing = True
+        self.wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            remaining = self.pending + self.take_batch()
+            while not self.queue.empty():
+                remaining.extend(self.take_batch())
+            logger.warning(f"Audit log flush timed out, spilling {len(remaining)} events")
+            await self.spill(remaining)
+        self._task = None
+        if self.owner_lock is not None:
+            if not self.spilled:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(self.spill_file + ".lock")
+            self.owner_lock.close()
+            self.owner_lock = None
+
+audit_log = AuditLog()
+
+# Startup tasks
+async def seed_default_admin():
+    """Create the default admin account if it does not exist yet"""
+    if await db.admins.find_one({"username": "admin"}, {"_id": 1}):
+        return
+    admin = Admin(username="admin", password=await hash_password("admin123"), role=AdminRole.ADMIN)
+    result = await db.admins.update_one(
+        {"username": "admin"},
+        {"$setOnInsert": prepare_for_mongo(admin.dict())},
+        upsert=True
+    )
+    if result.upserted_id is not None:
+        logger.info("Default admin created: username=admin, password=admin123, role=admin")
+
+async def seed_default_rooms():
+    """Create the default rooms when the rooms collection is empty"""
+    if await db.rooms.find_one({}, {"_id": 1}):
+        return
+
+    # Upsert by room number so pods starting at the same time can't double-seed
+    operations = []
+    for room_data in DEFAULT_ROOMS:
+        room_dict = prepare_for_mongo(Room(**room_data).dict())
+        operations.append(UpdateOne(
+            {"number": room_dict["number"]},
+            {"$setOnInsert": room_dict},
+            upsert=True
+        ))
+
+    try:
+        result = await db.rooms.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+        # Another instance inserted the same numbers first
+        logger.info(f"Default rooms created: {e.details['nUpserted']} (the rest were already seeded)")
+        return
+    logger.info(f"Default rooms created: {result.upserted_count}")
+
+# Index options that change what an index enforces; an existing index whose options differ
+# from INDEXES is rebuilt, since create_indexes refuses to change it in place
+ENFORCING_INDEX_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+# Every process runs ensure_indexes when it starts, so rebuilds race with other workers and pods
+INDEX_NOT_FOUND = 27
+INDEX_CONFLICT_CODES = (85, 86)  # IndexOptionsConflict, IndexKeySpecsConflict
+
+async def drop_changed_indexes(collection, indexes):
+    existing = await db[collection].index_information()
+    for index in indexes:
+        spec = index.document
+        current = existing.get(spec["name"])
+        if current is None:
+            continue
+        if any(current.get(option) != spec.get(option) for option in ENFORCING_INDEX_OPTIONS):
+            logger.warning(f"Rebuilding index {collection}.{spec['name']} with new options")
+            try:
+                await db[collection].drop_index(spec["name"])
+            except OperationFailure as e:
+                # Another process dropped it first
+                if e.code != INDEX_NOT_FOUND:
+                    raise
+
+async def ensure_indexes():
+    """Build the indexes declared in INDEXES (no-op for indexes that already exist)"""
+    async def ensure(collection, indexes):
+        await drop_changed_indexes(collection, indexes)
+        try:
+            await db[collection].create_indexes(indexes)
+        except OperationFailure as e:
+            if e.code not in INDEX_CONFLICT_CODES:
+                raise
+            # A process still running the previous release recreated the old index in between;
+            # the next start rebuilds it once that release is gone
+            logger.warning(f"Indexes of {collection} not rebuilt, another process created them concurrently: {e}")
+
+    await asyncio.gather(*[ensure(collection, indexes) for collection, indexes in INDEXES.items()])
+
+async def warm_up_database():
+    """Open the first pooled connection before the app starts taking traffic"""
+    await client.admin.command("ping")
+
+# Data migrations
+# Each migration runs once, tracked by its number in the `migrations` ledger collection.
+# Documents are processed in _id order in batches; the last _id of every batch is
+# stored as a checkpoint so an interrupted run resumes where it stopped.
+MIGRATION_BATCH_SIZE = int(os.environ.get('MIGRATION_BATCH_SIZE', '1000'))
+MIGRATION_LEASE_SECONDS = int(os.environ.get('MIGRATION_LEASE_SECONDS', '300'))
+
+def migrate_room_guest_structure(room):
+    """Build company_name/guests from the legacy guest_name field"""
+    guest = RoomGuest(name=room["guest_name"])
+    return UpdateOne(
+        {"_id": room["_id"]},
+        {"$set": {"company_name": "Cá nhân", "guests": [guest.dict()]}}
+    )
+
+MIGRATIONS = [
+    {
+        "id": 1,
+        "name": "room_guest_structure",
+        "collection": "rooms",
+        # Rooms with guest_name but no company_name (old structure)
+        "filter": {
+            "guest_name": {"$exists": True, "$ne": None},
+            "company_name": {"$exists": False}
+        },
+        "projection": {"_id": 1, "guest_name": 1},
+        "transform": migrate_room_guest_structure,
+    },
+]
+
+def format_migration_ledger(migration, ledger):
+    """Describe a migration and its ledger entry for API responses"""
+    ledger = ledger or {}
+    checkpoint = ledger.get("checkpoint")
+    return {
+        "id": migration["id"],
+        "name": migration["name"],
+        "collection": migration["collection"],
+        "status": ledger.get("status", "pending"),
+        "processed": ledger.get("processed", 0),
+        "modified": ledger.get("modified", 0),
+        "checkpoint": str(checkpoint) if checkpoint is not None else None,
+        "started_at": ledger.get("started_at"),
+        "completed_at": ledger.get("completed_at"),
+    }
+
+async def acquire_migration_lease(migration):
+    """Mark a migration as running, unless another process holds a live lease"""
+    now = datetime.now(timezone.utc)
+    try:
+        return await db.migrations.find_one_and_update(
+            {
+                "_id": migration["id"],
+                "status": {"$ne": "completed"},
+                "$or": [
+                    {"locked_until": {"$exists": False}},
+                    {"locked_until": {"$lt": now.isoformat()}}
+                ]
+            },
+            {
+                "$set": {
+                    "name": migration["name"],
+                    "status": "running",
+                    "locked_until": (now + timedelta(seconds=MIGRATION_LEASE_SECONDS)).isoformat()
+                },
+                "$setOnInsert": {
+                    "checkpoint": None,
+                    "processed": 0,
+                    "modified": 0,
+                    "started_at": now.isoformat()
+                }
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # The ledger entry exists but is completed or leased by another process
+        return None
+
+async def run_migration(migration, dry_run=False, batch_size=MIGRATION_BATCH_SIZE):
+    """Run one migration to completion, resuming from its checkpoint"""
+    collection = db[migration["collection"]]
+
+    if dry_run:
+        ledger = await db.migrations.find_one({"_id": migration["id"]})
+        result = format_migration_ledger(migration, ledger)
+        query = dict(migration["filter"])
+        if ledger and ledger.get("checkpoint") is not None:
+            query["_id"] = {"$gt": ledger["checkpoint"]}
+        result["dry_run"] = True
+        result["pending_documents"] = 0 if result["status"] == "completed" else await collection.count_documents(query)
+        return result
+
+    ledger = await acquire_migration_lease(migration)
+    if ledger is None:
+        ledger = await db.migrations.find_one({"_id": migration["id"]})
+        return format_migration_ledger(migration, ledger)
+
+    checkpoint = ledger.get("checkpoint")
+    processed = ledger.get("processed", 0)
+    modified = ledger.get("modified", 0)
+    logger.info(f"Running migration {migration['id']} ({migration['name']}) from checkpoint {checkpoint}")
+
+    while True:
+        query = dict(migration["filter"])
+        if checkpoint is not None:
+            query["_id"] = {"$gt": checkpoint}
+
+        batch = await collection.find(query, migration["projection"]).sort("_id", ASCENDING).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            break
+
+        operations = [op for op in (migration["transform"](doc) for doc in batch) if op is not None]
+        if operations:
+            result = await collection.bulk_write(operations, ordered=False)
+            modified += result.modified_count
+
+        checkpoint = batch[-1]["_id"]
+        processed += len(batch)
+        await db.migrations.update_one(
+            {"_id": migration["id"]},
+            {"$set": {
+                "checkpoint": checkpoint,
+                "processed": processed,
+                "modified": modified,
+                "locked_until": (datetime.now(timezone.utc) + timedelta(seconds=MIGRATION_LEASE_SECONDS)).isoformat()
+            }}
+        )
+        logger.info(f"Migration {migration['id']}: {processed} documents processed, {modified} modified")
+
+        if len(batch) < batch_size:
+            break
+
+    ledger = await db.migrations.find_one_and_update(
+        {"_id": migration["id"]},
+        {
+            "$set": {"status": "completed", "completed_at": datetime.now(timezone.utc).isoformat()},
+            "$unset": {"locked_until": ""}
+        },
+        return_document=ReturnDocument.AFTER
+    )
+    logger.info(f"Migration {migration['id']} ({migration['name']}) completed: {processed} processed, {modified} modified")
+    return format_migration_ledger(migration, ledger)
+
+async def run_pending_migrations(dry_run=False, batch_size=MIGRATION_BATCH_SIZE):
+    """Run every migration missing from the ledger, in order"""
+    completed = await db.migrations.find({"status": "completed"}, {"_id": 1}).to_list(length=None)
+    completed_ids = {entry["_id"] for entry in completed}
+
+    results = []
+    for migration in MIGRATIONS:
+        if migration["id"] in completed_ids:
+            continue
+        results.append(await run_migration(migration, dry_run=dry_run, batch_size=batch_size))
+
+    if not results:
+        logger.info("No pending migrations")
+    return results
+
+# Stages run in order; the tasks inside a stage are independent and run concurrently
+STARTUP_TASKS = [
+    [
+        ("seed_default_admin", seed_default_admin),
+        ("ensure_indexes", ensure_indexes),
+        ("warm_up_database", warm_up_database),
+    ],
+    [
+        # After ensure_indexes: the unique room number index is what makes seeding safe
+        ("seed_default_rooms", seed_default_rooms),
+        ("run_pending_migrations", run_pending_migrations),
+    ],
+]
+
+startup_state = {"completed": False, "tasks": {}}
+
+# Health state
+# Probes never talk to MongoDB: a background task pings it every HEALTH_CHECK_INTERVAL_SECONDS and
+# keeps the outcome, latency and pool usage, and /health, /health/live and /health/ready only
+# read that state. A result older than three intervals counts as unknown.
+HEALTH_CHECK_INTERVAL_SECONDS = float(os.environ.get('HEALTH_CHECK_INTERVAL_SECONDS', '5'))
+HEALTH_CHECK_TIMEOUT_SECONDS = 2
+# Run the startup tasks after the server starts listening; /health/ready reports when they are done
+STARTUP_IN_BACKGROUND = os.environ.get('STARTUP_IN_BACKGROUND', 'false').lower() == 'true'
+
+class DatabaseHealth:
+    """Last result of a periodic MongoDB ping"""
+
+    def __init__(self):
+        self.status = "unknown"
+        self.error = None
+        self.latency_ms = None
+        self.checked_at = None
+        self.checked_monotonic = None
+        self._task = None
+
+    async def check(self):
+        started = time.perf_counter()
+        try:
+            with pymongo.timeout(HEALTH_CHECK_TIMEOUT_SECONDS):
+                await client.admin.command("ping")
+            self.status, self.error = "connected", None
+        except PyMongoError as e:
+            self.status, self.error = "disconnected", str(e)
+        self.latency_ms = round((time.perf_counter() - started) * 1000, 1)
+        self.checked_at = datetime.now(timezone.utc)
+        self.checked_monotonic = time.monotonic()
+
+    def connected(self):
+        fresh = self.checked_monotonic is not None and time.monotonic() - self.checked_monotonic < 3 * HEALTH_CHECK_INTERVAL_SECONDS
+        return fresh and self.status == "connected"
+
+    def snapshot(self):
+        return {
+            "status": self.status if self.connected() or self.status != "connected" else "stale",
+            "error": self.error,
+            "latency_ms": self.latency_ms,
+            "checked_at": self.checked_at.isoformat() if self.checked_at else None,
+            "pool": pool_stats.snapshot(),
+        }
+
+    def start(self):
+        self._task = asyncio.create_task(self.poll())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def poll(self):
+        while True:
+            try:
+                await self.check()
+            except Exception as e:
+                # Anything but a driver error is a bug here; keep probing rather than go stale for good
+                logger.exception("Database health check failed")
+                self.status, self.error = "disconnected", f"{type(e).__name__}: {e}"
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL_SECONDS)
+
+database_health = DatabaseHealth()
+
+def readiness_problems():
+    """Why this instance should not get traffic yet (empty when it is ready)"""
+    problems = []
+    if shutdown_coordinator.draining:
+        problems.append("shutting down")
+    if not startup_state["completed"]:
+        problems.append("startup tasks are still running")
+    for name, task in startup_state["tasks"].items():
+        if task["status"] != "ok":
+            problems.append(f"startup task {name} {task['status']}")
+    if not database_health.connected():
+        problems.append(f"database is {database_health.snapshot()['status']}")
+    if mongo_guard.breaker.state == "open":
+        problems.append("database circuit is open")
+    if AUTH_ENABLED and not revoked_tokens.loaded:
+        problems.append("revoked tokens are not loaded yet")
+    return problems
+
+async def run_startup_task(name, task):
+    """Run a single startup task, recording its duration and outcome"""
+    started = time.perf_counter()
+    try:
+        await task()
+        status = "ok"
+    except Exception:
+        status = "failed"
+        logger.exception(f"Startup task {name} failed")
+
+    duration_ms = round((time.perf_counter() - started) * 1000, 1)
+    startup_state["tasks"][name] = {"status": status, "duration_ms": duration_ms}
+    logger.info(f"Startup task {name} {status} in {duration_ms}ms")
+
+async def run_startup_tasks():
+    started = time.perf_counter()
+    for stage in STARTUP_TASKS:
+        await asyncio.gather(*[run_startup_task(name, task) for name, task in stage])
+
+    startup_state["completed"] = True
+    logger.info(f"Startup finished in {(time.perf_counter() - started) * 1000:.1f}ms")
+
 # Initialize default rooms and admin
 @app.on_event("startup")
 async def startup_event():
-    # Create default admin if not exists
-    admin_exists = await db.admins.find_one({"username": "admin"})
-    if not admin_exists:
-        admin = Admin(username="admin", password="admin123", role=AdminRole.ADMIN)
-        admin_dict = prepare_for_mongo(admin.dict())
-        await db.admins.insert_one(admin_dict)
-        print("Default admin created: username=admin, password=admin123, role=admin")
-    
-    # Create default rooms if not exist
-    room_count = await db.rooms.count_documents({})
-    if room_count == 0:
-        default_rooms = [
-            # Single rooms
-            {"number": "201", "type": "single"},
-            {"number": "206", "type": "single"},
-            {"number": "207", "type": "single"},
-            # Double rooms  
-            {"number": "101", "type": "double"},
-            {"number": "102", "type": "double"},
-            {"number": "103", "type": "double"},
-            {"number": "202", "type": "double"},
-            {"number": "203", "type": "double"},
-            {"number": "204", "type": "double"},
-            {"number": "205", "type": "double"},
-        ]
-        
-        for room_data in default_rooms:
-            room = Room(**room_data)
-            room_dict = prepare_for_mongo(room.dict())
-            await db.rooms.insert_one(room_dict)
-        print("Default rooms created")
-    
-    # Auto-migrate old room data
-    await migrate_old_room_data()
-
-# Migration function
-async def migrate_old_room_data():
-    """Migrate old room data with guest_name to new structure with company_name and guests"""
-    print("Starting room data migration...")
-    
-    # Find rooms with guest_name but no company_name (old structure)
-    old_rooms = await db.rooms.find({
-        "guest_name": {"$exists": True, "$ne": None},
-        "company_name": {"$exists": False}
-    }).to_list(length=None)
-    
-    migrated_count = 0
-    for room in old_rooms:
-        guest_name = room.get("guest_name")
-        if guest_name:
-            # Create guest from old guest_name
-            guest = RoomGuest(
-                name=guest_name,
-                phone=None,
-                email=None,
-                id_card=None
-            )
-            
-            # Update room with new structure
-            update_data = {
-                "company_name": "Cá nhân",
-                "guests": [guest.dict()]
-            }
-            
-            await db.rooms.update_one(
-                {"id": room["id"]}, 
-                {"$set": update_data}
-            )
-            migrated_count += 1
-    
-    if migrated_count > 0:
-        print(f"Migrated {migrated_count} rooms from old structure to new structure")
+    slow_query_log.loop = asyncio.get_running_loop()
+    loop_stall_detector.start()
+    database_health.start()
+    if AUTH_ENABLED:
+        revoked_tokens.start()
+    audit_log.start()
+    if STARTUP_IN_BACKGROUND:
+        app.state.startup_task = asyncio.create_task(run_startup_tasks())
     else:
-        print("No rooms needed migration")
+        await run_startup_tasks()
+
+# Migration routes
+@api_router.get("/migrations")
+async def get_migrations():
+    """List migrations with their ledger status and progress"""
+    ledger = await db.migrations.find().to_list(length=None)
+    ledger_by_id = {entry["_id"]: entry for entry in ledger}
+    return [format_migration_ledger(migration, ledger_by_id.get(migration["id"])) for migration in MIGRATIONS]
+
+@api_router.post("/migrations/run")
+async def run_migrations(dry_run: bool = False, batch_size: int = MIGRATION_BATCH_SIZE):
+    """Run pending migrations (dry_run only reports how many documents would be touched)"""
+    if batch_size < 1:
+        raise HTTPException(status_code=400, detail="batch_size must be positive")
+    return {"dry_run": dry_run, "migrations": await run_pending_migrations(dry_run=dry_run, batch_size=batch_size)}
 
 # Migration endpoint (manual trigger)
 @api_router.post("/migrate/rooms")
 async def manual_migrate_rooms():
     """Manually trigger room data migration"""
-    await migrate_old_room_data()
-    return {"message": "Room migration completed successfully"}
+    migration = await run_migration(MIGRATIONS[0])
+    if migration["status"] != "completed":
+        # Another process holds the lease; it did not run here
+        raise HTTPException(status_code=409, detail=f"Room migration is {migration['status']} in another process, retry later")
+    return {
+        "message": f"Room migration completed: {migration['processed']} documents processed, {migration['modified']} modified",
+        "migration": migration,
+    }
 
 # Auth routes
-@api_router.post("/admin/login", response_model=AdminResponse)
+@api_router.post("/admin/login", response_model=LoginResponse)
 async def admin_login(login_data: AdminLogin):
-    admin = await db.admins.find_one({"username": login_data.username, "password": login_data.password})
-    if not admin:
+    admin = await db.admins.find_one({"username": login_data.username})
+    if not await verify_password(login_data.password, admin.get("password") if admin else None):
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    return AdminResponse(id=admin["id"], username=admin["username"], role=admin.get("role", "receptionist"))
+    if not is_password_hash(admin["password"]):
+        # Replace a password stored before hashing; a concurrent change wins
+        await db.admins.update_one(
+            {"id": admin["id"], "password": admin["password"]},
+            {"$set": {"password": await hash_password(login_data.password)}},
+        )
+    token, expires_at = issue_token(admin)
+    return LoginResponse(id=admin["id"], username=admin["username"], role=admin.get("role", "receptionist"),
+                         access_token=token, expires_at=expires_at)
+
+@api_router.post("/admin/logout")
+async def admin_logout():
+    """Revoke the bearer token of the request"""
+    await revoked_tokens.revoke(current_admin_claims())
+    return {"message": "Logged out"}
 
 # Room routes
 @api_router.get("/rooms", response_model=List[Room])
 async def get_rooms():
     rooms = await db.rooms.find().to_list(length=None)
-    return [Room(**parse_from_mongo(room)) for room in rooms]
+    return [Room(**parse_from_mongo(upgrade_document("rooms", room))) for room in rooms]
 
 @api_router.post("/rooms", response_model=Room)
 async def create_room(room_data: RoomCreate):
@@ -437,7 +2855,12 @@ async def create_room(room_data: RoomCreate):
     
     room = Room(**room_data.dict())
     room_dict = prepare_for_mongo(room.dict())
-    await db.rooms.insert_one(room_dict)
+    try:
+        await db.rooms.insert_one(room_dict)
+    except DuplicateKeyError:
+        # Created concurrently since the check above
+        raise HTTPException(status_code=400, detail="Room number already exists")
+    await audit_log.record("room.created", "rooms", room.id, {"number": room.number, "type": room.type})
     return room
 
 @api_router.put("/rooms/{room_id}", response_model=Room)
@@ -450,8 +2873,12 @@ async def update_room(room_id: str, room_data: RoomUpdate):
     update_data = prepare_for_mongo(update_data)
     
     await db.rooms.update_one({"id": room_id}, {"$set": update_data})
+    await audit_log.record("room.pricing_updated" if "pricing" in update_data else "room.updated", "rooms", room_id, {
+        "before": {field: existing.get(field) for field in update_data},
+        "after": update_data,
+    })
     updated_room = await db.rooms.find_one({"id": room_id})
-    return Room(**parse_from_mongo(updated_room))
+    return Room(**parse_from_mongo(upgrade_document("rooms", updated_room)))
 
 @api_router.post("/rooms/{room_id}/checkin", response_model=Room)
 async def check_in_room(room_id: str, checkin_data: CheckIn):
@@ -482,11 +2909,10 @@ async def check_in_room(room_id: str, checkin_data: CheckIn):
         
         return await process_company_checkin(room_id, company_checkin)
     
+    except (HTTPException, PyMongoError, DatabaseUnavailable):
+        raise
     except Exception as e:
-        print(f"Error in check_in_room: {str(e)}")
-        print(f"Error type: {type(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error in check_in_room: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @api_router.post("/rooms/{room_id}/checkin-company", response_model=Room)
@@ -494,10 +2920,10 @@ async def check_in_room_company(room_id: str, checkin_data: CheckInCompany):
     """New check-in endpoint for companies with multiple guests"""
     try:
         return await process_company_checkin(room_id, checkin_data)
+    except (HTTPException, PyMongoError, DatabaseUnavailable):
+        raise
     except Exception as e:
-        print(f"Error in check_in_room_company: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error in check_in_room_company: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 async def process_company_checkin(room_id: str, checkin_data: CheckInCompany):
@@ -527,18 +2953,7 @@ async def process_company_checkin(room_id: str, checkin_data: CheckInCompany):
     
     # Calculate total cost based on booking type
     room_pricing = PricingStructure(**existing.get("pricing", {}))
-    
-    if checkin_data.booking_type == BookingType.HOURLY:
-        if checkin_data.duration <= 1:
-            total_cost = room_pricing.hourly_first
-        elif checkin_data.duration <= 2:
-            total_cost = room_pricing.hourly_first + room_pricing.hourly_second
-        else:
-            total_cost = room_pricing.hourly_first + room_pricing.hourly_second + ((checkin_data.duration - 2) * room_pricing.hourly_additional)
-    elif checkin_data.booking_type == BookingType.DAILY:
-        total_cost = room_pricing.daily_rate * checkin_data.duration
-    elif checkin_data.booking_type == BookingType.MONTHLY:
-        total_cost = room_pricing.monthly_rate * checkin_data.duration
+    total_cost = calculate_booking_cost(checkin_data.booking_type, checkin_data.duration, room_pricing)
     
     # Convert guests to dict for MongoDB
     guests_dict = [guest.dict() for guest in checkin_data.guests]
@@ -557,12 +2972,19 @@ async def process_company_checkin(room_id: str, checkin_data: CheckInCompany):
     }
     
     await db.rooms.update_one({"id": room_id}, {"$set": update_data})
+    await audit_log.record("room.checked_in", "rooms", room_id, {
+        "company_name": checkin_data.company_name,
+        "guests": len(guests_dict),
+        "booking_type": checkin_data.booking_type.value,
+        "duration": checkin_data.duration,
+        "total_cost": total_cost,
+    })
     updated_room = await db.rooms.find_one({"id": room_id})
-    return Room(**parse_from_mongo(updated_room))
+    return Room(**parse_from_mongo(upgrade_document("rooms", updated_room)))
 
 @api_router.post("/rooms/{room_id}/checkout")
 async def check_out_room(room_id: str):
-    existing = await db.rooms.find_one({"id": room_id})
+    existing = upgrade_document("rooms", await db.rooms.find_one({"id": room_id}))
     if not existing:
         raise HTTPException(status_code=404, detail="Room not found")
     
@@ -570,25 +2992,11 @@ async def check_out_room(room_id: str):
         raise HTTPException(status_code=400, detail="Room is not occupied")
     
     # Get booking type to determine how to calculate cost
-    booking_type = existing.get("booking_type", "hourly")  # Default to hourly for older records
+    booking_type = existing.get("booking_type", "hourly")  # Rooms occupied without a check-in have none
     original_total_cost = existing.get("total_cost")  # Pre-calculated cost from check-in
     
     # Calculate total cost
-    check_in_date_str = existing["check_in_date"]
-    if isinstance(check_in_date_str, str):
-        # Handle both timezone-aware and naive datetime strings
-        if check_in_date_str.endswith('Z'):
-            check_in_time = datetime.fromisoformat(check_in_date_str.replace('Z', '+00:00'))
-        elif '+' in check_in_date_str or check_in_date_str.endswith('+00:00'):
-            check_in_time = datetime.fromisoformat(check_in_date_str)
-        else:
-            # Assume UTC if no timezone info
-            check_in_time = datetime.fromisoformat(check_in_date_str).replace(tzinfo=timezone.utc)
-    else:
-        check_in_time = check_in_date_str
-        if check_in_time.tzinfo is None:
-            check_in_time = check_in_time.replace(tzinfo=timezone.utc)
-    
+    check_in_time = as_utc_datetime(existing["check_in_date"])
     check_out_time = datetime.now(timezone.utc)
     
     # Get pricing from room or use default
@@ -626,12 +3034,8 @@ async def check_out_room(room_id: str):
         calculation_method = "default_calculation"
     
     # Get company and guest info
-    company_name = existing.get("company_name", "Cá nhân")
-    guests = existing.get("guests", [])
-    
-    # Fallback to legacy guest_name if no guests
-    if not guests and existing.get("guest_name"):
-        guests = [{"name": existing["guest_name"], "phone": None, "email": None, "id_card": None}]
+    company_name = existing["company_name"]
+    guests = existing["guests"]
     
     update_data = {
         "status": "empty",
@@ -660,7 +3064,8 @@ async def check_out_room(room_id: str):
         "check_in_time": check_in_time.isoformat(),
         "check_out_time": check_out_time.isoformat(),
         "cost_calculation": cost_calculation,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "schema_version": SCHEMA_VERSIONS["bills"]
     }
     
     await db.bills.insert_one(bill_record)
@@ -683,11 +3088,18 @@ async def check_out_room(room_id: str):
     
     enhanced_bill_dict = prepare_for_mongo(enhanced_bill.dict())
     await db.enhanced_bills.insert_one(enhanced_bill_dict)
+    await audit_log.record("room.checked_out", "rooms", room_id, {
+        "company_name": company_name,
+        "bill_id": bill_record["id"],
+        "enhanced_bill_id": enhanced_bill.id,
+        "total_cost": cost_calculation["total_cost"],
+        "calculation_method": calculation_method,
+    })
     
     updated_room = await db.rooms.find_one({"id": room_id})
     
     return {
-        "room": Room(**parse_from_mongo(updated_room)),
+        "room": Room(**parse_from_mongo(upgrade_document("rooms", updated_room))),
         "bill": cost_calculation,
         "booking_type": booking_type,
         "original_total_cost": original_total_cost,
@@ -700,10 +3112,13 @@ async def check_out_room(room_id: str):
     }
 
 @api_router.delete("/rooms/{room_id}")
+@require_permission(AdminRole.MANAGER)
 async def delete_room(room_id: str):
+    """Only MANAGER or ADMIN can delete rooms"""
     result = await db.rooms.delete_one({"id": room_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Room not found")
+    await audit_log.record("room.deleted", "rooms", room_id)
     return {"message": "Room deleted successfully"}
 
 # Guest routes
@@ -765,14 +3180,9 @@ async def create_reservation(reservation_data: ReservationCreate):
         raise HTTPException(status_code=404, detail="Guest not found")
     
     # Check room availability for the date range
-    existing_reservations = await db.reservations.find({
-        "room_id": reservation_data.room_id,
-        "status": {"$in": ["confirmed", "checked_in"]},
-        "$or": [
-            {"start_date": {"$lte": reservation_data.end_date.isoformat()}, 
-             "end_date": {"$gte": reservation_data.start_date.isoformat()}}
-        ]
-    }).to_list(length=None)
+    existing_reservations = await db.reservations.find(
+        reservation_overlap_filter(reservation_data.room_id, reservation_data.start_date, reservation_data.end_date)
+    ).to_list(length=None)
     
     if existing_reservations:
         raise HTTPException(status_code=400, detail="Room is not available for the selected dates")
@@ -786,6 +3196,8 @@ async def create_reservation(reservation_data: ReservationCreate):
     reservation = Reservation(**reservation_data.dict(), total_cost=total_cost)
     reservation_dict = prepare_for_mongo(reservation.dict())
     await db.reservations.insert_one(reservation_dict)
+    await audit_log.record("reservation.created", "reservations", reservation.id, {
+        "room_id": reservation.room_id, "total_cost": total_cost})
     return reservation
 
 @api_router.put("/reservations/{reservation_id}", response_model=Reservation)
@@ -798,6 +3210,10 @@ async def update_reservation(reservation_id: str, reservation_data: ReservationU
     update_data = prepare_for_mongo(update_data)
     
     await db.reservations.update_one({"id": reservation_id}, {"$set": update_data})
+    await audit_log.record("reservation.updated", "reservations", reservation_id, {
+        "before": {field: existing.get(field) for field in update_data},
+        "after": update_data,
+    })
     updated_reservation = await db.reservations.find_one({"id": reservation_id})
     return Reservation(**parse_from_mongo(updated_reservation))
 
@@ -820,7 +3236,13 @@ async def checkin_from_reservation(reservation_id: str):
     # Update room status
     await db.rooms.update_one(
         {"id": reservation["room_id"]}, 
-        {"$set": {"status": "occupied", "guest_name": reservation["guest_id"]}}
+        {"$set": {
+            "status": "occupied",
+            "guest_name": reservation["guest_id"],
+            "company_name": "Cá nhân",
+            "guests": [RoomGuest(name=reservation["guest_id"]).dict()],
+            "booking_type": "hourly"
+        }}
     )
     
     # Update reservation status
@@ -828,6 +3250,7 @@ async def checkin_from_reservation(reservation_id: str):
         {"id": reservation_id}, 
         {"$set": {"status": "checked_in"}}
     )
+    await audit_log.record("room.checked_in", "rooms", reservation["room_id"], {"reservation_id": reservation_id})
     
     return {"message": "Checked in successfully"}
 
@@ -872,28 +3295,9 @@ async def get_orders(
     limit: int = 100
 ):
     """Get orders with optional filters"""
-    # Build filter query
-    filter_query = {}
-    
-    # Date filter
-    if start_date or end_date:
-        date_filter = {}
-        if start_date:
-            date_filter["$gte"] = start_date
-        if end_date:
-            date_filter["$lte"] = end_date
-        filter_query["order_date"] = date_filter
-    
-    # Company name filter (case-insensitive partial match)
-    if company_name:
-        filter_query["company_name"] = {"$regex": company_name, "$options": "i"}
-    
-    # Dish name filter (case-insensitive partial match)
-    if dish_name:
-        filter_query["dish_name"] = {"$regex": dish_name, "$options": "i"}
-    
+    filter_query = orders_filter(start_date, end_date, company_name, dish_name)
     orders = await db.orders.find(filter_query).sort("order_date", -1).limit(limit).to_list(length=None)
-    return [Order(**parse_from_mongo(order)) for order in orders]
+    return [Order(**parse_from_mongo(upgrade_document("orders", order))) for order in orders]
 
 @api_router.get("/orders/company-report")
 async def get_company_order_report(
@@ -903,53 +3307,7 @@ async def get_company_order_report(
     group_by: str = "daily"  # daily, monthly
 ):
     """Get order report for a specific company with daily/monthly totals"""
-    
-    # Build date filter
-    date_filter = {}
-    if start_date:
-        date_filter["$gte"] = start_date
-    if end_date:
-        date_filter["$lte"] = end_date
-    
-    # Base match stage
-    match_stage = {
-        "company_name": {"$regex": company_name, "$options": "i"}
-    }
-    if date_filter:
-        match_stage["order_date"] = date_filter
-    
-    # Group by date format
-    if group_by == "monthly":
-        date_format = "%Y-%m"
-        group_label = "month"
-    else:  # daily
-        date_format = "%Y-%m-%d"
-        group_label = "day"
-    
-    # Aggregation pipeline
-    pipeline = [
-        {"$match": match_stage},
-        {
-            "$group": {
-                "_id": {
-                    "date": {"$dateToString": {"format": date_format, "date": {"$dateFromString": {"dateString": "$order_date"}}}},
-                    "company": "$company_name"
-                },
-                "total_orders": {"$sum": 1},
-                "total_amount": {"$sum": "$total_price"},
-                "orders": {
-                    "$push": {
-                        "dish_name": "$dish_name",
-                        "quantity": "$quantity",
-                        "unit_price": "$unit_price",
-                        "total_price": "$total_price",
-                        "order_date": "$order_date"
-                    }
-                }
-            }
-        },
-        {"$sort": {"_id.date": -1}}
-    ]
+    pipeline = company_report_pipeline(company_name, start_date, end_date, group_by)
     
     results = await db.orders.aggregate(pipeline).to_list(length=None)
     
@@ -989,32 +3347,7 @@ async def get_companies_order_summary(
     end_date: str = None
 ):
     """Get order summary for all companies"""
-    
-    # Build date filter
-    date_filter = {}
-    if start_date:
-        date_filter["$gte"] = start_date
-    if end_date:
-        date_filter["$lte"] = end_date
-    
-    match_stage = {}
-    if date_filter:
-        match_stage["order_date"] = date_filter
-    
-    # Aggregation pipeline
-    pipeline = [
-        {"$match": match_stage} if match_stage else {"$match": {}},
-        {
-            "$group": {
-                "_id": "$company_name",
-                "total_orders": {"$sum": 1},
-                "total_amount": {"$sum": "$total_price"},
-                "unique_dishes": {"$addToSet": "$dish_name"},
-                "last_order_date": {"$max": "$order_date"}
-            }
-        },
-        {"$sort": {"total_amount": -1}}
-    ]
+    pipeline = companies_summary_pipeline(start_date, end_date)
     
     results = await db.orders.aggregate(pipeline).to_list(length=None)
     
@@ -1061,6 +3394,8 @@ async def create_order(order_data: OrderCreate):
     
     order_dict = prepare_for_mongo(order.dict())
     await db.orders.insert_one(order_dict)
+    await audit_log.record("order.created", "orders", order.id, {
+        "company_name": order.company_name, "dish_id": order.dish_id, "total_price": total_price})
     return order
 async def create_order(order_data: OrderCreate):
     # Get dish info
@@ -1086,10 +3421,7 @@ async def create_order(order_data: OrderCreate):
 @api_router.get("/orders/companies")
 async def get_order_companies():
     """Get list of all companies that have placed orders"""
-    pipeline = [
-        {"$group": {"_id": "$company_name"}},
-        {"$sort": {"_id": 1}}
-    ]
+    pipeline = distinct_values_pipeline("company_name")
     
     results = await db.orders.aggregate(pipeline).to_list(length=None)
     companies = [result["_id"] for result in results if result["_id"]]
@@ -1099,10 +3431,7 @@ async def get_order_companies():
 @api_router.get("/orders/dishes")
 async def get_order_dishes():
     """Get list of all dishes that have been ordered"""
-    pipeline = [
-        {"$group": {"_id": "$dish_name"}},
-        {"$sort": {"_id": 1}}
-    ]
+    pipeline = distinct_values_pipeline("dish_name")
     
     results = await db.orders.aggregate(pipeline).to_list(length=None)
     dishes = [result["_id"] for result in results if result["_id"]]
@@ -1115,6 +3444,7 @@ async def get_bills():
     bills = await db.bills.find().sort("created_at", -1).to_list(length=50)
     # Remove MongoDB _id field to avoid serialization issues
     for bill in bills:
+        upgrade_document("bills", bill)
         if "_id" in bill:
             del bill["_id"]
     return bills
@@ -1131,6 +3461,7 @@ async def create_enhanced_bill(bill_data: dict):
     bill = EnhancedBill(**bill_data)
     bill_dict = prepare_for_mongo(bill.dict())
     await db.enhanced_bills.insert_one(bill_dict)
+    await audit_log.record("bill.created", "enhanced_bills", bill.id, {"total": bill.total})
     return bill
 
 @api_router.put("/enhanced-bills/{bill_id}/payment")
@@ -1144,6 +3475,8 @@ async def update_bill_payment_status(bill_id: str, status: BillStatus):
         update_data["paid_at"] = datetime.now(timezone.utc).isoformat()
     
     await db.enhanced_bills.update_one({"id": bill_id}, {"$set": update_data})
+    await audit_log.record("bill.payment_status_changed", "enhanced_bills", bill_id, {
+        "before": existing.get("status"), "after": status.value, "total": existing.get("total")})
     updated_bill = await db.enhanced_bills.find_one({"id": bill_id})
     return EnhancedBill(**parse_from_mongo(updated_bill))
 
@@ -1171,10 +3504,7 @@ async def get_revenue_report(period: str = "daily", start_date: str = None, end_
     
     # Get bills in date range
     bills = await db.bills.find({
-        "created_at": {
-            "$gte": start_date.isoformat(),
-            "$lte": end_date.isoformat()
-        }
+        "created_at": date_range_filter(start_date.isoformat(), end_date.isoformat())
     }).to_list(length=None)
     
     total_revenue = sum([bill.get("cost_calculation", {}).get("total_cost", 0) for bill in bills])
@@ -1210,19 +3540,7 @@ async def get_popular_dishes_report(limit: int = 10):
     """
     Get most popular dishes by order quantity
     """
-    pipeline = [
-        {
-            "$group": {
-                "_id": "$dish_id",
-                "dish_name": {"$first": "$dish_name"},
-                "total_quantity": {"$sum": "$quantity"},
-                "total_revenue": {"$sum": "$total_price"},
-                "order_count": {"$sum": 1}
-            }
-        },
-        {"$sort": {"total_quantity": -1}},
-        {"$limit": limit}
-    ]
+    pipeline = popular_dishes_pipeline(limit)
     
     popular_dishes = await db.orders.aggregate(pipeline).to_list(length=limit)
     
@@ -1236,24 +3554,7 @@ async def get_room_occupancy_report():
     Get room occupancy rate by room type
     """
     # Get all rooms grouped by type
-    pipeline = [
-        {
-            "$group": {
-                "_id": "$type",
-                "total_rooms": {"$sum": 1},
-                "occupied_rooms": {
-                    "$sum": {
-                        "$cond": [{"$eq": ["$status", "occupied"]}, 1, 0]
-                    }
-                },
-                "empty_rooms": {
-                    "$sum": {
-                        "$cond": [{"$eq": ["$status", "empty"]}, 1, 0]
-                    }
-                }
-            }
-        }
-    ]
+    pipeline = room_occupancy_pipeline()
     
     occupancy_data = await db.rooms.aggregate(pipeline).to_list(length=None)
     
@@ -1271,7 +3572,10 @@ async def get_room_occupancy_report():
 async def create_admin(admin_data: dict):
     """Only ADMIN can create new admins"""
     admin = Admin(**admin_data)
-    admin_dict = prepare_for_mongo(admin.dict())
+    try:
+        admin_dict = prepare_for_mongo({**admin.dict(), "password": await hash_password(admin.password)})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     await db.admins.insert_one(admin_dict)
     return AdminResponse(**admin.dict())
 
@@ -1282,16 +3586,102 @@ async def get_all_admins():
     admins = await db.admins.find().to_list(length=None)
     return [AdminResponse(**parse_from_mongo(admin)) for admin in admins]
 
-@api_router.delete("/rooms/{room_id}")
+@api_router.get("/admin/pool")
+@require_permission(AdminRole.ADMIN)
+async def get_connection_pool_stats():
+    """MongoDB connection pool settings and live usage per server"""
+    return {
+        "options": dict(client_options),
+        "servers": pool_stats.snapshot()
+    }
+
+@api_router.get("/admin/slow-queries")
+@require_permission(AdminRole.ADMIN)
+async def get_slow_queries(limit: int = 50):
+    """Most recent MongoDB commands slower than SLOW_QUERY_THRESHOLD_MS, newest first"""
+    return {
+        "threshold_ms": SLOW_QUERY_THRESHOLD_MS,
+        "queries": slow_query_log.recent(limit)
+    }
+
+@api_router.post("/admin/slow-queries/{entry_id}/explain")
+@require_permission(AdminRole.ADMIN)
+async def explain_slow_query(entry_id: str):
+    """Capture explain("executionStats") for a recorded slow query"""
+    entry = slow_query_log.get(entry_id)
+    if not entry:
+        raise HTTPException(status_code=404, detail="Slow query not found")
+    if "_command" not in entry:
+        raise HTTPException(status_code=400, detail=f"{entry['command']} commands cannot be explained")
+    return await slow_query_log.explain(entry_id)
+
+@api_router.get("/admin/profiles")
+@require_permission(AdminRole.ADMIN)
+async def get_profiles():
+    """Stored request profiles, newest first (without the full cProfile output)"""
+    return [
+        {key: value for key, value in profile.items() if key != "profile"}
+        for profile in reversed(profiles.values())
+    ]
+
+@api_router.get("/admin/profiles/{profile_id}")
+@require_permission(AdminRole.ADMIN)
+async def get_profile(profile_id: str):
+    """Time breakdown and cProfile output of a profiled request"""
+    profile = profiles.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+@api_router.get("/admin/loop-stalls")
+@require_permission(AdminRole.ADMIN)
+async def get_loop_stalls():
+    """Recent event loop stalls with the blocking stack and route, newest first"""
+    return {
+        "threshold_ms": LOOP_STALL_THRESHOLD_MS,
+        "stalls": list(reversed(loop_stall_detector.stalls))
+    }
+
+@api_router.get("/admin/audit")
 @require_permission(AdminRole.MANAGER)
-async def delete_room(room_id: str):
-    """Only MANAGER or ADMIN can delete rooms"""
-    existing = await db.rooms.find_one({"id": room_id})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Room not found")
-    
-    await db.rooms.delete_one({"id": room_id})
-    return {"message": "Room deleted successfully"}
+async def get_audit_events(entity_id: str = None, event_type: str = None, limit: int = 100):
+    """Recorded state changes, newest first (events still queued are not included yet)"""
+    query = {}
+    if entity_id:
+        query["entity_id"] = entity_id
+    if event_type:
+        query["type"] = event_type
+    events = await db.audit_log.find(query).sort("at", -1).to_list(length=min(limit, 1000))
+    return [{"id": event.pop("_id"), **event} for event in events]
+
+@api_router.get("/admin/faults")
+@require_permission(AdminRole.ADMIN)
+async def get_faults():
+    """Active fault injection rules and how many faults each kind injected"""
+    if not FAULT_INJECTION_ENABLED:
+        raise HTTPException(status_code=404, detail="Fault injection is disabled")
+    return {"rules": fault_injector.rules, "injected": dict(fault_injector.injected)}
+
+@api_router.put("/admin/faults")
+@require_permission(AdminRole.ADMIN)
+async def set_faults(rules: List[FaultRule]):
+    """Replace the fault injection rules (an empty list turns injection off)"""
+    if not FAULT_INJECTION_ENABLED:
+        raise HTTPException(status_code=404, detail="Fault injection is disabled")
+    try:
+        fault_injector.configure(rules)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.warning(f"Fault injection rules set: {[rule.dict() for rule in rules]}")
+    return {"rules": fault_injector.rules}
+
+@api_router.delete("/admin/faults")
+@require_permission(AdminRole.ADMIN)
+async def clear_faults():
+    if not FAULT_INJECTION_ENABLED:
+        raise HTTPException(status_code=404, detail="Fault injection is disabled")
+    fault_injector.configure([])
+    return {"rules": []}
 
 # Dashboard summary (any authenticated user)
 @api_router.get("/dashboard")
@@ -1323,7 +3713,7 @@ async def get_dashboard_summary():
 @api_router.get("/rooms/{room_id}/current-cost")
 async def get_current_cost(room_id: str):
     """Get current cost calculation for occupied room - only applies to hourly bookings"""
-    existing = await db.rooms.find_one({"id": room_id})
+    existing = upgrade_document("rooms", await db.rooms.find_one({"id": room_id}))
     if not existing:
         raise HTTPException(status_code=404, detail="Room not found")
     
@@ -1331,40 +3721,11 @@ async def get_current_cost(room_id: str):
         raise HTTPException(status_code=400, detail="Room is not occupied")
     
     # Check if this is an hourly booking by looking at stored booking_type
-    booking_type = existing.get("booking_type", "hourly")  # Default to hourly for older records
+    booking_type = existing.get("booking_type", "hourly")  # Rooms occupied without a check-in have none
     is_hourly_booking = booking_type == "hourly"
     
-    check_in_date_str = existing["check_in_date"]
-    check_out_date_str = existing.get("check_out_date")
-    
-    if isinstance(check_in_date_str, str):
-        # Handle both timezone-aware and naive datetime strings
-        if check_in_date_str.endswith('Z'):
-            check_in_time = datetime.fromisoformat(check_in_date_str.replace('Z', '+00:00'))
-        elif '+' in check_in_date_str or check_in_date_str.endswith('+00:00'):
-            check_in_time = datetime.fromisoformat(check_in_date_str)
-        else:
-            # Assume UTC if no timezone info
-            check_in_time = datetime.fromisoformat(check_in_date_str).replace(tzinfo=timezone.utc)
-    else:
-        check_in_time = check_in_date_str
-        if check_in_time.tzinfo is None:
-            check_in_time = check_in_time.replace(tzinfo=timezone.utc)
-    
-    # Parse check_out_date if exists
-    planned_check_out_time = None
-    if check_out_date_str:
-        if isinstance(check_out_date_str, str):
-            if check_out_date_str.endswith('Z'):
-                planned_check_out_time = datetime.fromisoformat(check_out_date_str.replace('Z', '+00:00'))
-            elif '+' in check_out_date_str or check_out_date_str.endswith('+00:00'):
-                planned_check_out_time = datetime.fromisoformat(check_out_date_str)
-            else:
-                planned_check_out_time = datetime.fromisoformat(check_out_date_str).replace(tzinfo=timezone.utc)
-        else:
-            planned_check_out_time = check_out_date_str
-            if planned_check_out_time.tzinfo is None:
-                planned_check_out_time = planned_check_out_time.replace(tzinfo=timezone.utc)
+    check_in_time = as_utc_datetime(existing["check_in_date"])
+    planned_check_out_time = as_utc_datetime(existing.get("check_out_date"))
     
     current_time = datetime.now(timezone.utc)
     
@@ -1397,8 +3758,8 @@ async def get_current_cost(room_id: str):
     
     return {
         "room_number": existing["number"],
-        "company_name": existing.get("company_name", "Cá nhân"),
-        "guests": existing.get("guests", []),
+        "company_name": existing["company_name"],
+        "guests": existing["guests"],
         "guest_name": existing.get("guest_name"),  # Legacy field
         "check_in_time": check_in_time.isoformat(),
         "current_time": current_time.isoformat(),
@@ -1412,27 +3773,15 @@ async def get_current_cost(room_id: str):
 @api_router.get("/rooms/{room_id}/guests")
 async def get_room_guests(room_id: str):
     """Get guests information for a specific room"""
-    room = await db.rooms.find_one({"id": room_id})
+    room = upgrade_document("rooms", await db.rooms.find_one({"id": room_id}))
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
     
-    guests = room.get("guests", [])
-    company_name = room.get("company_name")
-    
-    # Fallback to legacy guest_name
-    if not guests and room.get("guest_name"):
-        guests = [{
-            "name": room["guest_name"],
-            "phone": None,
-            "email": None,
-            "id_card": None
-        }]
-    
     return {
         "room_id": room_id,
         "room_number": room["number"],
-        "company_name": company_name,
-        "guests": guests,
+        "company_name": room["company_name"],
+        "guests": room["guests"],
         "status": room["status"]
     }
 
@@ -1466,7 +3815,7 @@ app.include_router(api_router)
 
 # CORS configuration
 cors_origins = os.environ.get('CORS_ORIGINS', 'http://localhost:3000').split(',')
-print(f"CORS Origins: {cors_origins}")
+logger.info(f"CORS Origins: {cors_origins}")
 
 app.add_middleware(
     CORSMiddleware,
@@ -1476,16 +3825,578 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+# Per-request profiling (staging diagnostics)
+# A request sent with `X-Profile: 1` (or `?__profile=1`) and `X-Profile-Token: $PROFILING_TOKEN`
+# runs under cProfile. The response gets X-Profile-Id and Server-Timing headers, and the
+# full profile is kept for GET /api/admin/profiles/{id}. Disabled when PROFILING_TOKEN is unset.
+# cProfile sees everything the event loop thread runs, so a request is only profiled when it is
+# the only one in flight (otherwise it runs unprofiled with X-Profile-Status: busy), and a profile
+# that other requests overlapped is marked `isolated: false` and X-Profile-Status: overlapped.
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN', '')
+profiles = collections.OrderedDict()
+PROFILE_BUFFER_SIZE = 50
+
+def profile_category(function_key):
+    """Attribute a profiled function to validation, serialization or other code"""
+    filename, _, name = function_key
+    if "SchemaSerializer" in name or "fastapi/encoders.py" in filename or "starlette/responses.py" in filename or filename.endswith("json/encoder.py"):
+        return "serialization"
+    if "SchemaValidator" in name or "/pydantic/" in filename:
+        return "validation"
+    return None
+
+def summarize_profile(profiler, wall_ms, context):
+    """Split a request's wall time between MongoDB, validation, serialization and handler code"""
+    stats = pstats.Stats(profiler)
+    split_ms = {"validation": 0.0, "serialization": 0.0}
+    for function_key, (_, _, tottime, _, _) in stats.stats.items():
+        category = profile_category(function_key)
+        if category:
+            split_ms[category] += tottime * 1000
+
+    breakdown = {
+        "wall_ms": round(wall_ms, 3),
+        "mongo_ms": round(context.db_time_ms, 3),
+        "mongo_commands": context.db_commands,
+        "validation_ms": round(split_ms["validation"], 3),
+        "serialization_ms": round(split_ms["serialization"], 3),
+    }
+    breakdown["handler_ms"] = round(max(wall_ms - context.db_time_ms - split_ms["validation"] - split_ms["serialization"], 0.0), 3)
+
+    output = io.StringIO()
+    stats.stream = output
+    stats.sort_stats("cumulative").print_stats(40)
+    return breakdown, output.getvalue()
+
+class ProfilingMiddleware:
+    """Profiles single requests on demand for admins"""
+
+    def __init__(self, app):
+        self.app = app
+        self.active = False
+        self.in_flight = 0
+        self.started = 0
+
+    def requested(self, scope):
+        headers = dict(scope["headers"])
+        if headers.get(b"x-profile") != b"1" and b"__profile=1" not in scope.get("query_string", b""):
+            return False
+        token = headers.get(b"x-profile-token", b"").decode()
+        return bool(PROFILING_TOKEN) and secrets.compare_digest(token, PROFILING_TOKEN)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not PROFILING_TOKEN:
+            await self.app(scope, receive, send)
+            return
+
+        self.in_flight += 1
+        self.started += 1
+        try:
+            if self.requested(scope):
+                await self.profile(scope, receive, send)
+            else:
+                await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+    async def profile(self, scope, receive, send):
+        if self.active or self.in_flight > 1:
+            # Other requests' frames would end up in the profile
+            async def send_busy(message):
+                if message["type"] == "http.response.start":
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-profile-status", b"busy")]
+                await send(message)
+            await self.app(scope, receive, send_busy)
+            return
+
+        context = request_context.get()
+        profile_id = str(uuid.uuid4())
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        started_before = self.started
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and self.active:
+                profiler.disable()
+                self.active = False
+                isolated = self.started == started_before
+                breakdown, text = summarize_profile(profiler, (time.perf_counter() - started) * 1000, context)
+                profiles[profile_id] = {
+                    "id": profile_id,
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "route": context.route,
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "isolated": isolated,
+                    "breakdown": breakdown,
+                    "profile": text,
+                }
+                while len(profiles) > PROFILE_BUFFER_SIZE:
+                    profiles.popitem(last=False)
+
+                server_timing = ", ".join(
+                    f"{name};dur={breakdown[f'{name}_ms']}" for name in ("mongo", "validation", "serialization", "handler")
+                )
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-id", profile_id.encode()),
+                    (b"x-profile-status", b"isolated" if isolated else b"overlapped"),
+                    (b"server-timing", server_timing.encode()),
+                ]
+            await send(message)
+
+        self.active = True
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if self.active:
+                profiler.disable()
+                self.active = False
+
+app.add_middleware(ProfilingMiddleware)
+
+# Per-request MongoDB budget (DB_DEBUG only)
+def db_budget_report(context):
+    """Budget and repeated-query findings for the MongoDB commands of one request"""
+    budget = DB_QUERY_BUDGETS.get((context.method, context.route))
+    repeated = {shape: count for shape, count in context.db_shapes.items() if count >= DB_REPEATED_QUERY_THRESHOLD}
+    return {
+        "commands": context.db_commands,
+        "time_ms": round(context.db_time_ms, 3),
+        "budget": budget,
+        "over_budget": budget is not None and context.db_commands > budget,
+        "repeated": repeated,
+    }
+
+class DbBudgetMiddleware:
+    """Reports MongoDB command counts per request and flags budget overruns and N+1 patterns"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not DB_DEBUG:
+            await self.app(scope, receive, send)
+            return
+
+        context = request_context.get()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                report = db_budget_report(context)
+                headers = [
+                    (b"x-db-commands", str(report["commands"]).encode()),
+                    (b"x-db-time-ms", str(report["time_ms"]).encode()),
+                ]
+                if report["over_budget"]:
+                    headers.append((b"x-db-budget-exceeded", f"{report['commands']}/{report['budget']}".encode()))
+                    logger.warning(f"{context.method} {context.route} used {report['commands']} MongoDB commands (budget {report['budget']})")
+                for shape, count in report["repeated"].items():
+                    headers.append((b"x-db-repeated-query", f"{count}x {shape}".encode()))
+                    logger.warning(f"{context.method} {context.route} repeated a query {count} times: {shape}")
+                message["headers"] = list(message.get("headers", [])) + headers
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+app.add_middleware(DbBudgetMiddleware)
+
+# Traffic capture (for replay.py)
+# With TRAFFIC_CAPTURE_FILE set, every sampled request is appended to that file as one compact
+# JSON line: time, method, route, path, sanitized query and body shape, duration and status.
+# Query and body values are replaced by their type unless the field is a UUID, a date or one of
+# TRAFFIC_CAPTURE_KEEP_FIELDS, so names, phone numbers and passwords never reach the file.
+TRAFFIC_CAPTURE_FILE = os.environ.get('TRAFFIC_CAPTURE_FILE', '')
+TRAFFIC_CAPTURE_SAMPLE_RATE = float(os.environ.get('TRAFFIC_CAPTURE_SAMPLE_RATE', '1'))
+TRAFFIC_CAPTURE_MAX_BODY_BYTES = 64 * 1024
+TRAFFIC_CAPTURE_KEEP_FIELDS = {
+    "booking_type", "duration", "quantity", "type", "status", "period", "group_by", "limit",
+    "dry_run", "batch_size", "price", "role",
+}
+
+def capture_keeps_value(key, value):
+    if key == "id" or key.endswith("_id"):
+        # Only generated ids; guest_id on a legacy check-in is an ID card number
+        try:
+            uuid.UUID(str(value))
+            return True
+        except ValueError:
+            return False
+    return key in TRAFFIC_CAPTURE_KEEP_FIELDS or key.endswith("_date")
+
+def body_shape(value, key=None):
+    """Structure of a request body with every value not worth keeping replaced by its type name"""
+    if isinstance(value, dict):
+        return {item_key: body_shape(item, item_key) for item_key, item in value.items()}
+    if isinstance(value, list):
+        # Keep the length, it matters for the cost of the request (e.g. number of guests)
+        return [body_shape(item) for item in value]
+    if value is None or (key is not None and capture_keeps_value(key, value)):
+        return value
+    return type(value).__name__
+
+def query_shape(query_string):
+    params = urllib.parse.parse_qsl(query_string.decode("latin-1"), keep_blank_values=True)
+    return {key: value if capture_keeps_value(key, value) else "str" for key, value in params}
+
+class TrafficCaptureMiddleware:
+    """Appends sanitized request traces to TRAFFIC_CAPTURE_FILE"""
+
+    def __init__(self, app):
+        self.app = app
+        self.file_logger = None
+        if TRAFFIC_CAPTURE_FILE:
+            self.file_logger = logging.getLogger("traffic_capture")
+            self.file_logger.propagate = False
+            handler = logging.handlers.RotatingFileHandler(TRAFFIC_CAPTURE_FILE, maxBytes=50 * 1024 * 1024, backupCount=10)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.file_logger.addHandler(queued_handler(handler))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.file_logger is None or random.random() >= TRAFFIC_CAPTURE_SAMPLE_RATE:
+            await self.app(scope, receive, send)
+            return
+
+        body = bytearray()
+        response = {"status": 500}
+        started = time.perf_counter()
+        started_at = time.time()
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request" and len(body) <= TRAFFIC_CAPTURE_MAX_BODY_BYTES:
+                body.extend(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            route = scope.get("route")
+            trace = {
+                "t": round(started_at, 3),
+                "m": scope["method"],
+                "r": route.path if route is not None else None,
+                "p": scope["path"],
+                "q": query_shape(scope.get("query_string", b"")),
+                "d": round((time.perf_counter() - started) * 1000, 2),
+                "s": response["status"],
+            }
+            if body:
+                try:
+                    trace["b"] = body_shape(json.loads(body)) if len(body) <= TRAFFIC_CAPTURE_MAX_BODY_BYTES else "too_large"
+                except ValueError:
+                    trace["b"] = "not_json"
+            self.file_logger.info(json.dumps(trace, separators=(",", ":"), ensure_ascii=False))
+
+app.add_middleware(TrafficCaptureMiddleware)
+
+# Idempotency keys
+# A mutating request sent with an `Idempotency-Key` header is executed once per method, path
+# and key: the first response (anything but 429 and 5xx) is stored in the idempotency_keys
+# collection for IDEMPOTENCY_TTL_HOURS and replayed for every retry, with an
+# `Idempotent-Replayed: true` header. Recent responses are also kept in memory, and duplicates
+# arriving while the first request is still running wait for it (same process) or get a 409.
+IDEMPOTENCY_TTL_HOURS = float(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '1000'))
+# A request still "processing" after this long is assumed lost (crashed worker) and can be retried
+IDEMPOTENCY_LEASE_SECONDS = 60
+IDEMPOTENCY_DB_TIMEOUT_SECONDS = 2
+IDEMPOTENCY_MAX_KEY_LENGTH = 255
+IDEMPOTENCY_MAX_RESPONSE_BYTES = 1024 * 1024
+IDEMPOTENCY_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+IDEMPOTENCY_STORED_HEADERS = {b"content-type", b"location", b"retry-after"}
+
+async def read_request_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        body.extend(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return bytes(body)
+
+async def send_response(send, status, headers, body):
+    headers = [(name, value) for name, value in headers if name.lower() != b"content-length"]
+    headers.append((b"content-length", str(len(body)).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+async def send_json_error(send, status, detail, headers=()):
+    body = json.dumps({"detail": detail}).encode()
+    await send_response(send, status, [(b"content-type", b"application/json"), *headers], body)
+
+class IdempotencyMiddleware:
+    """Executes a mutating request at most once per Idempotency-Key and replays its response"""
+
+    def __init__(self, app):
+        self.app = app
+        # record id -> (monotonic expiry, fingerprint, response)
+        self.cache = collections.OrderedDict()
+        # record id -> future resolved with the response (None if it was not stored)
+        self.in_flight = {}
+
+    def cached(self, record_id):
+        entry = self.cache.get(record_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self.cache[record_id]
+            return None
+        self.cache.move_to_end(record_id)
+        return entry[1], entry[2]
+
+    def remember(self, record_id, fingerprint, response):
+        self.cache[record_id] = (time.monotonic() + IDEMPOTENCY_TTL_HOURS * 3600, fingerprint, response)
+        self.cache.move_to_end(record_id)
+        while len(self.cache) > IDEMPOTENCY_CACHE_SIZE:
+            self.cache.popitem(last=False)
+
+    async def claim(self, record_id, fingerprint):
+        """Claim the key for this request; returns the existing record if another request owns it"""
+        now = datetime.now(timezone.utc)
+        lease = {
+            "status": "processing",
+            "fingerprint": fingerprint,
+            "locked_until": now + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS),
+            "expires_at": now + timedelta(hours=IDEMPOTENCY_TTL_HOURS),
+        }
+        with pymongo.timeout(IDEMPOTENCY_DB_TIMEOUT_SECONDS):
+            try:
+                await db.idempotency_keys.insert_one({"_id": record_id, **lease})
+                return None
+            except DuplicateKeyError:
+                existing = await db.idempotency_keys.find_one({"_id": record_id})
+            if existing is None or existing["status"] != "processing" or as_utc_datetime(existing["locked_until"]) > now:
+                return existing
+            # The request that held the key never finished; take over its lease
+            taken = await db.idempotency_keys.find_one_and_update(
+                {"_id": record_id, "status": "processing", "locked_until": existing["locked_until"]},
+                {"$set": lease},
+            )
+            return None if taken else await db.idempotency_keys.find_one({"_id": record_id})
+
+    async def replay(self, send, fingerprint, stored_fingerprint, response):
+        if fingerprint != stored_fingerprint:
+            await send_json_error(send, 422, "Idempotency-Key was already used for a different request")
+            return
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in response["headers"]]
+        headers.append((b"idempotent-replayed", b"true"))
+        await send_response(send, response["status"], headers, bytes(response["body"]))
+
+    async def __call__(self, scope, receive, send):
+        key = dict(scope.get("headers", [])).get(b"idempotency-key") if scope["type"] == "http" else None
+        if key is None or scope["method"] not in IDEMPOTENCY_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        key = key.decode("latin-1").strip()
+        if not key or len(key) > IDEMPOTENCY_MAX_KEY_LENGTH:
+            await send_json_error(send, 400, f"Idempotency-Key must be 1 to {IDEMPOTENCY_MAX_KEY_LENGTH} characters")
+            return
+
+        body = await read_request_body(receive)
+        query = scope.get("query_string", b"")
+        fingerprint = hashlib.sha256(query + b"\0" + body).hexdigest()
+        target = f"{scope['path']}?{query.decode('latin-1')}" if query else scope["path"]
+        record_id = f"{scope['method']} {target} {key}"
+
+        # Fast path: answered by this process already, or being answered right now
+        if record_id in self.in_flight:
+            await asyncio.shield(self.in_flight[record_id])
+        cached = self.cached(record_id)
+        if cached:
+            await self.replay(send, fingerprint, *cached)
+            return
+
+        try:
+            existing = await self.claim(record_id, fingerprint)
+        except (PyMongoError, DatabaseUnavailable) as e:
+            # Without the collection only this process is protected
+            logger.warning(f"Idempotency record unavailable for {record_id}: {e}")
+            existing = None
+        if existing is not None:
+            if existing["status"] == "completed":
+                self.remember(record_id, existing["fingerprint"], existing["response"])
+                await self.replay(send, fingerprint, existing["fingerprint"], existing["response"])
+            else:
+                await send_json_error(send, 409, "A request with this Idempotency-Key is still being processed",
+                                      [(b"retry-after", b"1")])
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[record_id] = future
+        response = {"status": 500, "headers": [], "body": bytearray()}
+
+        async def receive_body():
+            nonlocal body
+            if body is not None:
+                message = {"type": "http.request", "body": body, "more_body": False}
+                body = None
+                return message
+            return await receive()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [[name.decode("latin-1"), value.decode("latin-1")]
+                                       for name, value in message.get("headers", [])
+                                       if name.lower() in IDEMPOTENCY_STORED_HEADERS]
+            elif message["type"] == "http.response.body":
+                response["body"].extend(message.get("body", b""))
+            await send(message)
+
+        stored = None
+        try:
+            await self.app(scope, receive_body, send_wrapper)
+            if response["status"] < 500 and response["status"] != 429 and len(response["body"]) <= IDEMPOTENCY_MAX_RESPONSE_BYTES:
+                stored = {"status": response["status"], "headers": response["headers"], "body": bytes(response["body"])}
+        finally:
+            if stored is not None:
+                self.remember(record_id, fingerprint, stored)
+            try:
+                # Waiters woken before the record is released would find it still processing
+                await self.persist(record_id, stored)
+            finally:
+                del self.in_flight[record_id]
+                future.set_result(stored)
+
+    async def persist(self, record_id, stored):
+        """Store the response for replays, or release the key so the request can be retried"""
+        try:
+            with pymongo.timeout(IDEMPOTENCY_DB_TIMEOUT_SECONDS):
+                if stored is not None:
+                    await db.idempotency_keys.update_one(
+                        {"_id": record_id}, {"$set": {"status": "completed", "response": stored}})
+                else:
+                    await db.idempotency_keys.delete_one({"_id": record_id, "status": "processing"})
+        except (PyMongoError, DatabaseUnavailable) as e:
+            logger.warning(f"Could not update idempotency record {record_id}: {e}")
+
+app.add_middleware(IdempotencyMiddleware)
+
+# Graceful shutdown
+# When SIGTERM arrives the launcher (launcher.py) marks the instance as draining while its
+# listener is still open: readiness turns 503 so the load balancer stops routing here, and new
+# requests get a 503 with Retry-After and `Connection: close` (health probes excepted). After
+# the launcher's shutdown delay uvicorn closes the listener and gives the requests already
+# running its graceful timeout to finish. Only then does lifespan shutdown run: background
+# writes and the audit queue are flushed within AUDIT_SHUTDOWN_TIMEOUT_SECONDS and the MongoDB
+# client is closed last, so a checkout in progress is never cut off mid-write.
+# SHUTDOWN_DRAIN_TIMEOUT_SECONDS is the budget for all of it, from SIGTERM to exit.
+SHUTDOWN_DRAIN_TIMEOUT_SECONDS = float(os.environ.get('SHUTDOWN_DRAIN_TIMEOUT_SECONDS', '25'))
+DRAIN_EXEMPT_PATHS = {"/health", "/health/live", "/health/ready", "/metrics"}
+
+class DrainMiddleware:
+    """Turns new requests away while the instance shuts down"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and shutdown_coordinator.draining and scope["path"] not in DRAIN_EXEMPT_PATHS:
+            await send_json_error(send, 503, "Server is shutting down, please retry",
+                                  [(b"retry-after", b"1"), (b"connection", b"close")])
+            return
+        await self.app(scope, receive, send)
+
+class ShutdownCoordinator:
+    def __init__(self):
+        self.draining = False
+
+    def begin(self):
+        """Stop taking requests; called from the signal handler, and again by lifespan shutdown"""
+        if not self.draining:
+            logger.info("Draining: new requests are turned away")
+        self.draining = True
+
+shutdown_coordinator = ShutdownCoordinator()
+
+app.add_middleware(DrainMiddleware)
+
+# Request metrics (outermost, so CORS handling is included in the timings)
+class MetricsMiddleware:
+    """Records request count, latency, in-flight requests and response size per route"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        started = time.perf_counter()
+        response = {"status": 500, "size": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["size"] += len(message.get("body", b""))
+            await send(message)
+
+        http_requests_in_flight.inc(method)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.dec(method)
+            # FastAPI stores the matched route in the scope; unmatched paths share one label
+            route = scope.get("route")
+            route_path = route.path if route is not None else "unmatched"
+            http_requests_total.inc(method, route_path, str(response["status"]))
+            http_request_duration.observe(time.perf_counter() - started, method, route_path)
+            http_response_size.observe(response["size"], method, route_path)
+
+app.add_middleware(MetricsMiddleware)
+
+# Request context (outermost, so every other layer runs inside it)
+class RequestContextMiddleware:
+    """Makes a RequestContext available to the code handling each HTTP request and returns its X-Request-ID"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        context = RequestContext(scope)
+        token = request_context.set(context)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", context.request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_context.reset(token)
+
+app.add_middleware(RequestContextMiddleware)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    # uvicorn has already waited for the running requests; what is left is flushing
+    shutdown_coordinator.begin()
+    deadline = time.monotonic() + AUDIT_SHUTDOWN_TIMEOUT_SECONDS
+    loop_stall_detector.stop()
+    database_health.stop()
+    revoked_tokens.stop()
+    if _write_back_tasks:
+        await asyncio.wait(list(_write_back_tasks), timeout=max(0.1, deadline - time.monotonic()))
+    await audit_log.stop(max(0.1, deadline - time.monotonic()))
     client.close()
+    logger.info("Shutdown complete")
 
 # Root endpoint
 @app.get("/")
@@ -1497,15 +4408,43 @@ async def root():
         "docs": "/docs"
     }
 
-# Health check endpoint
+# Health check endpoints (cached state only, see DatabaseHealth)
 @app.get("/health")
 async def health_check():
-    try:
-        # Test database connection
-        await db.admin.command('ping')
-        return {"status": "healthy", "database": "connected"}
-    except Exception as e:
-        return {"status": "unhealthy", "database": "disconnected", "error": str(e)}
+    circuit = mongo_guard.breaker.snapshot()
+    database = database_health.snapshot()
+    if database["status"] != "connected":
+        status = "unhealthy"
+    else:
+        status = "healthy" if circuit["state"] == "closed" else "degraded"
+    return {
+        "status": status,
+        "database": database["status"],
+        "database_check": database,
+        "circuit": circuit,
+        "admission": {route_class: gate.snapshot() for route_class, gate in admission_gates.items()},
+        "startup": startup_state,
+    }
+
+@app.get("/health/live")
+async def liveness():
+    """The process is up and its event loop answers"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    """Whether this instance should receive traffic"""
+    problems = readiness_problems()
+    return JSONResponse(status_code=503 if problems else 200, content={
+        "status": "not_ready" if problems else "ready",
+        "problems": problems,
+        "startup": startup_state,
+    })
+
+# Prometheus metrics endpoint
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # For Vercel deployment
 handler = app
@@ -0,0 +1,72 @@
+"""
+Shared fixtures for the backend tests.
+
+The app runs in-process against the MongoDB server at TEST_MONGO_URL, using a
+throwaway database that is dropped at the end of the session. Tests that need
+the database are skipped when no server is reachable.
+"""
+
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+BACKEND_DIR = Path(__file__).resolve().parents[1] / "backend"
+TEST_MONGO_URL = os.environ.get("TEST_MONGO_URL", "mongodb://localhost:27017")
+TEST_DB_NAME = f"hotel_management_test_{uuid.uuid4().hex[:8]}"
+
+# Must be set before server.py is imported: it reads its configuration at import time
+os.environ["MONGO_URL"] = TEST_MONGO_URL
+os.environ["DB_NAME"] = TEST_DB_NAME
+os.environ["DB_DEBUG"] = "true"
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def mongo_available():
+    try:
+        MongoClient(TEST_MONGO_URL, serverSelectionTimeoutMS=1000).admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+
+
+@pytest.fixture(scope="session")
+def mongo():
+    """Synchronous client on the test database"""
+    if not mongo_available():
+        pytest.skip(f"MongoDB is not reachable at {TEST_MONGO_URL}")
+    client = MongoClient(TEST_MONGO_URL)
+    yield client[TEST_DB_NAME]
+    client.drop_database(TEST_DB_NAME)
+    client.close()
+
+
+@pytest.fixture(scope="session")
+def api(mongo):
+    """TestClient for the app, with startup (seeding, indexes, migrations) already run"""
+    from fastapi.testclient import TestClient
+
+    import server
+
+    with TestClient(server.app) as client:
+        yield client
+
+
+@pytest.fixture
+def assert_db_budget():
+    """Check a response's X-DB-Commands header against the route's budget in DB_QUERY_BUDGETS"""
+    import server
+
+    def check(response, method, route):
+        assert response.status_code < 400, response.text
+        budget = server.DB_QUERY_BUDGETS[(method, route)]
+        commands = int(response.headers["x-db-commands"])
+        assert commands <= budget, f"{method} {route} used {commands} MongoDB commands (budget {budget})"
+        assert "x-db-repeated-query" not in response.headers, response.headers["x-db-repeated-query"]
+        return commands
+
+    return check
@@ -0,0 +1,72 @@
+"""
+Admission control per route class, exercised with stand-in handlers (no MongoDB needed).
+"""
+
+import asyncio
+
+import pytest
+
+import server
+
+
+async def hold(gate, release):
+    return await gate.run(release.wait)
+
+
+def test_routes_are_classified():
+    assert server.classify_route("POST", "/api/rooms/{room_id}/checkout") == "critical"
+    assert server.classify_route("GET", "/api/rooms") == "interactive"
+    assert server.classify_route("GET", "/api/reports/revenue") == "analytics"
+    assert server.classify_route("GET", "/api/orders/company-report") == "analytics"
+    assert server.classify_route("GET", "/api/dashboard/stats") == "interactive"
+    assert server.classify_route("GET", "/api/bills/{bill_id}/pdf") == "interactive"
+
+
+def test_full_queue_is_rejected_with_429():
+    async def scenario():
+        gate = server.AdmissionGate("analytics", limit=1, queue_size=1, queue_timeout_ms=1000)
+        release = asyncio.Event()
+        running = asyncio.create_task(hold(gate, release))
+        queued = asyncio.create_task(hold(gate, release))
+        await asyncio.sleep(0)
+        with pytest.raises(server.Overloaded) as rejected:
+            await gate.run(release.wait)
+        release.set()
+        await asyncio.gather(running, queued)
+        return rejected.value, gate
+
+    rejected, gate = asyncio.run(scenario())
+    assert rejected.status_code == 429
+    assert rejected.retry_after >= 1
+    assert (gate.active, len(gate.waiters)) == (0, 0)
+
+
+def test_queue_wait_is_bounded_with_503():
+    async def scenario():
+        gate = server.AdmissionGate("analytics", limit=1, queue_size=5, queue_timeout_ms=20)
+        release = asyncio.Event()
+        running = asyncio.create_task(hold(gate, release))
+        await asyncio.sleep(0)
+        with pytest.raises(server.Overloaded) as rejected:
+            await gate.run(release.wait)
+        release.set()
+        await running
+        # The slot freed by the first request is usable again
+        await gate.run(release.wait)
+        return rejected.value
+
+    assert asyncio.run(scenario()).status_code == 503
+
+
+def test_unlimited_class_never_waits():
+    async def scenario():
+        gate = server.AdmissionGate("critical", limit=0, queue_size=0, queue_timeout_ms=1)
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(hold(gate, release)) for _ in range(50)]
+        await asyncio.sleep(0)
+        active = gate.active
+        release.set()
+        await asyncio.gather(*tasks)
+        return active
+
+    assert asyncio.run(scenario()) == 50
@@ -0,0 +1,162 @@
+"""
+Write-behind audit log: batching, spill file and flush on shutdown, against a stand-in collection.
+"""
+
+import asyncio
+import fcntl
+import json
+import os
+import types
+
+import pytest
+from bson.errors import InvalidDocument
+from pymongo.errors import AutoReconnect
+
+import server
+
+
+class AuditCollection:
+    def __init__(self):
+        self.batches = []
+        self.events = {}
+        self.down = False
+
+    async def insert_many(self, events, ordered=True):
+        if self.down:
+            raise AutoReconnect("injected")
+        if any(isinstance(value, set) for event in events for value in event["details"].values()):
+            raise InvalidDocument("cannot encode object: set")
+        self.batches.append(len(events))
+        self.events.update((event["_id"], event) for event in events)
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    collection = AuditCollection()
+    monkeypatch.setattr(server, "db", types.SimpleNamespace(audit_log=collection))
+    monkeypatch.setattr(server, "AUDIT_FLUSH_INTERVAL_MS", 10)
+    return collection
+
+
+def own_spill(tmp_path):
+    return tmp_path / f"spill.{os.getpid()}.jsonl"
+
+
+def record_many(audit, count):
+    return asyncio.gather(*[audit.record("room.checked_in", "rooms", f"room-{i}") for i in range(count)])
+
+
+def test_events_are_written_in_batches(collection, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "AUDIT_BATCH_SIZE", 4)
+
+    async def scenario():
+        audit = server.AuditLog(str(tmp_path / "spill.jsonl"))
+        audit.start()
+        await record_many(audit, 10)
+        await asyncio.sleep(0.05)
+        await audit.stop()
+
+    asyncio.run(scenario())
+    assert sorted(collection.batches) == [2, 4, 4]
+    assert len(collection.events) == 10
+
+
+def test_unwritten_events_are_spilled_and_replayed_once(collection, tmp_path):
+    spill_file = own_spill(tmp_path)
+
+    async def scenario():
+        audit = server.AuditLog(str(tmp_path / "spill.jsonl"))
+        audit.start()
+        collection.down = True
+        await record_many(audit, 3)
+        await asyncio.sleep(0.05)
+        assert spill_file.exists() and not collection.events
+
+        collection.down = False
+        await record_many(audit, 2)
+        await audit.stop()
+
+    asyncio.run(scenario())
+    assert len(collection.events) == 5
+    assert not spill_file.exists()
+
+
+def test_spill_left_by_a_previous_process_is_replayed_on_start(collection, tmp_path):
+    spill_file = own_spill(tmp_path)
+
+    async def previous_process():
+        collection.down = True
+        audit = server.AuditLog(str(tmp_path / "spill.jsonl"))
+        audit.start()
+        await record_many(audit, 2)
+        await audit.stop()
+
+    async def next_process():
+        collection.down = False
+        audit = server.AuditLog(str(tmp_path / "spill.jsonl"))
+        audit.start()
+        await audit.stop()
+
+    asyncio.run(previous_process())
+    assert spill_file.exists()
+    asyncio.run(next_process())
+    assert len(collection.events) == 2
+    assert not spill_file.exists()
+
+
+def test_full_queue_spills_instead_of_blocking(collection, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "AUDIT_QUEUE_SIZE", 2)
+    monkeypatch.setattr(server, "AUDIT_BACKPRESSURE_TIMEOUT_MS", 1)
+    spill_file = own_spill(tmp_path)
+
+    async def scenario():
+        # Not started: nothing drains the queue
+        audit = server.AuditLog(str(tmp_path / "spill.jsonl"))
+        await record_many(audit, 5)
+        return audit.queue.qsize()
+
+    assert asyncio.run(scenario()) == 2
+    assert len(spill_file.read_text().splitlines()) == 3
+
+
+def spilled_event(event_id):
+    return json.dumps({"_id": event_id, "type": "room.checked_in", "details": {}}) + "\n"
+
+
+def test_spills_of_dead_processes_are_replayed_and_live_ones_left_alone(collection, tmp_path):
+    dead = tmp_path / "spill.1001.jsonl"
+    # A crash mid-append leaves a torn last line
+    dead.write_text(spilled_event("dead-1") + spilled_event("dead-2") + '{"_id": "dead-3", "ty')
+    live = tmp_path / "spill.1002.jsonl"
+    live.write_text(spilled_event("live-1"))
+    live_lock = open(f"{live}.lock", "a")
+    fcntl.flock(live_lock, fcntl.LOCK_EX)
+
+    async def scenario():
+        audit = server.AuditLog(str(tmp_path / "spill.jsonl"))
+        audit.start()
+        await audit.stop()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        live_lock.close()
+    assert set(collection.events) == {"dead-1", "dead-2"}
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["spill.1002.jsonl", "spill.1002.jsonl.lock"]
+
+
+def test_batches_mongodb_cannot_encode_are_spilled_as_json(collection, tmp_path):
+    async def scenario():
+        audit = server.AuditLog(str(tmp_path / "spill.jsonl"))
+        audit.start()
+        await audit.record("room.updated", "rooms", "room-1", {"amenities": {"wifi"}})
+        await asyncio.sleep(0.05)
+        assert own_spill(tmp_path).exists()
+        # The writer survived and replays the spilled event after the next write
+        await record_many(audit, 1)
+        await audit.stop()
+
+    asyncio.run(scenario())
+    assert len(collection.events) == 2
+    replayed, = [event for event in collection.events.values() if event["entity_id"] == "room-1"]
+    assert replayed["details"] == {"amenities": "{'wifi'}"}
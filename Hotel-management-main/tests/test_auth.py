@@ -0,0 +1,116 @@
+"""
+JWT sessions, password hashing and role checks.
+"""
+
+import asyncio
+import threading
+from datetime import timedelta
+
+import bcrypt
+import jwt
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def call_as(token, endpoint):
+    """Run a decorated endpoint as if it handled a request sent with this bearer token"""
+    headers = [(b"authorization", f"Bearer {token}".encode())] if token else []
+    context = server.RequestContext({"method": "GET", "path": "/api/admins", "headers": headers})
+
+    async def scenario():
+        server.request_context.set(context)
+        return await endpoint()
+    return asyncio.run(scenario())
+
+
+@pytest.fixture
+def manager_only(monkeypatch):
+    monkeypatch.setattr(server, "AUTH_ENABLED", True)
+
+    @server.require_permission(server.AdminRole.MANAGER)
+    async def endpoint():
+        return "ok"
+    return endpoint
+
+
+def token_for(role, **claims):
+    token, _ = server.issue_token({"id": "a1", "username": "an", "role": role})
+    if claims:
+        decoded = jwt.decode(token, server.JWT_SECRET, algorithms=[server.JWT_ALGORITHM])
+        token = jwt.encode({**decoded, **claims}, server.JWT_SECRET, algorithm=server.JWT_ALGORITHM)
+    return token
+
+
+def test_roles_at_or_above_the_requirement_pass(manager_only):
+    assert call_as(token_for("manager"), manager_only) == "ok"
+    assert call_as(token_for("admin"), manager_only) == "ok"
+    with pytest.raises(HTTPException) as denied:
+        call_as(token_for("receptionist"), manager_only)
+    assert denied.value.status_code == 403
+
+
+@pytest.mark.parametrize("token", [None, "not-a-jwt", jwt.encode({"sub": "a1", "role": "admin", "jti": "x", "exp": 9999999999}, "a-different-signing-key-of-32-bytes")])
+def test_missing_or_forged_tokens_are_rejected(manager_only, token):
+    with pytest.raises(HTTPException) as denied:
+        call_as(token, manager_only)
+    assert denied.value.status_code == 401
+
+
+def test_expired_and_revoked_tokens_are_rejected(manager_only, monkeypatch):
+    with pytest.raises(HTTPException):
+        call_as(token_for("admin", exp=server.datetime.now(server.timezone.utc) - timedelta(seconds=1)), manager_only)
+
+    token = token_for("admin")
+    assert call_as(token, manager_only) == "ok"
+    monkeypatch.setattr(server.revoked_tokens, "ids", {server.decode_token(token)["jti"]})
+    with pytest.raises(HTTPException):
+        call_as(token, manager_only)
+
+
+def test_enforced_auth_needs_a_shared_secret():
+    assert server.jwt_secret({"AUTH_ENABLED": "true", "JWT_SECRET": "shared"}) == "shared"
+    with pytest.raises(RuntimeError):
+        server.jwt_secret({"AUTH_ENABLED": "true"})
+    # Development: tokens are issued but not enforced, a per-process key will do
+    assert server.jwt_secret({}) != server.jwt_secret({})
+
+
+def test_passwords_are_hashed(monkeypatch):
+    monkeypatch.setattr(server, "BCRYPT_ROUNDS", 4)
+    hashed = asyncio.run(server.hash_password("s3cret"))
+    assert server.is_password_hash(hashed)
+    assert asyncio.run(server.verify_password("s3cret", hashed))
+    assert not asyncio.run(server.verify_password("wrong", hashed))
+    with pytest.raises(ValueError):
+        asyncio.run(server.hash_password("x" * 73))
+
+
+def test_unknown_users_never_hash_on_the_event_loop(monkeypatch):
+    monkeypatch.setattr(server, "BCRYPT_ROUNDS", 4)
+    server.dummy_password_hash.cache_clear()
+    hashed_on = []
+    hashpw = bcrypt.hashpw
+
+    def recording_hashpw(*args):
+        hashed_on.append(threading.current_thread())
+        return hashpw(*args)
+    monkeypatch.setattr(bcrypt, "hashpw", recording_hashpw)
+
+    assert not asyncio.run(server.verify_password("s3cret", None))
+    assert hashed_on and threading.main_thread() not in hashed_on
+    server.dummy_password_hash.cache_clear()
+
+def test_login_issues_a_token_and_rehashes_plaintext_passwords(api, mongo):
+    mongo.admins.insert_one({"id": "legacy-1", "username": "legacy", "password": "plain", "role": "manager"})
+
+    response = api.post("/api/admin/login", json={"username": "legacy", "password": "plain"})
+    assert response.status_code == 200
+    claims = server.decode_token(response.json()["access_token"])
+    assert (claims["sub"], claims["role"]) == ("legacy-1", "manager")
+    assert server.is_password_hash(mongo.admins.find_one({"id": "legacy-1"})["password"])
+
+    assert api.post("/api/admin/login", json={"username": "legacy", "password": "plain"}).status_code == 200
+    assert api.post("/api/admin/login", json={"username": "legacy", "password": "wrong"}).status_code == 401
+    assert api.post("/api/admin/login", json={"username": "nobody", "password": "plain"}).status_code == 401
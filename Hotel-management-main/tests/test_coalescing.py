@@ -0,0 +1,72 @@
+"""
+Single-flight coalescing of hot read endpoints, exercised with stand-in handlers (no MongoDB needed).
+"""
+
+import asyncio
+
+import pytest
+from fastapi.responses import JSONResponse
+
+import server
+
+
+def counting_handler(release, error=None):
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await release.wait()
+        if error:
+            raise error
+        return JSONResponse({"rooms": len(calls)})
+    return compute, calls
+
+
+def test_concurrent_callers_share_one_computation():
+    async def scenario():
+        flight, release = server.SingleFlight(), asyncio.Event()
+        compute, calls = counting_handler(release)
+        callers = [asyncio.create_task(flight.run("rooms", "/api/rooms", compute)) for _ in range(10)]
+        await asyncio.sleep(0)
+        release.set()
+        responses = await asyncio.gather(*callers)
+        # Completed calls are not cached
+        await flight.run("rooms", "/api/rooms", compute)
+        return responses, calls, flight
+
+    responses, calls, flight = asyncio.run(scenario())
+    assert len(calls) == 2
+    assert {response.body for response in responses} == {b'{"rooms":1}'}
+    # Each caller gets its own response and header list
+    assert len({id(response.raw_headers) for response in responses}) == 10
+    assert flight.calls == {}
+
+
+def test_failure_reaches_every_caller():
+    async def scenario():
+        flight, release = server.SingleFlight(), asyncio.Event()
+        compute, calls = counting_handler(release, server.DatabaseUnavailable(3))
+        callers = [asyncio.create_task(flight.run("stats", "/api/dashboard/stats", compute)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(*callers, return_exceptions=True), calls
+
+    results, calls = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(isinstance(result, server.DatabaseUnavailable) for result in results)
+
+
+def test_leader_disconnect_does_not_cancel_followers():
+    async def scenario():
+        flight, release = server.SingleFlight(), asyncio.Event()
+        compute, _ = counting_handler(release)
+        leader = asyncio.create_task(flight.run("rooms", "/api/rooms", compute))
+        follower = asyncio.create_task(flight.run("rooms", "/api/rooms", compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(scenario()).status_code == 200
@@ -0,0 +1,74 @@
+"""
+MongoDB command budgets per route.
+
+Each request is checked against DB_QUERY_BUDGETS through the X-DB-Commands
+header that DB_DEBUG adds, so an endpoint that starts issuing extra queries
+fails here before it reaches production.
+"""
+
+import collections
+
+
+def empty_room(api):
+    rooms = api.get("/api/rooms").json()
+    return next(room for room in rooms if room["status"] == "empty")
+
+
+def test_room_reads(api, assert_db_budget):
+    response = api.get("/api/rooms")
+    assert_db_budget(response, "GET", "/api/rooms")
+
+    room = response.json()[0]
+    assert_db_budget(api.get(f"/api/rooms/{room['id']}/guests"), "GET", "/api/rooms/{room_id}/guests")
+
+
+def test_checkin_and_checkout(api, assert_db_budget):
+    room = empty_room(api)
+    checkin = {
+        "company_name": "Công ty ABC",
+        "guests": [{"name": "Nguyễn Văn An", "id_card": "001090000001"}],
+        "booking_type": "daily",
+        "duration": 2
+    }
+    response = api.post(f"/api/rooms/{room['id']}/checkin-company", json=checkin)
+    assert_db_budget(response, "POST", "/api/rooms/{room_id}/checkin-company")
+
+    assert_db_budget(api.get(f"/api/rooms/{room['id']}/current-cost"), "GET", "/api/rooms/{room_id}/current-cost")
+    assert_db_budget(api.post(f"/api/rooms/{room['id']}/checkout"), "POST", "/api/rooms/{room_id}/checkout")
+
+
+def test_legacy_checkin(api, assert_db_budget):
+    room = empty_room(api)
+    response = api.post(f"/api/rooms/{room['id']}/checkin", json={"guest_name": "Trần Thị Bình", "duration": 3})
+    assert_db_budget(response, "POST", "/api/rooms/{room_id}/checkin")
+    api.post(f"/api/rooms/{room['id']}/checkout")
+
+
+def test_orders(api, assert_db_budget):
+    dish = api.post("/api/dishes", json={"name": "Phở bò", "price": 50000}).json()
+
+    response = api.post("/api/orders", json={"company_name": "Công ty ABC", "dish_id": dish["id"], "quantity": 2})
+    assert_db_budget(response, "POST", "/api/orders")
+    assert_db_budget(api.get("/api/orders", params={"company_name": "ABC"}), "GET", "/api/orders")
+
+
+def test_dashboard_and_reports(api, assert_db_budget):
+    assert_db_budget(api.get("/api/dashboard/stats"), "GET", "/api/dashboard/stats")
+    assert_db_budget(api.get("/api/reports/revenue"), "GET", "/api/reports/revenue")
+    assert_db_budget(api.get("/api/reports/room-occupancy"), "GET", "/api/reports/room-occupancy")
+
+
+def test_budget_report_flags_overruns_and_repeated_queries():
+    import server
+
+    class Context:
+        method = "GET"
+        route = "/api/rooms"
+        db_commands = 4
+        db_time_ms = 1.5
+        db_shapes = collections.Counter({'find rooms {"id": "?"}': 3, "find dishes null": 1})
+
+    report = server.db_budget_report(Context())
+    assert report["budget"] == 1
+    assert report["over_budget"]
+    assert report["repeated"] == {'find rooms {"id": "?"}': 3}
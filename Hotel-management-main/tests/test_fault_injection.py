@@ -0,0 +1,56 @@
+"""
+Fault injection rules, exercised against a stand-in operation (no MongoDB needed).
+"""
+
+import asyncio
+
+import pytest
+from pymongo.errors import AutoReconnect, NotPrimaryError
+
+import server
+
+
+def run(injector, collection, operation, calls):
+    async def operation_method():
+        calls.append(operation)
+        return "result"
+    return asyncio.run(injector.call(collection, operation, operation_method))
+
+
+def test_error_before_the_operation_runs():
+    injector = server.FaultInjector()
+    injector.configure([server.FaultRule(collection="rooms", operation="find_one", error="NotPrimaryError", error_rate=1)])
+    calls = []
+    with pytest.raises(NotPrimaryError):
+        run(injector, "rooms", "find_one", calls)
+    assert calls == []
+    # Other collections and operations are untouched
+    assert run(injector, "orders", "find_one", calls) == "result"
+    assert run(injector, "rooms", "update_one", calls) == "result"
+
+
+def test_drop_after_the_operation_ran():
+    injector = server.FaultInjector()
+    injector.configure([server.FaultRule(operation="update_one", drop_rate=1, remaining=1)])
+    calls = []
+    with pytest.raises(AutoReconnect):
+        run(injector, "rooms", "update_one", calls)
+    assert calls == ["update_one"]
+    # The rule expired after one fault
+    assert run(injector, "rooms", "update_one", calls) == "result"
+    assert injector.injected == {"drop:rooms.update_one": 1}
+
+
+def test_unknown_error_is_rejected():
+    with pytest.raises(ValueError):
+        server.FaultInjector().configure([server.FaultRule(error="Bogus", error_rate=1)])
+
+
+@pytest.mark.parametrize("environ, enabled", [
+    ({"FAULT_INJECTION_ENABLED": "true", "ENVIRONMENT": "staging"}, True),
+    ({"FAULT_INJECTION_ENABLED": "true"}, True),
+    ({"FAULT_INJECTION_ENABLED": "true", "ENVIRONMENT": "production"}, False),
+    ({"ENVIRONMENT": "staging"}, False),
+])
+def test_never_enabled_in_production(environ, enabled):
+    assert server.fault_injection_enabled(environ) is enabled
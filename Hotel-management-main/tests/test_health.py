@@ -0,0 +1,71 @@
+"""
+Liveness and readiness probes, answered from cached state (no MongoDB needed).
+"""
+
+import asyncio
+import time
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def started(monkeypatch):
+    monkeypatch.setitem(server.startup_state, "completed", True)
+    monkeypatch.setitem(server.startup_state, "tasks", {"ensure_indexes": {"status": "ok", "duration_ms": 1.0}})
+    health = server.DatabaseHealth()
+    health.status, health.checked_monotonic = "connected", time.monotonic()
+    monkeypatch.setattr(server, "database_health", health)
+    return health
+
+
+def test_ready_once_started_and_connected(started):
+    response = asyncio.run(server.readiness())
+    assert response.status_code == 200
+
+
+def test_not_ready_during_startup(started, monkeypatch):
+    monkeypatch.setitem(server.startup_state, "completed", False)
+    response = asyncio.run(server.readiness())
+    assert response.status_code == 503
+    assert b"startup tasks are still running" in response.body
+
+
+def test_failed_startup_task_is_not_ready(started):
+    server.startup_state["tasks"]["run_pending_migrations"] = {"status": "failed", "duration_ms": 1.0}
+    assert server.readiness_problems() == ["startup task run_pending_migrations failed"]
+
+
+def test_stale_or_failed_database_check_is_not_ready(started):
+    started.checked_monotonic -= 3 * server.HEALTH_CHECK_INTERVAL_SECONDS
+    assert server.readiness_problems() == ["database is stale"]
+
+    started.status, started.checked_monotonic = "disconnected", time.monotonic()
+    assert server.readiness_problems() == ["database is disconnected"]
+
+
+def test_liveness_needs_nothing(monkeypatch):
+    monkeypatch.setattr(server, "database_health", server.DatabaseHealth())
+    assert asyncio.run(server.liveness()) == {"status": "alive"}
+
+
+def test_poll_survives_unexpected_errors(monkeypatch):
+    monkeypatch.setattr(server, "HEALTH_CHECK_INTERVAL_SECONDS", 0.01)
+    health = server.DatabaseHealth()
+    checks = []
+
+    async def check():
+        checks.append(1)
+        if len(checks) == 1:
+            raise RuntimeError("not a driver error")
+        health.status, health.checked_monotonic = "connected", time.monotonic()
+    health.check = check
+
+    async def scenario():
+        health.start()
+        await asyncio.sleep(0.05)
+        health.stop()
+    asyncio.run(scenario())
+    assert len(checks) > 1
+    assert health.connected()
@@ -0,0 +1,93 @@
+"""
+Idempotency-Key handling on mutating endpoints.
+"""
+
+import asyncio
+import uuid
+
+import httpx
+import pytest
+
+import server
+
+
+def test_retried_checkout_creates_one_bill(api, mongo):
+    room = next(room for room in api.get("/api/rooms").json() if room["status"] == "empty")
+    checkin = {"company_name": "Công ty ABC", "guests": [{"name": "Nguyễn Văn An"}], "booking_type": "daily"}
+    assert api.post(f"/api/rooms/{room['id']}/checkin-company", json=checkin).status_code == 200
+
+    bills_before = mongo.bills.count_documents({})
+    headers = {"Idempotency-Key": str(uuid.uuid4())}
+    first = api.post(f"/api/rooms/{room['id']}/checkout", headers=headers)
+    retry = api.post(f"/api/rooms/{room['id']}/checkout", headers=headers)
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json() == first.json()
+    assert mongo.bills.count_documents({}) == bills_before + 1
+
+
+def test_key_reused_for_a_different_order(api):
+    dish = api.post("/api/dishes", json={"name": "Phở bò", "price": 50000}).json()
+    headers = {"Idempotency-Key": str(uuid.uuid4())}
+    order = {"company_name": "Công ty ABC", "dish_id": dish["id"], "quantity": 2}
+
+    first = api.post("/api/orders", json=order, headers=headers)
+    assert first.status_code == 200
+    assert api.post("/api/orders", json=order, headers=headers).json()["id"] == first.json()["id"]
+    assert api.post("/api/orders", json={**order, "quantity": 3}, headers=headers).status_code == 422
+
+
+@pytest.fixture
+def middleware():
+    """IdempotencyMiddleware over a stand-in app, with its MongoDB records kept in a dict"""
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append(scope["query_string"])
+        call = len(calls)
+        await asyncio.sleep(0.05)
+        status = 500 if call == 1 and scope["path"] == "/api/flaky" else 200
+        await send({"type": "http.response.start", "status": status, "headers": []})
+        await send({"type": "http.response.body", "body": str(call).encode()})
+
+    middleware = server.IdempotencyMiddleware(app)
+    records = {}
+
+    async def claim(record_id, fingerprint):
+        if record_id in records:
+            return records[record_id]
+        records[record_id] = {"status": "processing", "fingerprint": fingerprint}
+        return None
+
+    async def persist(record_id, stored):
+        await asyncio.sleep(0.01)
+        if stored is None:
+            del records[record_id]
+        else:
+            records[record_id].update(status="completed", response=stored)
+    middleware.claim, middleware.persist = claim, persist
+    middleware.calls = calls
+    return middleware
+
+
+def send_all(middleware, *requests):
+    async def scenario():
+        transport = httpx.ASGITransport(app=middleware)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*[client.post(url, headers={"Idempotency-Key": "k1"}) for url in requests])
+    return asyncio.run(scenario())
+
+
+def test_query_string_is_part_of_the_request(middleware):
+    first, other_query, same_query = send_all(middleware, "/api/orders?room=1", "/api/orders?room=2", "/api/orders?room=1")
+    assert sorted(middleware.calls) == [b"room=1", b"room=2"]
+    assert same_query.text == first.text
+    assert other_query.text != first.text
+
+
+def test_waiter_retries_after_a_server_error(middleware):
+    failed, retried = send_all(middleware, "/api/flaky", "/api/flaky")
+    assert failed.status_code == 500
+    assert retried.status_code == 200
+    assert len(middleware.calls) == 2
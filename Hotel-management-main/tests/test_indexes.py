@@ -0,0 +1,60 @@
+"""
+Index rebuilds racing with other processes, against a stand-in collection (no MongoDB needed).
+"""
+
+import asyncio
+
+import pytest
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+import server
+
+INDEX = IndexModel([("number", ASCENDING)], name="number_1", unique=True)
+
+
+class RacedCollection:
+    """Sees the old non-unique index, but another process drops and recreates it first"""
+
+    def __init__(self, create_error=None):
+        self.create_error = create_error
+        self.created = []
+
+    async def index_information(self):
+        return {"number_1": {"key": [("number", 1)]}}
+
+    async def drop_index(self, name):
+        raise OperationFailure(f"index not found with name [{name}]", code=27)
+
+    async def create_indexes(self, indexes):
+        if self.create_error:
+            raise OperationFailure("An existing index has the same name", code=self.create_error)
+        self.created.extend(index.document["name"] for index in indexes)
+
+
+@pytest.fixture
+def rooms(monkeypatch):
+    def install(create_error=None):
+        collection = RacedCollection(create_error)
+        monkeypatch.setattr(server, "db", {"rooms": collection})
+        monkeypatch.setattr(server, "INDEXES", {"rooms": [INDEX]})
+        return collection
+    return install
+
+
+def test_index_dropped_by_another_process(rooms):
+    collection = rooms()
+    asyncio.run(server.ensure_indexes())
+    assert collection.created == ["number_1"]
+
+
+@pytest.mark.parametrize("code", [85, 86])
+def test_index_recreated_by_another_process(rooms, code):
+    rooms(code)
+    asyncio.run(server.ensure_indexes())
+
+
+def test_other_index_failures_still_fail_startup(rooms):
+    rooms(67)
+    with pytest.raises(OperationFailure):
+        asyncio.run(server.ensure_indexes())
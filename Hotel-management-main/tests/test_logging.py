@@ -0,0 +1,47 @@
+"""
+Structured, queued logging with request-id correlation.
+"""
+
+import json
+import logging
+import queue
+import sys
+
+import server
+
+
+def make_record(message="check-in failed", exc_info=None):
+    return logging.LogRecord("server", logging.ERROR, __file__, 1, message, None, exc_info)
+
+
+def test_records_are_json_with_the_traceback():
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        record = make_record(exc_info=sys.exc_info())
+    record.request_id = "req-1"
+
+    entry = json.loads(server.JsonFormatter().format(record))
+    assert (entry["level"], entry["message"], entry["request_id"]) == ("ERROR", "check-in failed", "req-1")
+    assert "ZeroDivisionError" in entry["exception"]
+
+
+def test_records_carry_the_request_id():
+    context = server.RequestContext({"method": "POST", "path": "/api/orders", "headers": [(b"x-request-id", b"from-proxy")]})
+    token = server.request_context.set(context)
+    try:
+        record = make_record()
+        server.RequestLogFilter().filter(record)
+    finally:
+        server.request_context.reset(token)
+    assert (record.request_id, record.method) == ("from-proxy", "POST")
+
+    generated = server.RequestContext({"method": "GET", "path": "/", "headers": [(b"x-request-id", b"x" * 500)]})
+    assert len(generated.request_id) == 32
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = server.NonBlockingQueueHandler(queue.Queue(2))
+    for _ in range(5):
+        handler.handle(make_record())
+    assert (handler.queue.qsize(), handler.dropped) == (2, 3)
@@ -0,0 +1,52 @@
+"""
+Event loop stall detection, with a handler that blocks on time.sleep (no MongoDB needed).
+"""
+
+import asyncio
+import time
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def detector(monkeypatch):
+    monkeypatch.setattr(server, "LOOP_MONITOR_INTERVAL_MS", 20)
+    monkeypatch.setattr(server, "LOOP_STALL_THRESHOLD_MS", 100)
+    return server.LoopStallDetector()
+
+
+async def blocking_handler():
+    time.sleep(0.3)
+
+
+def run_with(detector, handler):
+    async def scenario():
+        detector.start()
+        detector.routes_by_code[blocking_handler.__code__] = "/api/blocking"
+        await asyncio.sleep(0.05)
+        await handler()
+        # Let the monitor wake up late and record what it missed
+        await asyncio.sleep(0.1)
+        detector.stop()
+    asyncio.run(scenario())
+
+
+def test_blocking_sleep_is_recorded_with_its_route(detector):
+    before = server.event_loop_stalls_total.values.get(("/api/blocking",), 0)
+    run_with(detector, blocking_handler)
+
+    stall, = detector.stalls
+    assert stall["route"] == "/api/blocking"
+    assert stall["duration_ms"] >= 200
+    assert any("time.sleep(0.3)" in line for line in stall["stack"])
+    assert server.event_loop_stalls_total.values[("/api/blocking",)] == before + 1
+
+
+def test_awaiting_does_not_count_as_a_stall(detector):
+    async def sleeping_handler():
+        await asyncio.sleep(0.3)
+
+    run_with(detector, sleeping_handler)
+    assert not detector.stalls
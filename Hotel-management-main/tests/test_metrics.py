@@ -0,0 +1,51 @@
+"""
+Request metrics, recorded against a stand-in FastAPI app (no MongoDB needed).
+"""
+
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+
+import server
+
+
+def send(*paths):
+    app = FastAPI()
+
+    @app.get("/api/items/{item_id}")
+    async def item(item_id: str):
+        return {"id": item_id}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=server.MetricsMiddleware(app))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [(await client.get(path)).status_code for path in paths]
+    return asyncio.run(scenario())
+
+
+def count(method, route, status):
+    return server.http_requests_total.values.get((method, route, status), 0)
+
+
+def test_routes_are_labelled_by_template():
+    before = count("GET", "/api/items/{item_id}", "200")
+    assert send("/api/items/1", "/api/items/2") == [200, 200]
+    assert count("GET", "/api/items/{item_id}", "200") == before + 2
+    # One series per route, not per id
+    assert not any(labels[1].startswith("/api/items/") and "{" not in labels[1]
+                   for labels in server.http_requests_total.values)
+
+
+def test_unmatched_paths_share_one_label():
+    before = count("GET", "unmatched", "404")
+    assert send("/scanner/1", "/scanner/2") == [404, 404]
+    assert count("GET", "unmatched", "404") == before + 2
+
+
+def test_latency_histogram_is_rendered_per_route():
+    send("/api/items/3")
+    text = server.render_metrics()
+    assert '# TYPE http_request_duration_seconds histogram' in text
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/api/items/{item_id}",le="+Inf"}' in text
+    assert 'http_requests_in_flight{method="GET"} 0' in text
@@ -0,0 +1,127 @@
+"""
+MongoGuard retries and circuit breaker, exercised against stand-in operations (no MongoDB needed).
+"""
+
+import asyncio
+
+import pytest
+from pymongo.errors import AutoReconnect, DuplicateKeyError, ExecutionTimeout, NetworkTimeout, WaitQueueTimeoutError
+
+import server
+
+
+def flaky(failures, error=AutoReconnect):
+    """Stand-in operation failing `failures` times before succeeding"""
+    calls = []
+
+    async def invoke():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise error("injected")
+        return "result"
+    return invoke, calls
+
+
+@pytest.fixture
+def guard(monkeypatch):
+    monkeypatch.setattr(server, "MONGO_RETRY_BASE_DELAY_MS", 1)
+    return server.MongoGuard()
+
+
+def test_reads_are_retried(guard):
+    invoke, calls = flaky(2)
+    assert asyncio.run(guard.call("rooms", "find_one", invoke)) == "result"
+    assert len(calls) == 3
+
+
+def test_writes_are_not_retried(guard):
+    invoke, calls = flaky(1)
+    with pytest.raises(AutoReconnect):
+        asyncio.run(guard.call("rooms", "update_one", invoke))
+    assert len(calls) == 1
+
+
+def test_request_errors_do_not_count_against_the_database(guard):
+    for _ in range(server.MONGO_CIRCUIT_FAILURE_THRESHOLD + 1):
+        invoke, _ = flaky(1, DuplicateKeyError)
+        with pytest.raises(DuplicateKeyError):
+            asyncio.run(guard.call("admins", "insert_one", invoke))
+    assert guard.breaker.state == "closed"
+
+
+def test_circuit_opens_and_recovers_through_one_probe(guard, monkeypatch):
+    for _ in range(server.MONGO_CIRCUIT_FAILURE_THRESHOLD):
+        invoke, _ = flaky(1)
+        with pytest.raises(AutoReconnect):
+            asyncio.run(guard.call("rooms", "update_one", invoke))
+    assert guard.breaker.state == "open"
+
+    invoke, calls = flaky(0)
+    with pytest.raises(server.DatabaseUnavailable):
+        asyncio.run(guard.call("rooms", "find_one", invoke))
+    assert calls == []
+
+    # Once the reset period is over a single probe goes through and closes the circuit
+    monkeypatch.setattr(guard.breaker, "opened_at", guard.breaker.opened_at - server.MONGO_CIRCUIT_RESET_SECONDS)
+    assert asyncio.run(guard.call("rooms", "find_one", invoke)) == "result"
+    assert guard.breaker.state == "closed"
+
+
+def open_circuit(guard, monkeypatch):
+    """Open the circuit, then let the reset period pass so the next call is the half-open probe"""
+    for _ in range(server.MONGO_CIRCUIT_FAILURE_THRESHOLD):
+        invoke, _ = flaky(1)
+        with pytest.raises(AutoReconnect):
+            asyncio.run(guard.call("rooms", "update_one", invoke))
+    monkeypatch.setattr(guard.breaker, "opened_at", guard.breaker.opened_at - server.MONGO_CIRCUIT_RESET_SECONDS)
+
+
+def test_cancelled_probe_gives_the_slot_back(guard, monkeypatch):
+    open_circuit(guard, monkeypatch)
+
+    async def cancelled_probe():
+        started = asyncio.Event()
+
+        async def hang():
+            started.set()
+            await asyncio.sleep(60)
+        probe = asyncio.create_task(guard.call("rooms", "find_one", hang))
+        await started.wait()
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+    asyncio.run(cancelled_probe())
+
+    invoke, calls = flaky(0)
+    assert asyncio.run(guard.call("rooms", "find_one", invoke)) == "result"
+    assert guard.breaker.state == "closed"
+
+
+def test_unreported_probe_slot_expires(guard, monkeypatch):
+    open_circuit(guard, monkeypatch)
+    assert guard.breaker.allow()
+    assert not guard.breaker.allow()
+    monkeypatch.setattr(guard.breaker, "probe_started", guard.breaker.probe_started - server.MONGO_CIRCUIT_RESET_SECONDS)
+    assert guard.breaker.allow()
+
+
+def test_slow_queries_do_not_open_the_circuit(guard):
+    for _ in range(server.MONGO_CIRCUIT_FAILURE_THRESHOLD + 1):
+        invoke, calls = flaky(1, ExecutionTimeout)
+        with pytest.raises(ExecutionTimeout):
+            asyncio.run(guard.call("rooms", "aggregate", invoke))
+        assert len(calls) == 1
+    assert guard.breaker.state == "closed"
+
+
+@pytest.mark.parametrize("error", [NetworkTimeout, WaitQueueTimeoutError])
+def test_unanswered_operations_open_the_circuit(guard, error):
+    for _ in range(server.MONGO_CIRCUIT_FAILURE_THRESHOLD):
+        invoke, calls = flaky(1, error)
+        with pytest.raises(error):
+            asyncio.run(guard.call("rooms", "find_one", invoke))
+        # Timeouts used up the deadline; they are not retried
+        assert len(calls) == 1
+    assert guard.breaker.state == "open"
+    with pytest.raises(server.DatabaseUnavailable):
+        asyncio.run(guard.call("rooms", "find_one", flaky(0)[0]))
@@ -0,0 +1,68 @@
+"""
+Per-request profiling, exercised against a stand-in app (no MongoDB needed).
+"""
+
+import asyncio
+
+import httpx
+import pytest
+
+import server
+
+TOKEN = "profiling-token"
+PROFILE = {"X-Profile": "1", "X-Profile-Token": TOKEN}
+
+
+async def stand_in(scope, receive, send):
+    await asyncio.sleep(0.1 if scope["path"] == "/api/slow" else 0)
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(server, "PROFILING_TOKEN", TOKEN)
+    monkeypatch.setattr(server, "profiles", server.collections.OrderedDict())
+    app = server.RequestContextMiddleware(server.ProfilingMiddleware(stand_in))
+    return lambda: httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+def get(client, *requests):
+    """Send (path, headers) pairs concurrently, each a little after the previous one"""
+    async def scenario():
+        async with client() as http:
+            async def send(index, path, headers):
+                await asyncio.sleep(index * 0.02)
+                return await http.get(path, headers=headers)
+            return await asyncio.gather(*[send(index, *request) for index, request in enumerate(requests)])
+    return asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("headers", [{}, {"X-Profile": "1"}, {"X-Profile": "1", "X-Profile-Token": "wrong"}])
+def test_profiling_needs_the_token(client, headers):
+    response, = get(client, ("/api/rooms", headers))
+    assert response.status_code == 200
+    assert "x-profile-id" not in response.headers
+    assert not server.profiles
+
+
+def test_profiled_request_gets_a_breakdown(client):
+    response, = get(client, ("/api/rooms", PROFILE))
+    assert response.headers["x-profile-status"] == "isolated"
+    assert "handler;dur=" in response.headers["server-timing"]
+    profile = server.profiles[response.headers["x-profile-id"]]
+    assert profile["isolated"]
+    assert set(profile["breakdown"]) == {"wall_ms", "mongo_ms", "mongo_commands", "validation_ms",
+                                         "serialization_ms", "handler_ms"}
+
+
+def test_not_profiled_while_other_requests_run(client):
+    _, response = get(client, ("/api/slow", {}), ("/api/rooms", PROFILE))
+    assert response.headers["x-profile-status"] == "busy"
+    assert "x-profile-id" not in response.headers
+
+
+def test_overlapping_requests_are_flagged(client):
+    response, _ = get(client, ("/api/slow", PROFILE), ("/api/rooms", {}))
+    assert response.headers["x-profile-status"] == "overlapped"
+    assert not server.profiles[response.headers["x-profile-id"]]["isolated"]
@@ -0,0 +1,197 @@
+"""
+Query-plan regression suite.
+
+Seeds the test database with synthetic data, then runs explain("executionStats")
+on every query shape server.py sends to MongoDB. A plan fails when it is a
+COLLSCAN or examines more than MAX_EXAMINED_RATIO times the documents the query
+actually needs, which is how a missing or unused index shows up.
+
+Shapes that cannot use an index today are marked xfail with the reason, so
+they stay visible in the report. The marks are strict: once a shape is fixed
+its XPASS fails the run until the KNOWN_ISSUES entry is removed.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+MAX_EXAMINED_RATIO = 2
+# Small scans are never worth failing on
+MIN_EXAMINED_ALLOWANCE = 20
+
+NOW = datetime(2026, 6, 15, 12, 0, tzinfo=timezone.utc)
+COMPANIES = ["Công ty ABC", "Công ty Hoàng Long", "Công ty Minh Phát", "Công ty Sao Việt", "Công ty Thành Công",
+             "Công ty An Khang", "Công ty Phú Quý", "Công ty Đại Nam", "Công ty Bình Minh", "Cá nhân"]
+
+REGEX_REASON = "case-insensitive partial-match regex cannot use index bounds"
+FULL_SCAN_REASON = "reads the whole collection by design"
+
+
+def iso(moment):
+    return moment.isoformat()
+
+
+@pytest.fixture(scope="module")
+def seeded(api, mongo):
+    """Synthetic rooms, guests, reservations, orders and bills (indexes come from app startup)"""
+    rooms = [{
+        "id": f"room-{i:04d}",
+        "number": str(1000 + i),
+        "type": "single" if i % 3 else "double",
+        "status": "occupied" if i % 4 == 0 else "empty",
+        "schema_version": 2,
+    } for i in range(300)]
+    guests = [{
+        "id": f"guest-{i:05d}",
+        "name": f"Khách {i}",
+        "created_at": iso(NOW - timedelta(hours=i)),
+        "schema_version": 1,
+    } for i in range(2000)]
+    reservations = [{
+        "id": f"reservation-{i:05d}",
+        "room_id": f"room-{i % 300:04d}",
+        "guest_id": f"guest-{i % 2000:05d}",
+        "start_date": iso(NOW + timedelta(days=i % 90)),
+        "end_date": iso(NOW + timedelta(days=i % 90 + 2)),
+        "status": ["pending", "confirmed", "cancelled", "checked_in"][i % 4],
+        "created_at": iso(NOW - timedelta(minutes=i)),
+        "schema_version": 1,
+    } for i in range(5000)]
+    orders = [{
+        "id": f"order-{i:06d}",
+        "company_name": COMPANIES[i % len(COMPANIES)],
+        "dish_id": f"dish-{i % 40:03d}",
+        "dish_name": f"Món {i % 40}",
+        "quantity": 1 + i % 5,
+        "unit_price": 50000,
+        "total_price": 50000 * (1 + i % 5),
+        "order_date": iso(NOW - timedelta(minutes=15 * i)),
+        "status": "pending",
+        "schema_version": 2,
+    } for i in range(30000)]
+    bills = [{
+        "id": f"bill-{i:05d}",
+        "room_number": str(1000 + i % 300),
+        "cost_calculation": {"total_cost": 500000},
+        "created_at": iso(NOW - timedelta(hours=i)),
+        "schema_version": 2,
+    } for i in range(8000)]
+
+    mongo.rooms.insert_many(rooms)
+    mongo.guests.insert_many(guests)
+    mongo.reservations.insert_many(reservations)
+    mongo.orders.insert_many(orders)
+    mongo.bills.insert_many(bills)
+    mongo.enhanced_bills.insert_many([{"id": bill["id"], "created_at": bill["created_at"]} for bill in bills])
+    mongo.dishes.insert_many([{"id": f"dish-{i:03d}", "name": f"Món {i}", "price": 50000} for i in range(40)])
+    yield mongo
+    for collection in ("rooms", "guests", "reservations", "orders", "bills", "enhanced_bills", "dishes"):
+        mongo[collection].delete_many({"id": {"$regex": "^(room|guest|reservation|order|bill|dish)-"}})
+
+
+def find(collection, filter, sort=None, limit=None):
+    command = {"find": collection, "filter": filter}
+    if sort:
+        command["sort"] = sort
+    if limit:
+        command["limit"] = limit
+    return command, filter, limit
+
+
+def count(collection, filter):
+    return {"count": collection, "query": filter}, filter, None
+
+
+def update(collection, filter):
+    return {"update": collection, "updates": [{"q": filter, "u": {"$set": {"checked": True}}}]}, filter, 1
+
+
+def aggregate(collection, pipeline):
+    match = pipeline[0]["$match"] if "$match" in pipeline[0] else {}
+    return {"aggregate": collection, "pipeline": pipeline, "cursor": {}}, match, None
+
+
+def shapes(server):
+    """Every query shape server.py issues, keyed by a readable name"""
+    today = iso(NOW.replace(hour=0, minute=0, second=0, microsecond=0))
+    month_ago = iso(NOW - timedelta(days=30))
+    week_ago = iso(NOW - timedelta(days=7))
+    return {
+        # Rooms
+        "room by id": find("rooms", {"id": "room-0042"}, limit=1),
+        "room by number": find("rooms", {"number": "1042"}, limit=1),
+        "room update by id": update("rooms", {"id": "room-0042"}),
+        "occupied room count": count("rooms", {"status": "occupied"}),
+        "room list": find("rooms", {}),
+        "room occupancy report": aggregate("rooms", server.room_occupancy_pipeline()),
+        # Guests
+        "guest by id": find("guests", {"id": "guest-00042"}, limit=1),
+        "guest list newest first": find("guests", {}, sort={"created_at": -1}),
+        # Reservations
+        "reservation by id": find("reservations", {"id": "reservation-00042"}, limit=1),
+        "reservation overlap": find("reservations", server.reservation_overlap_filter(
+            "room-0042", NOW + timedelta(days=10), NOW + timedelta(days=12))),
+        "reservation list newest first": find("reservations", {}, sort={"created_at": -1}),
+        # Dishes
+        "dish by id": find("dishes", {"id": "dish-007"}, limit=1),
+        # Orders
+        "order list": find("orders", server.orders_filter(), sort={"order_date": -1}, limit=100),
+        "orders in date range": find("orders", server.orders_filter(week_ago, iso(NOW)), sort={"order_date": -1}, limit=100),
+        "orders by company": find("orders", server.orders_filter(company_name="ABC"), sort={"order_date": -1}, limit=100),
+        "orders by dish": find("orders", server.orders_filter(dish_name="Món 7"), sort={"order_date": -1}, limit=100),
+        "orders today count": count("orders", {"order_date": {"$gte": today}}),
+        "orders today count on created_at": count("orders", {"created_at": {"$gte": today}}),
+        "company order report": aggregate("orders", server.company_report_pipeline("ABC", month_ago, iso(NOW))),
+        "company summary in date range": aggregate("orders", server.companies_summary_pipeline(week_ago, iso(NOW))),
+        "company summary all time": aggregate("orders", server.companies_summary_pipeline()),
+        "ordering companies": aggregate("orders", server.distinct_values_pipeline("company_name")),
+        "ordered dishes": aggregate("orders", server.distinct_values_pipeline("dish_name")),
+        "popular dishes": aggregate("orders", server.popular_dishes_pipeline(10)),
+        # Bills
+        "bill list newest first": find("bills", {}, sort={"created_at": -1}, limit=50),
+        "revenue range": find("bills", {"created_at": server.date_range_filter(month_ago, iso(NOW))}),
+        "bills today": find("bills", {"created_at": {"$gte": today}}),
+        "enhanced bill by id": find("enhanced_bills", {"id": "bill-00042"}, limit=1),
+        "enhanced bill list newest first": find("enhanced_bills", {}, sort={"created_at": -1}, limit=50),
+        # Admins and the migration ledger
+        "admin login": find("admins", {"username": "admin"}, limit=1),
+        "completed migrations": find("migrations", {"status": "completed"}),
+    }
+
+
+KNOWN_ISSUES = {
+    "orders by company": REGEX_REASON,
+    "orders by dish": REGEX_REASON,
+    "company order report": REGEX_REASON,
+    "orders today count on created_at": "GET /api/dashboard counts orders on created_at, which orders do not have",
+    "room list": FULL_SCAN_REASON,
+    "room occupancy report": FULL_SCAN_REASON,
+    "company summary all time": FULL_SCAN_REASON,
+    "ordering companies": FULL_SCAN_REASON,
+    "ordered dishes": FULL_SCAN_REASON,
+    "popular dishes": FULL_SCAN_REASON,
+    "completed migrations": "the ledger holds one document per migration",
+}
+
+SHAPE_NAMES = [
+    pytest.param(name, marks=pytest.mark.xfail(strict=True, reason=KNOWN_ISSUES[name])) if name in KNOWN_ISSUES else name
+    for name in shapes(server)
+]
+
+
+@pytest.mark.parametrize("name", SHAPE_NAMES)
+def test_query_uses_an_index(seeded, name):
+    command, filter, limit = shapes(server)[name]
+    collection = next(iter(command.values()))
+    plan = server.summarize_explain(seeded.command("explain", command, verbosity="executionStats"))
+
+    # Documents the query genuinely needs to look at
+    needed = seeded[collection].count_documents(filter)
+    if limit:
+        needed = min(needed, limit)
+
+    assert not plan["collscan"], f"{name}: COLLSCAN ({plan})"
+    allowed = max(needed * MAX_EXAMINED_RATIO, MIN_EXAMINED_ALLOWANCE)
+    assert plan["docs_examined"] <= allowed, f"{name}: examined {plan['docs_examined']} documents for {needed} needed ({plan})"
@@ -0,0 +1,84 @@
+"""
+replay.py against a stand-in API (no MongoDB needed).
+"""
+
+import argparse
+import asyncio
+import json
+from functools import partial
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+
+import replay
+
+T0 = 1781000000.0  # 2026-06-09 UTC
+
+
+def trace(offset, method, route, path, status, duration, body=None, query=None):
+    return {"t": T0 + offset, "m": method, "r": route, "p": path, "q": query or {}, "b": body, "s": status,
+            "d": duration}
+
+
+@pytest.fixture
+def captures(tmp_path):
+    path = tmp_path / "traffic.log"
+    lines = [
+        json.dumps(trace(0, "GET", "/api/rooms/{room_id}", "/api/rooms/captured-room", 200, 12.5)),
+        "not json",
+        json.dumps(trace(1, "GET", "/metrics", "/metrics", 200, 1.0)),
+        json.dumps(trace(2, "POST", "/api/orders", "/api/orders", 200, 30.0,
+                         body={"company_name": "str", "dish_id": "str", "quantity": "int"})),
+        json.dumps(trace(3, "GET", "/api/rooms/{room_id}", "/api/rooms/other-room", 200, 14.0)),
+        json.dumps(trace(90000, "GET", "/api/rooms", "/api/rooms", 200, 5.0)),
+    ]
+    path.write_text("\n".join(lines) + "\n")
+    return path
+
+
+def stand_in():
+    app = FastAPI()
+    rooms = ["r1", "r2"]
+    received = []
+
+    @app.get("/api/rooms")
+    async def list_rooms():
+        return [{"id": room_id} for room_id in rooms]
+
+    @app.get("/api/rooms/{room_id}")
+    async def get_room(room_id: str):
+        if room_id not in rooms:
+            raise HTTPException(status_code=404)
+        return {"id": room_id}
+
+    @app.post("/api/orders")
+    async def create_order(order: dict):
+        received.append(order)
+        # The replayed dish does not exist on the target
+        raise HTTPException(status_code=404, detail="Dish not found")
+
+    return app, received
+
+
+def test_traces_are_filtered_and_ordered(captures):
+    traces = replay.load_traces([captures], date="2026-06-09")
+    assert [item["p"] for item in traces] == ["/api/rooms/captured-room", "/api/orders", "/api/rooms/other-room"]
+    assert len(replay.load_traces([captures], route_filter="/api/rooms")) == 3
+
+
+def test_replay_reports_status_mismatches(captures, monkeypatch):
+    app, received = stand_in()
+    monkeypatch.setattr(replay.httpx, "AsyncClient", partial(httpx.AsyncClient, transport=httpx.ASGITransport(app=app)))
+    args = argparse.Namespace(target="http://test", speed="max", concurrency=5, timeout=5)
+
+    summary = asyncio.run(replay.replay(replay.load_traces([captures], date="2026-06-09"), args))
+
+    rooms = summary["routes"]["GET /api/rooms/{room_id}"]
+    assert rooms["captured"]["count"] == rooms["replayed"]["count"] == 2
+    # Captured ids were mapped onto rooms that exist on the target
+    assert rooms["status_mismatch"] == 0
+    assert summary["routes"]["POST /api/orders"]["status_mismatch"] == 1
+    # Redacted body values were replaced by placeholders of the captured type
+    assert received == [{"company_name": "replay", "dish_id": "replay", "quantity": 1}]
+    assert summary["meta"]["requests"] == 3
@@ -0,0 +1,92 @@
+"""
+Draining on shutdown, exercised with a stand-in ASGI app behind a real uvicorn server (no MongoDB needed).
+"""
+
+import asyncio
+import signal
+
+import httpx
+import pytest
+import uvicorn
+
+import launcher
+import server
+
+
+@pytest.fixture
+def coordinator(monkeypatch):
+    coordinator = server.ShutdownCoordinator()
+    monkeypatch.setattr(server, "shutdown_coordinator", coordinator)
+    return coordinator
+
+
+async def stand_in(scope, receive, send):
+    """Slow checkout and a readiness probe reporting the drain state"""
+    if scope["path"] == "/api/rooms/r1/checkout":
+        await asyncio.sleep(0.3)
+    body = b"draining" if server.shutdown_coordinator.draining else b"ok"
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": body})
+
+
+def started_server(shutdown_delay):
+    config = uvicorn.Config(server.DrainMiddleware(stand_in), port=0, lifespan="off", log_config=None)
+    instance = launcher.DrainingServer(config, shutdown_delay)
+    # Leave pytest's own signal handlers alone; the test calls handle_exit itself
+    instance.install_signal_handlers = lambda: None
+    return instance
+
+
+def test_new_requests_are_turned_away_once_draining(coordinator):
+    async def scenario():
+        async def app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+        coordinator.begin()
+        transport = httpx.ASGITransport(app=server.DrainMiddleware(app))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            rejected = await client.get("/api/rooms")
+            probe = await client.get("/health/ready")
+        return rejected, probe
+
+    rejected, probe = asyncio.run(scenario())
+    assert rejected.status_code == 503
+    assert rejected.headers["retry-after"] == "1"
+    assert rejected.headers["connection"] == "close"
+    assert probe.status_code == 200
+
+
+def test_sigterm_drains_before_the_listener_closes(coordinator):
+    async def scenario():
+        instance = started_server(shutdown_delay=0.5)
+        serving = asyncio.create_task(instance.serve())
+        while not instance.started:
+            await asyncio.sleep(0.01)
+        port = instance.servers[0].sockets[0].getsockname()[1]
+
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+            checkout = asyncio.create_task(client.get("/api/rooms/r1/checkout"))
+            await asyncio.sleep(0.1)
+            instance.handle_exit(signal.SIGTERM, None)
+            # The listener is still open: readiness says so and new work is refused
+            ready = await client.get("/health/ready")
+            rejected = await client.get("/api/rooms")
+            finished = await checkout
+        stopped_early = serving.done()
+        await asyncio.wait_for(serving, 5)
+        return ready.text, rejected.status_code, finished.status_code, stopped_early
+
+    assert asyncio.run(scenario()) == ("draining", 503, 200, False)
+
+
+def test_sigint_skips_the_delay(coordinator):
+    async def scenario():
+        instance = started_server(shutdown_delay=60)
+        serving = asyncio.create_task(instance.serve())
+        while not instance.started:
+            await asyncio.sleep(0.01)
+        instance.handle_exit(signal.SIGINT, None)
+        await asyncio.wait_for(serving, 5)
+        return coordinator.draining
+
+    assert asyncio.run(scenario())
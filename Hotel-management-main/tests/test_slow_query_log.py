@@ -0,0 +1,76 @@
+"""
+Slow-query log: commands are attributed to the route that issued them, including
+from the executor threads where Motor runs pymongo and its command listeners.
+"""
+
+import asyncio
+import threading
+from types import SimpleNamespace
+
+from motor.frameworks.asyncio import run_on_executor
+
+import server
+
+ROOM_ROUTE = SimpleNamespace(path="/api/rooms/{room_id}")
+
+
+def room_request():
+    return server.RequestContext({"method": "GET", "path": "/api/rooms/r1", "headers": [], "route": ROOM_ROUTE})
+
+
+def command_events(duration_ms):
+    """started/succeeded event pair for a find on rooms"""
+    command = {"find": "rooms", "filter": {"id": "r1"}, "limit": 1, "lsid": {"id": "x"}}
+    started = SimpleNamespace(command_name="find", command=command, database_name="hotel", connection_id=("h", 1),
+                              request_id=7)
+    succeeded = SimpleNamespace(command_name="find", connection_id=("h", 1), request_id=7,
+                                duration_micros=int(duration_ms * 1000), reply={"cursor": {"firstBatch": [{}]}})
+    return started, succeeded
+
+
+def on_motor_executor(context, fn):
+    """Run fn the way Motor runs pymongo calls, from a task handling the given request"""
+    async def scenario():
+        server.request_context.set(context)
+        return await run_on_executor(asyncio.get_running_loop(), fn)
+    return asyncio.run(scenario())
+
+
+def test_request_context_reaches_motor_executor_threads():
+    context = room_request()
+    thread, seen = on_motor_executor(context, lambda: (threading.current_thread(), server.request_context.get()))
+    assert thread is not threading.main_thread()
+    assert seen is context
+
+
+def test_slow_commands_are_attributed_to_the_route():
+    log = server.SlowQueryLog()
+    started, succeeded = command_events(server.SLOW_QUERY_THRESHOLD_MS + 1)
+
+    def run_command():
+        log.started(started)
+        log.succeeded(succeeded)
+    on_motor_executor(room_request(), run_command)
+
+    entry, = log.recent()
+    assert (entry["method"], entry["route"]) == ("GET", "/api/rooms/{room_id}")
+    assert entry["filter_shape"] == {"id": "?"}
+    assert entry["docs_returned"] == 1
+    # The command is kept for explain, never exposed
+    assert "_command" not in entry and "lsid" not in log.get(entry["id"])["_command"]
+
+
+def test_fast_commands_are_not_kept():
+    log = server.SlowQueryLog()
+    started, succeeded = command_events(server.SLOW_QUERY_THRESHOLD_MS / 2)
+    log.started(started)
+    log.succeeded(succeeded)
+    assert log.recent() == []
+
+
+def test_real_commands_carry_their_route(api, monkeypatch):
+    monkeypatch.setattr(server, "SLOW_QUERY_THRESHOLD_MS", 0)
+    room = api.get("/api/rooms").json()[0]
+    assert api.get(f"/api/rooms/{room['id']}/guests").status_code == 200
+    routes = {entry["route"] for entry in server.slow_query_log.recent()}
+    assert "/api/rooms/{room_id}/guests" in routes